@@ -2,8 +2,9 @@
 import argparse
 import pathlib
 import csv
+import datetime
 
-from . import processors, utils, file_utils
+from . import processors, context, runner
 
 
 def get_args():
@@ -30,23 +31,60 @@ def get_args():
         choices={None, '7z', 'bz2', 'gzip'},
         required=False,
         default=None,
-        help='Output compression format.',
+        help='Output compression format. The outputs of extract-snapshot, '
+             'extract-link-snapshot and pipeline --keep-intermediates are '
+             'written uncompressed and then compressed when 7z is used, so '
+             'they need the disk space of the uncompressed output.',
     )
     parser.add_argument(
         '--dry-run', '-n',
         action='store_true',
         help="Don't write any file",
     )
+    parser.add_argument(
+        '--jobs', '-j',
+        dest='file_jobs',
+        type=int,
+        default=1,
+        help='Number of input files processed in parallel, each in a worker '
+             'process with its own cache, the largest first; files writing '
+             'the same outputs are processed one after the other '
+             '(default = 1).',
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Split each input file in this number of shards of whole pages, '
+             'processed in parallel by worker processes; supported by '
+             'extract-snapshot, extract-link-snapshot, match-id and '
+             'filter-field (default = 1).',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=context.CACHE_SIZE,
+        help='Memory bound in MB of the cache of the snapshots and redirects '
+             'loaded for a FILE and reused for the next ones, 0 to disable '
+             '(default = {}).'.format(context.CACHE_SIZE),
+    )
 
-    subparsers = parser.add_subparsers(help='sub-commands help')
+    subparsers = parser.add_subparsers(dest='command',
+                                       help='sub-commands help')
     processors.snapshot_extractor.configure_subparsers(subparsers)
     processors.link_snapshot_extractor.configure_subparsers(subparsers)
     processors.match_id.configure_subparsers(subparsers)
     processors.filter_ngi_keywords.configure_subparsers(subparsers)
     processors.match_ngi_id.configure_subparsers(subparsers)
     processors.redirect_resolver.configure_subparsers(subparsers)
+    processors.batch_redirect_resolver.configure_subparsers(subparsers)
     processors.extraction_comparator.configure_subparsers(subparsers)
     processors.filter_field.configure_subparsers(subparsers)
+    processors.snapshot_at.configure_subparsers(subparsers)
+    processors.link_indexer.configure_subparsers(subparsers)
+    processors.redirect_indexer.configure_subparsers(subparsers)
+    processors.title_indexer.configure_subparsers(subparsers)
+    processors.pipeline.configure_subparsers(subparsers)
 
     parsed_args = parser.parse_args()
     if 'func' not in parsed_args:
@@ -63,23 +101,14 @@ def main():
     if not args.output_dir_path.exists():
         args.output_dir_path.mkdir(parents=True)
 
-    for input_file_path in args.files:
-        utils.log("Analyzing {}...".format(input_file_path))
-
-        dump = file_utils.open_csv_file(str(input_file_path))
-
-        basename = input_file_path.name
-
-        args.func(
-            dump,
-            basename,
-            args,
-        )
+    # shared by the runs over all the input files
+    args.context = context.Context(cache_size=args.cache_size * 1024 * 1024)
 
-        # explicitly close input files
-        dump.close()
+    start_time = datetime.datetime.utcnow()
+    runs = runner.run_files(args)
+    end_time = datetime.datetime.utcnow()
 
-        utils.log("Done Analyzing {}.".format(input_file_path))
+    runner.write_summary(runs, args, start_time, end_time)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+"""State shared by the runs of a processor over the FILE arguments.
+
+__main__ calls the processor once for each input file, with the same
+Context in args.context. Snapshots and redirect histories loaded by a run
+are kept in a cache, so that the next runs that need the same file (e.g.
+many link snapshot chunks of the same date) do not load it again.
+"""
+
+import os
+import sys
+import collections.abc
+import itertools
+
+from typing import Any, Callable, Hashable, Optional
+
+from . import utils
+
+
+# default memory bound of the cache, in MB
+CACHE_SIZE = 1024
+
+# number of items sampled to estimate the size of a container
+SIZE_SAMPLE = 100
+
+
+def approx_size(value: Any) -> int:
+    """Estimate the memory used by value, in bytes.
+
+    The size of a container is estimated from a sample of its items.
+    """
+    size = sys.getsizeof(value)
+
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return size
+
+    if isinstance(value, collections.abc.Mapping):
+        items = list(itertools.islice(value.items(), SIZE_SAMPLE))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(itertools.islice(value, SIZE_SAMPLE))
+    else:
+        return size
+
+    if items:
+        sample = sum(approx_size(item) for item in items)
+        size += sample * len(value) // len(items)
+
+    return size
+
+
+class Context:
+    """Context of a run, with an LRU cache of the loaded files.
+
+    Values are cached by path, modification time of the path and a key;
+    the least recently used ones are dropped when the estimated size of the
+    cache exceeds cache_size (in bytes). A cache_size of 0 disables the
+    cache. Cached values are shared: they must not be modified.
+    """
+
+    def __init__(self, cache_size: int=CACHE_SIZE * 1024 * 1024) -> None:
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cache_used = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def cached(
+            self,
+            path: Any,
+            loader: Callable[[], Any],
+            *key: Hashable) -> Any:
+        """Return the value of loader() for the file at path, from the cache
+           if path has not changed since it was loaded with the same key.
+        """
+        try:
+            mtime = os.stat(str(path)).st_mtime_ns
+        except OSError:
+            # let the loader report missing files
+            return loader()
+
+        cache_key = (os.path.abspath(str(path)), mtime) + key
+        if cache_key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(cache_key)
+            utils.log("Using cached {}".format(path))
+            return self._cache[cache_key][0]
+
+        self.misses += 1
+        value = loader()
+
+        size = approx_size(value)
+        if size <= self.cache_size:
+            self._cache[cache_key] = (value, size)
+            self._cache_used += size
+            while self._cache_used > self.cache_size:
+                _, (_, dropped_size) = self._cache.popitem(last=False)
+                self._cache_used -= dropped_size
+
+        return value
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._cache_used = 0
+
+
+def of(args) -> Context:
+    """Return the context of args, a context without cache if there is none
+       (e.g. for processors called by other processors).
+    """
+    context = getattr(args, 'context', None)
+    if context is None:
+        context = Context(cache_size=0)
+    return context
+
+
+# context of a worker process, shared by the tasks run by the worker
+_worker_context = None
+
+
+def init_worker(cache_size: int) -> None:
+    """Initialize the context of a worker process."""
+    global _worker_context
+    _worker_context = Context(cache_size=cache_size)
+
+
+def worker() -> Optional[Context]:
+    """Return the context of the worker process, if initialized."""
+    return _worker_context
@@ -6,11 +6,10 @@ import bz2
 import gzip
 import codecs
 import subprocess
+import collections
 
 import pathlib
-from typing import IO, Optional, Union
-
-import subprocess
+from typing import IO, Any, Hashable, Iterable, Optional, Union
 
 import compressed_stream as cs
 
@@ -23,6 +22,29 @@ def open_csv_file(path: Union[str, IO]):
     return f
 
 
+def raw_file(fileobj: Any) -> Optional[IO]:
+    """Return the file on disk under a (decompressing) file object, if it
+       can be found.
+
+    Its position is the number of (compressed) bytes read so far.
+    """
+    seen = set()
+    while fileobj is not None and id(fileobj) not in seen:
+        seen.add(id(fileobj))
+        if isinstance(fileobj, io.FileIO):
+            return fileobj
+
+        for attr in ('buffer', 'raw', 'fileobj', '_fp', '_fileobj'):
+            inner = getattr(fileobj, attr, None)
+            if inner is not None:
+                fileobj = inner
+                break
+        else:
+            return None
+
+    return None
+
+
 def compressor_7z(file_path: str):
     """"Return a file-object that compresses data written using 7z."""
     p = subprocess.Popen(
@@ -46,6 +68,171 @@ def output_writer(path: str, compression: Optional[str]):
         return open(path, 'wt', encoding='utf-8')
 
 
+# maximum number of files kept open at the same time by an OutputPool
+MAX_OPEN_FILES = 64
+
+# maximum size (in UTF-8 bytes) of the rows buffered in memory by an
+# OutputPool
+MAX_BUFFER_SIZE = 256 * 1024 * 1024
+
+
+def append_writer(path: str, compression: Optional[str]):
+    """Append data to a (compressed) file.
+
+    gzip and bz2 files are extended with a new compressed stream, which
+    is transparently concatenated when the file is read back. 7z archives
+    can not be extended, so they are not supported.
+    """
+    if compression == 'bz2':
+        return bz2.open(path + '.bz2', 'at', encoding='utf-8')
+    elif compression == 'gzip':
+        return gzip.open(path + '.gz', 'at', encoding='utf-8')
+    elif compression is None:
+        return open(path, 'at', encoding='utf-8')
+    else:
+        raise ValueError("Can not append to files with compression {}"
+                         .format(compression))
+
+
+class OutputPool:
+    """Write CSV rows to many output files keeping a limited number of them
+    open at the same time.
+
+    Rows are buffered in memory, for each output, up to a total of
+    max_buffer bytes of UTF-8 text. When the buffers are full the largest
+    ones are written through at most max_open files, reopened in append mode
+    when needed. 7z outputs can not be appended to: they are written in
+    plain text and compressed, one at a time, when the pool is closed, so
+    the whole uncompressed output is on disk before compression.
+    """
+
+    def __init__(self,
+                 compression: Optional[str],
+                 max_open: int=MAX_OPEN_FILES,
+                 max_buffer: int=MAX_BUFFER_SIZE,
+                 **fmtparams) -> None:
+        self.compression = compression
+        self.max_open = max(max_open, 1)
+        self.max_buffer = max_buffer
+
+        # compression used for the files written by the pool
+        self._file_compression = None if compression == '7z' else compression
+
+        self._paths = {}
+        self._buffers = {}
+        self._sizes = {}
+        self._buffered = 0
+        self._created = set()
+        self._handles = collections.OrderedDict()
+
+        self._line = io.StringIO()
+        self._line_writer = csv.writer(self._line, **fmtparams)
+
+    def add(self, key: Hashable, path: str) -> None:
+        """Add an output file to the pool, path has no compression suffix."""
+        self._paths[key] = path
+        self._buffers[key] = []
+        self._sizes[key] = 0
+
+    def keys(self) -> Iterable[Hashable]:
+        return self._paths.keys()
+
+    def writerow(self, key: Hashable, row: Iterable[Any]) -> None:
+        """Buffer a row for the output identified by key."""
+        self._line_writer.writerow(row)
+        line = self._line.getvalue()
+        self._line.seek(0)
+        self._line.truncate()
+
+        # the budget is in bytes, titles are not ASCII
+        size = len(line.encode('utf-8'))
+        self._buffers[key].append(line)
+        self._sizes[key] += size
+        self._buffered += size
+
+        if self._buffered > self.max_buffer:
+            self._flush_largest()
+
+    def _handle(self, key: Hashable):
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+            return handle
+
+        if len(self._handles) >= self.max_open:
+            _, oldest = self._handles.popitem(last=False)
+            oldest.close()
+
+        if key in self._created:
+            handle = append_writer(self._paths[key], self._file_compression)
+        else:
+            handle = output_writer(self._paths[key], self._file_compression)
+            self._created.add(key)
+
+        self._handles[key] = handle
+        return handle
+
+    def _pending(self, key: Hashable) -> bool:
+        # a key needs to be written if it has buffered rows or if its file
+        # has not been created yet.
+        return bool(self._buffers[key]) or key not in self._created
+
+    def _flush_key(self, key: Hashable) -> None:
+        if not self._pending(key):
+            return
+
+        handle = self._handle(key)
+        handle.write(''.join(self._buffers[key]))
+
+        self._buffered -= self._sizes[key]
+        self._buffers[key] = []
+        self._sizes[key] = 0
+
+    def _flush_largest(self) -> None:
+        # write the largest buffers until at least half of the memory is
+        # released, so that each file is reopened as few times as possible.
+        target = self.max_buffer // 2
+        for key in sorted(self._sizes, key=self._sizes.get, reverse=True):
+            if self._buffered <= target or not self._sizes[key]:
+                break
+            self._flush_key(key)
+
+    def flush(self) -> None:
+        """Write all the buffered rows."""
+        for key in [key for key in self._paths if self._pending(key)]:
+            self._flush_key(key)
+
+    def close(self, compress: bool=True) -> None:
+        """Write all the buffered rows and close the files.
+
+        7z outputs are compressed only if compress is True, otherwise they
+        are left in plain text.
+        """
+        self.flush()
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            handle.close()
+
+        if self.compression == '7z' and compress:
+            for path in self._paths.values():
+                with open(path, 'rb') as infile:
+                    subprocess.run(
+                        ['7z', 'a', '-si', path + '.7z'],
+                        stdin=infile,
+                        stderr=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        check=True,
+                    )
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # do not compress partial outputs when exiting on an exception
+        self.close(compress=exc_type is None)
+
+
 def create_path(path: Union[pathlib.Path, str]):
     """Create a path, which may or may not exist."""
     path = pathlib.Path(path)
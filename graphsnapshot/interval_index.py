@@ -0,0 +1,260 @@
+"""Index and query the validity-interval files written by extract-snapshot.
+
+An interval file has a row for each revision, with the interval
+[valid_from, valid_to) in which the revision is the current revision of its
+page. The rows of a page are consecutive and sorted by valid_from.
+
+The index is a CSV file saved next to the interval file. It splits the
+interval file in blocks of whole pages and stores, for each block, its byte
+offset and length, the first and last page id, the minimum valid_from and
+the maximum valid_to. When a snapshot at a given date is requested only the
+blocks that may contain revisions valid at that date are read.
+
+The index is kept only in memory when it is not to be saved (e.g. in a
+dry run) or when the directory of the interval file is not writable.
+"""
+
+import io
+import os
+import csv
+
+import arrow
+import regex
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+from . import utils
+from . import file_utils as fu
+
+
+# suffix of the index file
+INDEX_SUFFIX = '.index.csv'
+
+# target size (in bytes) of an index block
+BLOCK_SIZE = 1024 * 1024
+
+
+# 0: page_id
+# 1: page_title
+# 2: revision_id
+# 3: revision_parent_id
+# 4: revision_timestamp
+# 5: valid_from
+# 6: valid_to
+VALID_FROM = 5
+VALID_TO = 6
+NSNAPSHOT_COLUMNS = 5
+
+
+# interval file name regex
+#   * enwiki-20180301-pages-meta-history1.xml.features.csv.intervals.csv.gz
+#
+# 1: basename of the input of extract-snapshot
+# 2: ext
+re_intervals = regex.compile(r'(.+)\.intervals\.csv(?:\.(gz|bz2|7z))?$')
+
+
+# - IndexBlock:
+#   - offset
+#   - length
+#   - first_page_id
+#   - last_page_id
+#   - min_from (epoch)
+#   - max_to (epoch, None if some revision in the block is still current)
+IndexBlock = NamedTuple('IndexBlock', [
+    ('offset', int),
+    ('length', int),
+    ('first_page_id', int),
+    ('last_page_id', int),
+    ('min_from', int),
+    ('max_to', Optional[int]),
+])
+
+
+csv_header_index = IndexBlock._fields
+
+
+def is_intervals_file(path: Union[str, os.PathLike]) -> bool:
+    """Return True if path looks like an interval file."""
+    return re_intervals.match(os.path.basename(str(path))) is not None
+
+
+def is_seekable(path: Union[str, os.PathLike]) -> bool:
+    """Return True if the interval file is not compressed."""
+    match = re_intervals.match(os.path.basename(str(path)))
+    return match is not None and match.group(2) is None
+
+
+def snapshot_basename(basename: str, date: arrow.Arrow) -> str:
+    """Return the name of the file written by extract-snapshot for date."""
+    match = re_intervals.match(basename)
+    if match:
+        basename = match.group(1)
+
+    return (basename + '.features.{date}.csv'
+            .format(date=date.format('YYYY-MM-DD')))
+
+
+def index_path(path: Union[str, os.PathLike]) -> str:
+    return str(path) + INDEX_SUFFIX
+
+
+def to_epoch(timestamp: str) -> Optional[int]:
+    """Convert a timestamp from the interval file to an epoch."""
+    if not timestamp:
+        return None
+    return utils.parse_timestamp(timestamp)
+
+
+def build_index(
+        path: Union[str, os.PathLike],
+        block_size: int=BLOCK_SIZE,
+        save: bool=True) -> List[IndexBlock]:
+    """Scan an uncompressed interval file and return its index, written
+       next to the file if save is True.
+    """
+    blocks = []
+
+    offset = 0
+    block = None
+    prev_page_id = None
+    with open(str(path), 'rb') as infile:
+        # skip header
+        offset += len(infile.readline())
+
+        for line in infile:
+            # page_id is the first column, the validity interval the last two
+            page_id = int(line.split(b',', 1)[0])
+            valid_from, valid_to = (line.rstrip(b'\r\n')
+                                    .rsplit(b',', 2)[-2:])
+            valid_from = to_epoch(valid_from.decode('utf-8'))
+            valid_to = to_epoch(valid_to.decode('utf-8'))
+
+            # a new block starts only at a page boundary
+            if block is None or (page_id != prev_page_id and
+                                 block['length'] >= block_size):
+                if block is not None:
+                    blocks.append(IndexBlock(**block))
+                block = {
+                    'offset': offset,
+                    'length': 0,
+                    'first_page_id': page_id,
+                    'last_page_id': page_id,
+                    'min_from': valid_from,
+                    'max_to': valid_to,
+                }
+
+            block['length'] += len(line)
+            block['last_page_id'] = page_id
+            block['min_from'] = min(block['min_from'], valid_from)
+            # max_to is None as soon as a revision is still current
+            if valid_to is None:
+                block['max_to'] = None
+            elif block['max_to'] is not None:
+                block['max_to'] = max(block['max_to'], valid_to)
+
+            prev_page_id = page_id
+            offset += len(line)
+
+    if block is not None:
+        blocks.append(IndexBlock(**block))
+
+    if save:
+        try:
+            with open(index_path(path), 'wt', encoding='utf-8') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(csv_header_index)
+                for block in blocks:
+                    writer.writerow(block)
+        except OSError as err:
+            utils.log("Could not save the index of {}: {}"
+                      .format(path, err))
+
+    return blocks
+
+
+def read_index(
+        path: Union[str, os.PathLike],
+        save: bool=True) -> List[IndexBlock]:
+    """Read the index of an interval file, building it if it is missing or
+       older than the interval file; a built index is saved if save is True.
+    """
+    ipath = index_path(path)
+    if not os.path.exists(ipath) or \
+            os.path.getmtime(ipath) < os.path.getmtime(str(path)):
+        return build_index(path, save=save)
+
+    blocks = []
+    with open(ipath, 'rt', encoding='utf-8') as infile:
+        reader = csv.reader(infile)
+
+        # skip header
+        next(reader, None)
+
+        for row in reader:
+            blocks.append(IndexBlock(int(row[0]),
+                                     int(row[1]),
+                                     int(row[2]),
+                                     int(row[3]),
+                                     int(row[4]),
+                                     int(row[5]) if row[5] else None,
+                                     ))
+
+    return blocks
+
+
+def select_blocks(
+        blocks: List[IndexBlock],
+        date: arrow.Arrow) -> List[IndexBlock]:
+    """Select the blocks that may contain revisions valid at date."""
+    epoch = date.timestamp
+    return [block for block in blocks
+            if block.min_from <= epoch and
+            (block.max_to is None or block.max_to > epoch)]
+
+
+def is_valid(row: List[str], epoch: int) -> bool:
+    """Return True if the revision in row is current at epoch."""
+    valid_from = to_epoch(row[VALID_FROM])
+    if valid_from > epoch:
+        return False
+
+    valid_to = to_epoch(row[VALID_TO])
+    return valid_to is None or valid_to > epoch
+
+
+def read_blocks(
+        path: Union[str, os.PathLike],
+        blocks: List[IndexBlock]) -> Iterator[List[str]]:
+    """Read the rows contained in the given blocks."""
+    with open(str(path), 'rb') as infile:
+        for block in blocks:
+            infile.seek(block.offset)
+            data = infile.read(block.length).decode('utf-8')
+            yield from csv.reader(io.StringIO(data))
+
+
+def read_snapshot(
+        path: Union[str, os.PathLike],
+        date: arrow.Arrow,
+        save_index: bool=True) -> Iterator[List[str]]:
+    """Yield the rows of the snapshot at date, without header.
+
+    The rows are the same that extract-snapshot writes in the file for date.
+    Uncompressed interval files are read through their index, which is
+    built if needed and saved if save_index is True; compressed ones are
+    scanned from the beginning.
+    """
+    epoch = date.timestamp
+
+    if is_seekable(path):
+        blocks = select_blocks(read_index(path, save=save_index), date)
+        rows = read_blocks(path, blocks)
+    else:
+        rows = csv.reader(fu.open_csv_file(str(path)))
+
+        # skip header
+        next(rows, None)
+
+    for row in rows:
+        if is_valid(row, epoch):
+            yield row[:NSNAPSHOT_COLUMNS]
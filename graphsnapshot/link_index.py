@@ -0,0 +1,231 @@
+"""Index link dumps so that the revisions not in a snapshot can be skipped.
+
+An indexed link dump is a gzip file made of many gzip members: the first
+member has the header, each of the others a block of consecutive lines.
+Blocks are split only between revisions, so that the lines of a revision are
+always in the same block. The blocks are made of the bytes of the link dump,
+line endings included, so the file can be read as a plain gzip file in place
+of the link dump.
+
+The index is a CSV file saved next to the link dump. It has a row for each
+run of lines of a page inside a block, with the byte offset and length of the
+block, the page id and the minimum and maximum revision id of the run. When
+a snapshot is extracted only the blocks that contain some of its revisions
+are decompressed.
+"""
+
+import io
+import os
+import csv
+import gzip
+import zlib
+import itertools
+
+import regex
+from typing import IO, Iterable, Iterator, List, NamedTuple, Union
+
+from . import utils
+
+
+# suffix of the index file
+INDEX_SUFFIX = '.index.csv'
+
+# target size (in bytes) of the uncompressed data of a block
+BLOCK_SIZE = 256 * 1024
+
+# gzip compression level of the blocks
+COMPRESSLEVEL = 6
+
+# maximum size (in bytes) of the adjacent blocks read at once
+MAX_READ_SIZE = 16 * 1024 * 1024
+
+
+# link dump name regex
+#   * enwiki-20180301-pages-meta-history1.xml.links.csv.7z
+#
+# 1: basename without the compression extension
+# 2: ext
+re_compressed = regex.compile(r'(.+?)(?:\.(gz|bz2|7z))?$')
+
+
+# page id and revision id of a line of the link dump
+splitline_re = regex.compile(rb'''^([0-9]{2,}),.+?,([0-9]+),''')
+
+
+# - IndexEntry:
+#   - offset
+#   - length
+#   - page_id
+#   - min_revision_id
+#   - max_revision_id
+IndexEntry = NamedTuple('IndexEntry', [
+    ('offset', int),
+    ('length', int),
+    ('page_id', int),
+    ('min_revision_id', int),
+    ('max_revision_id', int),
+])
+
+
+csv_header_index = IndexEntry._fields
+
+
+def indexed_basename(basename: str) -> str:
+    """Return the name of the indexed copy of a link dump."""
+    return re_compressed.match(basename).group(1) + '.gz'
+
+
+def index_path(path: Union[str, os.PathLike]) -> str:
+    return str(path) + INDEX_SUFFIX
+
+
+def build(
+        lines: Iterable[bytes],
+        outfile: IO[bytes],
+        block_size: int=BLOCK_SIZE) -> List[IndexEntry]:
+    """Write the lines of a link dump, read as bytes, to outfile as gzip
+       blocks and return the index of the blocks.
+    """
+    entries = []
+
+    lines = iter(lines)
+    header = next(lines, b'')
+    offset = outfile.write(gzip.compress(header,
+                                         compresslevel=COMPRESSLEVEL,
+                                         mtime=0))
+
+    block = []
+    block_length = 0
+    # runs of the block: [page_id, min_revision_id, max_revision_id]
+    runs = []
+
+    def write_block():
+        nonlocal offset
+        length = outfile.write(gzip.compress(b''.join(block),
+                                             compresslevel=COMPRESSLEVEL,
+                                             mtime=0))
+        for page_id, min_revision_id, max_revision_id in runs:
+            entries.append(IndexEntry(offset,
+                                      length,
+                                      page_id,
+                                      min_revision_id,
+                                      max_revision_id))
+        offset += length
+
+    prev_revision = None
+    for data in lines:
+        revmatch = splitline_re.match(data)
+        if revmatch is not None:
+            page_id = int(revmatch.group(1))
+            revision_id = int(revmatch.group(2))
+
+            # a new block starts only at a revision boundary
+            if block_length >= block_size and \
+                    (page_id, revision_id) != prev_revision:
+                write_block()
+                block = []
+                block_length = 0
+                runs = []
+
+            if runs and runs[-1][0] == page_id:
+                runs[-1][1] = min(runs[-1][1], revision_id)
+                runs[-1][2] = max(runs[-1][2], revision_id)
+            else:
+                runs.append([page_id, revision_id, revision_id])
+
+            prev_revision = (page_id, revision_id)
+
+        # lines that can not be split stay with the previous ones
+        block.append(data)
+        block_length += len(data)
+
+    if block:
+        write_block()
+
+    return entries
+
+
+def write_index(
+        path: Union[str, os.PathLike],
+        entries: Iterable[IndexEntry]) -> None:
+    """Write the index of the indexed link dump at path."""
+    with open(index_path(path), 'wt', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(csv_header_index)
+        for entry in entries:
+            writer.writerow(entry)
+
+
+def read_index(path: Union[str, os.PathLike]) -> List[IndexEntry]:
+    """Read the index of the indexed link dump at path."""
+    ipath = index_path(path)
+    if not os.path.exists(ipath):
+        raise ValueError("Missing index {} for link dump {}, "
+                         "build it with index-links".format(ipath, path))
+
+    with open(ipath, 'rt', encoding='utf-8') as infile:
+        reader = csv.reader(infile)
+
+        # skip header
+        next(reader, None)
+
+        return [IndexEntry(*(int(value) for value in row))
+                for row in reader]
+
+
+def select_blocks(
+        entries: List[IndexEntry],
+        pages_revisions: utils.IntMultiMap) -> List[IndexEntry]:
+    """Select the blocks that contain some of the revisions of
+       pages_revisions, a mapping from page ids to revision ids.
+
+    Only the offset and length of the returned entries are meaningful.
+    """
+    blocks = []
+    for _, block_entries in itertools.groupby(entries,
+                                              key=lambda e: e.offset):
+        block_entries = list(block_entries)
+        for entry in block_entries:
+            revisions = pages_revisions.get(entry.page_id, ())
+            if any(entry.min_revision_id <= revision_id
+                   <= entry.max_revision_id for revision_id in revisions):
+                blocks.append(block_entries[0])
+                break
+
+    return blocks
+
+
+def read_lines(
+        path: Union[str, os.PathLike],
+        blocks: List[IndexEntry]) -> Iterator[str]:
+    """Yield the header and the lines contained in the given blocks."""
+    with open(str(path), 'rb') as infile:
+        # the header is the first member
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        header = b''
+        while not decompressor.eof:
+            chunk = infile.read(io.DEFAULT_BUFFER_SIZE)
+            if not chunk:
+                break
+            header += decompressor.decompress(chunk)
+        # lines are read as from the link dump, with universal newlines
+        yield from io.StringIO(header.decode('utf-8'), newline=None)
+
+        # adjacent blocks are read together
+        start = None
+        length = 0
+        for block in itertools.chain(blocks, [None]):
+            if block is not None and start is not None and \
+                    start + length == block.offset and \
+                    length + block.length <= MAX_READ_SIZE:
+                length += block.length
+                continue
+
+            if start is not None:
+                infile.seek(start)
+                data = gzip.decompress(infile.read(length)).decode('utf-8')
+                yield from io.StringIO(data, newline=None)
+
+            if block is not None:
+                start = block.offset
+                length = block.length
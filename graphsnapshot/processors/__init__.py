@@ -7,4 +7,10 @@ from . import (
     redirect_resolver,
     extraction_comparator,
     filter_field,
+    snapshot_at,
+    link_indexer,
+    redirect_indexer,
+    batch_redirect_resolver,
+    title_indexer,
+    pipeline,
 )
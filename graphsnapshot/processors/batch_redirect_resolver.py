@@ -0,0 +1,213 @@
+"""
+Resolve redirects in many snapshots with a single pass over the redirect
+history.
+
+The output format is csv, the same of resolve-redirect, and each snapshot is
+resolved with the same redirects that resolve-redirect reads for its date:
+for each page, the last revision not after the date.
+"""
+
+import os
+import csv
+import glob
+import tempfile
+import concurrent.futures
+
+import arrow
+import numpy
+import regex as re
+from typing import Iterable, Iterator, List, Mapping, Tuple
+
+from .. import utils
+from .. import file_utils as fu
+from .. import redirect_index
+from . import redirect_resolver
+
+
+# snapshot file name regex
+#   * snapshot.2018-03-01.csv.gz
+#
+# 1: date
+re_snapshotfile = re.compile(
+    r'snapshot\.(\d{4}-\d{2}-\d{2})\.csv\.(gz|bz2|7z)$')
+
+
+def find_snapshots(patterns: List[str]) -> List[Tuple[arrow.Arrow, str]]:
+    """Return the date and the path of the snapshots in the given
+       directories or glob patterns, sorted by date.
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, 'snapshot.*.csv.*')
+        paths.update(path for path in glob.glob(pattern)
+                     if re_snapshotfile.search(os.path.basename(path)))
+
+    snapshots = []
+    for path in paths:
+        match = re_snapshotfile.search(os.path.basename(path))
+        snapshots.append((arrow.get(match.group(1), 'YYYY-MM-DD'), path))
+
+    return sorted(snapshots)
+
+
+def redirects_at_dates(
+        index: redirect_index.RedirectIndex,
+        dates: List[arrow.Arrow]) -> Iterator[Mapping]:
+    """Yield the redirects at each date, in increasing order, as
+       redirect_resolver.read_redirects would read them.
+
+    The revisions of the history are applied in order of time to a single
+    mapping, only the revisions between two consecutive dates are read. The
+    same mapping is yielded and then updated, it must be used before the next
+    one is requested.
+    """
+    # the sort is stable, revisions of a page with the same timestamp are
+    # applied in the order of the history.
+    timestamps = numpy.asarray(index.columns['revision_timestamp'])
+    order = numpy.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+
+    redirects_history = dict()
+    applied = 0
+    for date in dates:
+        end = int(numpy.searchsorted(timestamps, date.timestamp,
+                                     side='right'))
+        for values in index.revisions(order[applied:end]):
+            redirect = redirect_resolver.index_redirect(values)
+            redirects_history[redirect.page.id] = redirect
+        applied = end
+
+        yield redirects_history
+
+
+def resolve_snapshot(
+        path: str,
+        redirects_history: Mapping,
+        args) -> Mapping:
+    """Resolve the redirects of the snapshot at path, return the stats."""
+    utils.log("Resolving redirects in {}".format(path))
+
+    dump_file = fu.open_csv_file(path)
+
+    dump = csv.reader(dump_file)
+    if args.skip_header:
+        next(dump)
+
+    stats = redirect_resolver.write_resolved(
+        dump,
+        os.path.basename(path),
+        redirects_history=redirects_history,
+        args=args)
+
+    dump_file.close()
+
+    return stats
+
+
+def resolve_snapshot_indexed(
+        path: str,
+        date: arrow.Arrow,
+        index_path: str,
+        args) -> Mapping:
+    """Resolve the redirects of the snapshot at path, reading the redirects
+       at date from the index.
+    """
+    redirects_history = redirect_resolver.read_redirects_index(index_path,
+                                                               date)
+    return resolve_snapshot(path, redirects_history, args)
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'resolve-redirect-batch',
+        help='Resolve redirects in many snapshots, the input file is the '
+             'redirect history.',
+    )
+    parser.add_argument(
+        '--snapshots',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Directories or glob patterns of snapshot.YYYY-MM-DD.csv.* '
+             'files.'
+    )
+    parser.add_argument(
+        '--skip-header',
+        action='store_true',
+        help='Skip the first line of the snapshots.'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=sorted(redirect_resolver.ENGINES),
+        default='table',
+        help='Algorithm used to resolve the redirect chains, see '
+             'resolve-redirect [default: table].'
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='Number of processes resolving snapshots in parallel '
+             '[default: 1].'
+    )
+    parser.set_defaults(func=main, output_key=output_key)
+
+
+def output_key(basename: str, args) -> str:
+    """The outputs are named after the snapshots in args, so all the input
+       files write the same outputs.
+    """
+    return args.command
+
+
+def main(
+        dump: Iterable[str],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    snapshots = find_snapshots(args.snapshots)
+    if not snapshots:
+        raise ValueError("No snapshot found in {}"
+                         .format(' '.join(args.snapshots)))
+
+    for date, path in snapshots:
+        if not (date > redirect_resolver.DATE_START and
+                date < redirect_resolver.DATE_NOW):
+            raise ValueError("Snapshot date out of range: {}".format(path))
+
+    reader = csv.reader(dump)
+
+    # skip header
+    next(reader, None)
+
+    # the redirect history is read and indexed once
+    with tempfile.TemporaryDirectory(
+            prefix=basename + '.',
+            dir=str(args.output_dir_path)) as tmpdir:
+        index_path = os.path.join(tmpdir, redirect_index.index_path(basename))
+        redirect_index.build(reader, index_path)
+
+        if args.jobs > 1:
+            # each process reads the redirects at its date from the index
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=args.jobs) as executor:
+                futures = [executor.submit(resolve_snapshot_indexed,
+                                           path,
+                                           date,
+                                           index_path,
+                                           args)
+                           for date, path in snapshots]
+                snapshots_stats = [future.result() for future in futures]
+        else:
+            index = redirect_index.RedirectIndex(index_path)
+            dates = [date for date, _ in snapshots]
+            snapshots_stats = [
+                resolve_snapshot(path, redirects_history, args)
+                for (_, path), redirects_history in zip(
+                    snapshots, redirects_at_dates(index, dates))
+                ]
+            del index
+
+    return utils.sum_stats(snapshots_stats)
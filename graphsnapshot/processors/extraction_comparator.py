@@ -13,7 +13,6 @@ import mwxml
 import arrow
 import regex as re
 import pathlib
-import jsonable
 import datetime
 import itertools
 import functools
@@ -76,13 +75,80 @@ CHUNK_REGEXES = {
 }
 
 
+# - PageData:
+#   - id
+#   - timestamp (epoch seconds)
+#   - data
 PageData = NamedTuple('PageData', [
     ('id', int),
-    ('timestamp', jsonable.Type),
+    ('timestamp', int),
     ('data', dict),
 ])
 
 
+# Columns of the buffer of the revisions of a page (utils.RevisionBuffer),
+# the values of the row are its fields.
+#   0: lineno
+#   1: page_id
+#   2: revision_timestamp (epoch seconds)
+#   3: nvalues (number of values of the row, at most the columns of the
+#      header)
+BUFFER_COLUMNS = ('lineno', 'page_id', 'revision_timestamp', 'nvalues')
+
+
+class PageHistory:
+    """Revisions of a page, kept in a utils.RevisionBuffer.
+
+    Indexing gives a revision as {'lineno': ..., 'page': PageData}, the
+    PageData is built when the revision is accessed.
+    """
+
+    __slots__ = ('header', 'revisions')
+
+    def __init__(self,
+                 header: Iterable[list],
+                 revisions: Optional[utils.RevisionBuffer]=None) -> None:
+        self.header = header
+        if revisions is None:
+            revisions = utils.RevisionBuffer(BUFFER_COLUMNS,
+                                             nfields=len(header))
+        self.revisions = revisions
+
+    def append(self, lineno: int, page: PageData) -> None:
+        """Append a revision read at lineno."""
+        values = list(page.data.values())
+        nvalues = len(values)
+        values.extend([''] * (len(self.header) - nvalues))
+        self.revisions.append((lineno, page.id, page.timestamp, nvalues),
+                              values)
+
+    def __getitem__(self, index: int) -> Mapping:
+        lineno, pid, revtimestamp, nvalues = self.revisions.row(index)
+        data = dict(zip(self.header[:nvalues],
+                        self.revisions.row_fields(index)))
+        return {'lineno': lineno, 'page': PageData(pid, revtimestamp, data)}
+
+    def __len__(self) -> int:
+        return len(self.revisions)
+
+    def select(self, indexes: Iterable[int]) -> 'PageHistory':
+        """Return the history with the given revisions, in the given order.
+        """
+        return PageHistory(self.header, self.revisions.select(indexes))
+
+    def sorted(self, key: Callable[[Mapping], list]) -> 'PageHistory':
+        """Return the history sorted by key."""
+        return self.select(sorted(range(len(self)),
+                                  key=lambda index: key(self[index])))
+
+    def last(self, key: Callable[[Mapping], list]) -> 'PageHistory':
+        """Return the history with only its last revision by key."""
+        if not len(self):
+            return self
+        return self.select([max(range(len(self)),
+                                key=lambda index: key(self[index]))])
+
+
 # - Chunk:
 #   - lang
 #   - date
@@ -125,10 +191,12 @@ stats_template = '''
         <new>
             <pages_analyzed>${stats['performance']['new']['pages_analyzed'] | x}</pages_analyzed>
             <revisions_analyzed>${stats['performance']['new']['revisions_analyzed'] | x}</revisions_analyzed>
+            <pages_out_of_order>${stats['performance']['new']['pages_out_of_order'] | x}</pages_out_of_order>
         </new>
         <old>
             <pages_analyzed>${stats['performance']['old']['pages_analyzed'] | x}</pages_analyzed>
             <revisions_analyzed>${stats['performance']['old']['revisions_analyzed'] | x}</revisions_analyzed>
+            <pages_out_of_order>${stats['performance']['old']['pages_out_of_order'] | x}</pages_out_of_order>
         </old>
     </performance>
     <changes>
@@ -174,7 +242,7 @@ def sort_revisions(
 def process_pages(dump: Iterable[list],
                   header: Iterable[list],
                   stats: Mapping,
-                  max_timestamp: arrow.arrow.Arrow,
+                  max_timestamp: int,
                   sort_columns: Iterable[list],
                   only_last_revision: Optional[bool]=False,
                   which: Optional[str]='old') -> Iterator[list]:
@@ -186,14 +254,22 @@ def process_pages(dump: Iterable[list],
     page = None
     prevpage = None
 
-    revisions = []
+    revisions = PageHistory(header)
     sorted_revisions = None
 
     counter = 0
     lineno = 1
 
     custom_sort = sort_revisions(sort_columns)
-    timestamp_sort = sort_revisions('revision_timestamp')
+    timestamp_sort = sort_revisions(['revision_timestamp'])
+
+    # revisions are buffered in the order of the dump, the order of the
+    # sort columns is checked while buffering them and only the pages that
+    # are out of order are sorted. Sorting by lineno first keeps the order
+    # of the dump, so there is nothing to check.
+    check_order = bool(sort_columns) and sort_columns[0] != 'lineno'
+    in_order = True
+    last_key = None
 
     while True:
 
@@ -217,7 +293,7 @@ def process_pages(dump: Iterable[list],
         data = dict(zip(header, parsed))
         # PageData = NamedTuple('PageData', [
         #     ('id', int),
-        #     ('timestamp', jsonable.Type),
+        #     ('timestamp', int),
         #     ('data', dict),
         # ])
         try:
@@ -226,10 +302,10 @@ def process_pages(dump: Iterable[list],
             pid = -1
 
         try:
-            revtimestamp = arrow.get(data['revision_timestamp'])
+            revtimestamp = utils.parse_timestamp(data['revision_timestamp'])
         except:
             # set timestamp to EPOCH
-            revtimestamp = arrow.get(0)
+            revtimestamp = 0
 
         page = PageData(pid,revtimestamp,data)
 
@@ -277,7 +353,13 @@ def process_pages(dump: Iterable[list],
                     progress(':')
 
             if page.timestamp <= max_timestamp:
-                revisions.append( { 'lineno': lineno, 'page': page } )
+                if check_order:
+                    key = custom_sort({ 'lineno': lineno, 'page': page })
+                    if revisions and key < last_key:
+                        in_order = False
+                    last_key = key
+
+                revisions.append(lineno, page)
                 stats['revisions_analyzed'] += 1
 
             prevpage = page
@@ -292,9 +374,10 @@ def process_pages(dump: Iterable[list],
             #     and dump_prevpage.id != dump_page.id)
 
             # sort all the revision by timestamp (they are not guaranted to be
-            # ordered)
-            if sort_columns:
-                sorted_revisions = sorted(revisions, key=custom_sort)
+            # ordered), if they are out of order
+            if check_order and not in_order:
+                sorted_revisions = revisions.sorted(custom_sort)
+                stats['pages_out_of_order'] += 1
             else:
                 sorted_revisions = revisions
 
@@ -309,8 +392,7 @@ def process_pages(dump: Iterable[list],
             # all revisions will be in the correct order, so we still need to
             # collect them all, sort them and take the last one.
             if only_last_revision:
-                sorted_revisions = \
-                    [sorted(revisions, key=timestamp_sort)[-1]]
+                sorted_revisions = revisions.last(timestamp_sort)
 
             yield sorted_revisions
             del sorted_revisions
@@ -337,7 +419,11 @@ def process_pages(dump: Iterable[list],
             # we are not interested to the new page for the moment, put it in
             # the list
             prevpage = page
-            revisions = [ { 'lineno': lineno, 'page': page } ]
+            revisions = PageHistory(header)
+            revisions.append(lineno, page)
+            in_order = True
+            if check_order:
+                last_key = custom_sort(revisions[0])
 
 
 def get_header(dump: Iterable[list]) -> Iterable[list]:
@@ -631,7 +717,7 @@ def process_dumps(
     old_generator = process_pages(dump=old_dump,
                                   header=header_old,
                                   stats=stats['performance']['old'],
-                                  max_timestamp=max_timestamp,
+                                  max_timestamp=max_timestamp.timestamp,
                                   sort_columns=sort_columns,
                                   only_last_revision=only_last_revision,
                                   which='old'
@@ -640,7 +726,7 @@ def process_dumps(
     new_generator = process_pages(dump=new_dump,
                                   header=header_new,
                                   stats=stats['performance']['new'],
-                                  max_timestamp=max_timestamp,
+                                  max_timestamp=max_timestamp.timestamp,
                                   sort_columns=sort_columns,
                                   only_last_revision=only_last_revision,
                                   which='new'
@@ -1035,7 +1121,7 @@ def select_chunks(base_chunk, ext_type, args):
 def main(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
+        args) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -1044,11 +1130,13 @@ def main(
             'old': {
                 'pages_analyzed': 0,
                 'revisions_analyzed': 0,
+                'pages_out_of_order': 0,
                 'lines': 0
                 },
             'new': {
                 'pages_analyzed': 0,
                 'revisions_analyzed': 0,
+                'pages_out_of_order': 0,
                 'lines': 0
             }
         },
@@ -1228,3 +1316,5 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
@@ -5,7 +5,6 @@ The output format is csv.
 """
 
 import io
-import sys
 import csv
 import json
 import collections
@@ -43,10 +42,13 @@ def process_lines(
         stats: Mapping,
         header: Iterator[list],
         filter_regexes: Mapping,
-        replace_regexes: Mapping) -> Iterator[list]:
+        replace_regexes: Mapping,
+        progress: Optional[utils.Progress]=None) -> Iterator[list]:
     """Assign each revision to the snapshot to which they
        belong.
     """
+    if progress is None:
+        progress = utils.Progress()
 
     old_linkline = None
     linkline = None
@@ -76,6 +78,8 @@ def process_lines(
             # this is the last line, end loop.
             break
 
+        progress.line()
+
         page_data = dict(zip(header, linkline))
         page_id = int(page_data['page_id'])
         page_rev_id = int(page_data['revision_id'] )
@@ -83,8 +87,8 @@ def process_lines(
         # The code below code is executed when we encounter a new page id for
         # the first time.
         if prevpage_id is None or prevpage_id != page_id:
-            utils.log("Processing page id {}".format(page_data['page_id']))
             stats['performance']['pages_analyzed'] += 1
+            progress.page()
 
         if prevpage_rev_id is None or prevpage_rev_id != page_rev_id:
             stats['performance']['revisions_analyzed'] += 1
@@ -127,17 +131,6 @@ def process_lines(
         #        and 'see also' in page_data['wikilink.section_name'].lower():
         #    import ipdb; ipdb.set_trace()
 
-
-        # Print pagetitle for each different revision analyzed,
-        # that is at most once.
-        if prevpage_id != page_id:
-            # we print the page title in parenthesys
-            page_title = " ({})".format(page_data['page_title'])
-            print(page_title, end='', file=sys.stderr)
-
-        # print a dot for each link analyzed
-        utils.dot()
-
         if select_line:
             stats['filter']['lines'] += 1
             yield page_data
@@ -145,6 +138,16 @@ def process_lines(
         prevpage_id = page_id
         prevpage_rev_id = page_rev_id
 
+    progress.close()
+
+
+def input_has_header(args) -> bool:
+    """Return True if the first line of the input is a header, for
+       graphsnapshot.sharding.
+    """
+    # the first line is the header of the fields
+    return True
+
 
 def configure_subparsers(subparsers):
     """Configure a new subparser ."""
@@ -164,7 +167,7 @@ def configure_subparsers(subparsers):
 def main(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
+        args) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -222,6 +225,7 @@ def main(
     with pages_output:
         stats['performance']['start_time'] = datetime.datetime.utcnow()
 
+        progress = utils.Progress(source=fu.raw_file(dump))
         dump = csv.reader(dump)
 
         # get header
@@ -233,6 +237,7 @@ def main(
             header=header,
             filter_regexes=filter_regexes,
             replace_regexes=replace_regexes,
+            progress=progress,
         )
 
         writer = csv.DictWriter(pages_output, fieldnames=header)
@@ -247,3 +252,5 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
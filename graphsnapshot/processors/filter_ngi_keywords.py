@@ -137,7 +137,7 @@ def configure_subparsers(subparsers):
 def main(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
+        args) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -196,3 +196,5 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
@@ -0,0 +1,112 @@
+"""
+Write an indexed copy of a link dump.
+
+The output is a gzip file made of independent blocks and its index, see
+graphsnapshot.link_index.
+"""
+
+import os
+import datetime
+
+from typing import Iterable, Mapping
+
+from .. import utils
+from .. import file_utils as fu
+from .. import dumper
+from .. import link_index
+
+
+stats_template = '''
+<stats>
+    <performance>
+        <start_time>${stats['performance']['start_time'] | x}</start_time>
+        <end_time>${stats['performance']['end_time'] | x}</end_time>
+    </performance>
+    <index>
+        <blocks>${stats['index']['blocks'] | x}</blocks>
+        <entries>${stats['index']['entries'] | x}</entries>
+    </index>
+</stats>
+'''
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'index-links',
+        help='Write an indexed copy of a link dump, to be read by '
+             'extract-link-snapshot --use-index.',
+    )
+    parser.add_argument(
+        '--block-size',
+        type=int,
+        default=link_index.BLOCK_SIZE // 1024,
+        help='Target size of the uncompressed blocks in KB '
+             '(default = {}).'.format(link_index.BLOCK_SIZE // 1024),
+    )
+    parser.set_defaults(func=main)
+
+
+def main(
+        dump: Iterable[str],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    stats = {
+        'performance': {
+            'start_time': None,
+            'end_time': None,
+        },
+        'index': {
+            'blocks': 0,
+            'entries': 0,
+        },
+    }
+    stats['performance']['start_time'] = datetime.datetime.utcnow()
+
+    inputfile_full_path = [afile for afile in args.files
+                           if afile.name == basename][0]
+
+    output_path = args.output_dir_path / link_index.indexed_basename(basename)
+    if output_path.resolve() == inputfile_full_path.resolve():
+        raise ValueError("The indexed copy of {} would overwrite it"
+                         .format(inputfile_full_path))
+
+    utils.log("Writing indexed link dump {}".format(output_path))
+
+    if args.dry_run:
+        output = open(os.devnull, 'wb')
+    else:
+        output = open(str(output_path), 'wb')
+
+    # the lines are copied as bytes, with their line endings, from the
+    # binary stream under the text one
+    with output:
+        entries = link_index.build(dump.buffer,
+                                   output,
+                                   block_size=args.block_size * 1024)
+
+    if not args.dry_run:
+        link_index.write_index(output_path, entries)
+
+    stats['index']['blocks'] = len(set(entry.offset for entry in entries))
+    stats['index']['entries'] = len(entries)
+    stats['performance']['end_time'] = datetime.datetime.utcnow()
+
+    if args.dry_run:
+        stats_output = open(os.devnull, 'wt')
+    else:
+        stats_output = fu.output_writer(
+            path=str(args.output_dir_path /
+                     (basename + '.index-links.stats.xml')),
+            compression=args.output_compression,
+        )
+
+    with stats_output:
+        dumper.render_template(
+            stats_template,
+            stats_output,
+            stats=stats,
+        )
+
+    return stats
@@ -5,22 +5,27 @@ The output format is csv.
 """
 
 import io
-import sys
+import os
 import csv
 import collections
 import datetime
 import functools
+from array import array
 
 import jsonable
 import more_itertools
 import mwxml
 import regex
 import arrow
-from typing import Iterable, Iterator, Mapping, NamedTuple, Optional
+from typing import (Container, Iterable, Iterator, List, Mapping, NamedTuple,
+                    Optional, Tuple)
 
 from .. import utils
 from .. import file_utils as fu
 from .. import dumper
+from .. import interval_index
+from .. import link_index
+from .. import title_index
 
 
 # 9: wikilink.link
@@ -69,6 +74,13 @@ Page = NamedTuple('Page', [
 ])
 
 
+# snapshot name regex
+#   * snapshot.2018-03-01.csv.gz
+#
+# 1: date
+snapshot_name_re = regex.compile(r'.*snapshot\.(\d{4}-\d{2}-\d{2})\.csv')
+
+
 splitline_re = regex.compile(
     r'''^([0-9]{2,}),.+?,([0-9]+),''', regex.VERBOSE)
 
@@ -112,12 +124,21 @@ stats_template = '''
 def process_lines(
         dump: Iterable[list],
         stats: Mapping,
-        pages_in_snapshot: set,
-        pagetitles_in_snapshot: set,
-        revisions_in_snapshot: set) -> Iterator[list]:
-    """Assign each revision to the snapshot to which they
+        pages_in_snapshot: utils.IntSet,
+        pagetitles_in_snapshot: List[Container[str]],
+        revisions_in_snapshot: utils.IntMultiMap,
+        progress: Optional[utils.Progress]=None) -> Iterator[list]:
+    """Assign each revision to the snapshots to which they
        belong.
+
+    revisions_in_snapshot maps each revision id to the indexes of the
+    snapshots that contain it, pagetitles_in_snapshot has the set of titles
+    of each snapshot. Each link is yielded once for each snapshot that
+    contains its revision, together with the index of the snapshot.
     """
+    if progress is None:
+        progress = utils.Progress()
+
     # skip header
     next(dump)
 
@@ -155,6 +176,7 @@ def process_lines(
             break
 
         stats['performance']['revisions_analyzed'] += 1
+        progress.line()
 
         # Split the line to get page id and revision id, if something goes
         # wrong we ignore that line.
@@ -173,18 +195,16 @@ def process_lines(
         # The code below code is executed when we encounter a new page id for
         # the first time.
 
-        # Print page id
+        # Count pages
         if dump_prevpage == 0 or dump_prevpage_id != dump_page_id:
-            utils.log("Processing page id {}".format(dump_page_id))
             stats['performance']['pages_analyzed'] += 1
+            progress.page()
 
         # If the page id is not in the set of the page ids contained in this
         # snapshot we set skip_page to true so that we skip it.
         if dump_page_id not in pages_in_snapshot:
             skip_page = True
             dump_prevpage_id = dump_page_id
-
-            print(" -> skip", end='', file=sys.stderr, flush=True)
             continue
         else:
             # This page id is contained in this snapshot
@@ -248,30 +268,91 @@ def process_lines(
                                                    int(revcsv[14]),
                                                    )))
 
-                # Print pagetitle for each different revision analyzed,
-                # that is at most once.
+                # Count each different revision analyzed, that is at most
+                # once.
                 if dump_prevpage_revision_id != dump_page_revision_id:
-                    # we print the page title in parenthesys
-                    page_title = " ({})".format(dump_page.title)
-                    print(page_title, end='', file=sys.stderr)
                     stats['snapshot']['revisions'] += 1
 
-                # print a dot for each link analyzed
-                utils.dot()
-
                 wikilink = utils.normalize_wikititle(dump_page.revision.wikilink.link)
 
-                active_link = 0
-                if wikilink in pagetitles_in_snapshot:
-                    active_link = 1
+                for snapshot_index in \
+                        revisions_in_snapshot[dump_page_revision_id]:
+                    active_link = 0
+                    if wikilink in pagetitles_in_snapshot[snapshot_index]:
+                        active_link = 1
 
-                yield (dump_page, active_link)
-                stats['snapshot']['links'] += 1
+                    yield (dump_page, snapshot_index, active_link)
+                    stats['snapshot']['links'] += 1
 
                 dump_prevpage_id = dump_page_id
                 dump_prevpage_revision_id = dump_page_revision_id
                 dump_prevpage = dump_page
 
+    progress.close()
+
+
+def snapshot_readers(
+        snapshot_files: List[str],
+        dates: Optional[List[str]],
+        skip_snapshot_header: bool,
+        save_index: bool=True
+        ) -> List[Tuple[arrow.Arrow, Iterable[list]]]:
+    """Return the date and a reader of the rows of each snapshot.
+
+    Snapshot files are paired with dates, or dates are inferred from their
+    names. A single interval file can be used for any number of dates, its
+    index is saved if save_index is True.
+    """
+    if len(snapshot_files) == 1 and \
+            interval_index.is_intervals_file(snapshot_files[0]):
+        if not dates:
+            raise ValueError("--date is needed to read snapshots from an "
+                             "interval file")
+        snapshot_files = snapshot_files * len(dates)
+
+    if dates:
+        if len(dates) != len(snapshot_files):
+            raise ValueError("Got {} dates for {} snapshot files"
+                             .format(len(dates), len(snapshot_files)))
+        dates = [arrow.get(date) for date in dates]
+    else:
+        dates = []
+        for snapshot_file in snapshot_files:
+            match = snapshot_name_re.match(os.path.basename(snapshot_file))
+            if not match:
+                raise ValueError("Could not infer date from snapshot name "
+                                 "{} and no --date passed"
+                                 .format(snapshot_file))
+            dates.append(arrow.get(match.group(1), 'YYYY-MM-DD'))
+
+    readers = []
+    for date, snapshot_file in sorted(zip(dates, snapshot_files)):
+        if interval_index.is_intervals_file(snapshot_file):
+            # the snapshot at date is extracted from the interval file
+            snapshot_reader = interval_index.read_snapshot(
+                snapshot_file, date, save_index=save_index)
+        else:
+            snapshot_infile = fu.open_csv_file(snapshot_file)
+            snapshot_reader = csv.reader(snapshot_infile)
+
+            if skip_snapshot_header:
+                next(snapshot_reader)
+
+        readers.append((date, snapshot_reader))
+
+    return readers
+
+
+def input_has_header(args) -> bool:
+    """Return True if the first line of the input is a header, for
+       graphsnapshot.sharding.
+    """
+    if args.use_index:
+        raise ValueError("--use-index selects the blocks of the whole input, "
+                         "it can not be used with --shards")
+
+    # the first line is always skipped
+    return True
 
 
 def configure_subparsers(subparsers):
@@ -283,25 +364,44 @@ def configure_subparsers(subparsers):
     parser.add_argument(
         '--date',
         type=str,
-        help='Reference date'
+        nargs='+',
+        help='Reference dates, one for each snapshot file or any number '
+             'with an interval file [default: infer from the snapshot '
+             'file names].'
     )
     parser.add_argument(
         '--snapshot-file',
         type=str,
-        help='Snapshot file.'
+        nargs='+',
+        required=True,
+        help='Snapshot files, or interval file written by extract-snapshot '
+             'with --output-format intervals.'
     )
     parser.add_argument(
         '--skip-snapshot-header',
         action='store_true',
         help='Skip the snapshot file header line.'
     )
+    parser.add_argument(
+        '--title-index',
+        type=str,
+        help="Read the titles of each snapshot from this title index, "
+             "written by build-title-index, instead of the snapshot. {date} "
+             "is replaced by the date of the snapshot."
+    )
+    parser.add_argument(
+        '--use-index',
+        action='store_true',
+        help='Read only the blocks of the input that contain revisions in '
+             'the snapshots, the input must be written by index-links.'
+    )
     parser.set_defaults(func=main)
 
 
 def main(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
+        args) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -319,88 +419,147 @@ def main(
     stats['performance']['start_time'] = datetime.datetime.utcnow()
     start_time = stats['performance']['start_time']
 
-    date = arrow.get(args.date)
+    snapshots = snapshot_readers(args.snapshot_file,
+                                 args.date,
+                                 skip_snapshot_header=args.skip_snapshot_header,
+                                 save_index=not args.dry_run)
+    dates = [date for date, _ in snapshots]
 
-    snapshot_infile = fu.open_csv_file(args.snapshot_file)
-    snapshot_reader = csv.reader(fu.open_csv_file(snapshot_infile))
+    # pages_in_snapshot has the pages of all the snapshots,
+    # revisions_in_snapshot maps each revision to the snapshots that contain
+    # it, so that each link line is read once for all the snapshots.
+    #
+    # ids are collected in arrays and then stored in sorted arrays, which
+    # take a fraction of the memory of sets and dicts of ints.
+    page_ids = array('q')
+    revision_ids = array('q')
+    snapshot_indexes = array('q')
+    pagetitles_in_snapshot = []
+
+    # normalized titles are shared among snapshots
+    titles = dict()
+    indexes = []
+    for snapshot_index, (date, snapshot_reader) in enumerate(snapshots):
+        if args.title_index:
+            # titles are looked up in the index, they are not read
+            indexes.append(title_index.open_index(args.title_index, date))
+            snapshot_titles = indexes[-1].pages
+            for row_data in snapshot_reader:
+                page_ids.append(int(row_data[0]))
+                revision_ids.append(int(row_data[2]))
+                snapshot_indexes.append(snapshot_index)
+        else:
+            snapshot_titles = set()
+            for row_data in snapshot_reader:
+                page_ids.append(int(row_data[0]))
+
+                title = utils.normalize_wikititle(row_data[1])
+                snapshot_titles.add(titles.setdefault(title, title))
+
+                revision_ids.append(int(row_data[2]))
+                snapshot_indexes.append(snapshot_index)
+
+        pagetitles_in_snapshot.append(snapshot_titles)
+    del titles
+
+    if args.use_index:
+        # only the blocks of the input with revisions of the snapshots are
+        # read, the other lines are never decompressed
+        inputfile_full_path = [afile for afile in args.files
+                               if afile.name == basename][0]
+        blocks = link_index.select_blocks(
+            link_index.read_index(inputfile_full_path),
+            utils.IntMultiMap(page_ids, revision_ids),
+        )
+        dump = link_index.read_lines(inputfile_full_path, blocks)
 
-    pages_in_snapshot = set()
-    revisions_in_snapshot = set()
-    pagetitles_in_snapshot = set()
+    pages_in_snapshot = utils.IntSet(page_ids)
+    del page_ids
 
-    if args.skip_snapshot_header:
-        next(snapshot_reader)
-    for row_data in snapshot_reader:
-        pages_in_snapshot.add(int(row_data[0]))
-        pagetitles_in_snapshot.add(utils.normalize_wikititle(row_data[1]))
-        revisions_in_snapshot.add(int(row_data[2]))
+    revisions_in_snapshot = utils.IntMultiMap(revision_ids, snapshot_indexes)
+    del revision_ids, snapshot_indexes
 
     if args.dry_run:
-        pages_output = open(os.devnull, 'wt')
+        writers = fu.OutputPool(compression=None)
+        for snapshot_index in range(len(dates)):
+            writers.add(snapshot_index, os.devnull)
         stats_output = open(os.devnull, 'wt')
     else:
-        filename = str(args.output_dir_path /
-                       (basename + '.features.{date}.csv'))
-        filename = filename.format(date=date.format('YYYY-MM-DD'))
-        stats_filename = str(args.output_dir_path/(basename + '.stats.{date}.xml'))
-        stats_filename = stats_filename.format(date=date.format('YYYY-MM-DD'))
-
-        pages_output = fu.output_writer(
-            path=filename,
-            compression=args.output_compression,
-        )
+        writers = fu.OutputPool(compression=args.output_compression)
+        for snapshot_index, date in enumerate(dates):
+            filename = str(args.output_dir_path /
+                           (basename + '.features.{date}.csv'))
+            filename = filename.format(date=date.format('YYYY-MM-DD'))
+            writers.add(snapshot_index, filename)
+
+        if len(dates) == 1:
+            stats_filename = str(args.output_dir_path/
+                                 (basename + '.stats.{date}.xml'))
+            stats_filename = stats_filename.format(
+                date=dates[0].format('YYYY-MM-DD'))
+        else:
+            stats_filename = str(args.output_dir_path/
+                                 (basename + '.stats.{first}-{last}.xml'))
+            stats_filename = stats_filename.format(
+                first=dates[0].format('YYYY-MM-DD'),
+                last=dates[-1].format('YYYY-MM-DD'))
+
         stats_output = fu.output_writer(
             path=stats_filename,
             compression=args.output_compression,
         )
 
-    writer = csv.writer(pages_output)
-
     pages_generator = process_lines(
         dump,
         stats,
         pages_in_snapshot=pages_in_snapshot,
         pagetitles_in_snapshot=pagetitles_in_snapshot,
         revisions_in_snapshot=revisions_in_snapshot,
+        progress=utils.Progress(source=fu.raw_file(dump)),
     )
 
-    writer.writerow(output_csv_header)
-
-    for page, active_link in pages_generator:
-        # 1: page_id
-        # 2: page_title
-        # 3: revision_id
-        # 4: revision_parent_id
-        # 5: revision_timestamp
-        # 6: user_type
-        # 7: user_username
-        # 8: user_id
-        # 9: revision_minor
-        # 10: wikilink.link
-        # 11: wikilink.tosection
-        # 12: wikilink.anchor
-        # 13: wikilink.section_name
-        # 14: wikilink.section_level
-        # 15: wikilink.section_number
-        # 16: wikinlink.is_active
-        writer.writerow((
-            page.id,
-            page.title,
-            page.revision.id,
-            page.revision.parent_id,
-            page.revision.timestamp,
-            page.revision.user_type,
-            page.revision.username,
-            page.revision.user_id,
-            page.revision.minor,
-            page.revision.wikilink.link,
-            page.revision.wikilink.tosection,
-            page.revision.wikilink.anchor,
-            page.revision.wikilink.section_name,
-            page.revision.wikilink.section_level,
-            page.revision.wikilink.section_number,
-            active_link
-        ))
+    with writers:
+        for snapshot_index in range(len(dates)):
+            writers.writerow(snapshot_index, output_csv_header)
+
+        for page, snapshot_index, active_link in pages_generator:
+            # 1: page_id
+            # 2: page_title
+            # 3: revision_id
+            # 4: revision_parent_id
+            # 5: revision_timestamp
+            # 6: user_type
+            # 7: user_username
+            # 8: user_id
+            # 9: revision_minor
+            # 10: wikilink.link
+            # 11: wikilink.tosection
+            # 12: wikilink.anchor
+            # 13: wikilink.section_name
+            # 14: wikilink.section_level
+            # 15: wikilink.section_number
+            # 16: wikinlink.is_active
+            writers.writerow(snapshot_index, (
+                page.id,
+                page.title,
+                page.revision.id,
+                page.revision.parent_id,
+                page.revision.timestamp,
+                page.revision.user_type,
+                page.revision.username,
+                page.revision.user_id,
+                page.revision.minor,
+                page.revision.wikilink.link,
+                page.revision.wikilink.tosection,
+                page.revision.wikilink.anchor,
+                page.revision.wikilink.section_name,
+                page.revision.wikilink.section_level,
+                page.revision.wikilink.section_number,
+                active_link
+            ))
+
+    for index in indexes:
+        index.close()
 
     stats['performance']['end_time'] = datetime.datetime.utcnow()
     end_time = stats['performance']['end_time']
@@ -412,3 +571,5 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
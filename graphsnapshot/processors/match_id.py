@@ -22,6 +22,9 @@ from typing import Iterable, Iterator, Mapping, NamedTuple, Optional
 from .. import utils
 from .. import file_utils as fu
 from .. import dumper
+from .. import interval_index
+from .. import title_index
+from .. import context
 
 
 # templates
@@ -105,11 +108,15 @@ def process_lines(
         ids_redirected: Mapping,
         keep_duplicate_links: bool,
         add_titles: bool,
-        trim_redirects: bool
+        trim_redirects: bool,
+        progress: Optional[utils.Progress]=None
         ) -> Iterator[list]:
     """Assign each revision to the snapshot to which they
        belong.
     """
+    if progress is None:
+        progress = utils.Progress()
+
     dump_page = None
     dump_prevpage = None
     linkline = None
@@ -125,6 +132,8 @@ def process_lines(
     #   snapshot process them, otherwise skip
     # -------------------------------------------------------------------------
     for linkline in dump:
+        progress.line()
+
         # Mapping from the input csv
         # 'page_id', 0
         # 'page_title', 1
@@ -162,13 +171,11 @@ def process_lines(
         except ValueError:
             continue
 
-        # Print page id
+        # Count pages
         if dump_prevpage is None or dump_prevpage.id != dump_page.id:
-            utils.log("Processing page id {}".format(dump_page.id))
             stats['performance']['pages_analyzed'] += 1
+            progress.page()
 
-        # print a dot for each link analyzed
-        utils.dot()
         stats['performance']['links_analyzed']
 
         wikilink = (utils.normalize_wikititle(dump_page.revision.wikilink.link)
@@ -217,6 +224,8 @@ def process_lines(
 
         dump_prevpage = dump_page
 
+    progress.close()
+
 
 def read_snapshot(reader, resolved_redirects=False):
 
@@ -254,6 +263,13 @@ def read_snapshot(reader, resolved_redirects=False):
     return pages_in_snapshot, pages_redirected, ids_redirected
 
 
+def input_has_header(args) -> bool:
+    """Return True if the first line of the input is a header, for
+       graphsnapshot.sharding.
+    """
+    return args.skip_header
+
+
 def configure_subparsers(subparsers):
     """Configure a new subparser ."""
     parser = subparsers.add_parser(
@@ -263,8 +279,8 @@ def configure_subparsers(subparsers):
     parser.add_argument(
         '--snapshot-dir',
         type=str,
-        required=True,
-        help='Snapshot file.'
+        help='Directory with snapshot files, required unless '
+             '--intervals-file or --title-index is given.'
     )
     parser.add_argument(
         '--delimiter',
@@ -283,6 +299,20 @@ def configure_subparsers(subparsers):
         default='snapshot.{date}.csv.gz',
         help="Snapshot filename template [default: 'snapshot.{date}.csv.gz']."
     )
+    parser.add_argument(
+        '--intervals-file',
+        type=str,
+        help="Read the snapshot from this interval file, written by "
+             "extract-snapshot with --output-format intervals, instead of "
+             "the snapshot directory."
+    )
+    parser.add_argument(
+        '--title-index',
+        type=str,
+        help="Read the snapshot titles from this title index, written by "
+             "build-title-index, instead of the snapshot. {date} is replaced "
+             "by the date of the snapshot."
+    )
     parser.add_argument(
         '--skip-header',
         action='store_true',
@@ -314,14 +344,32 @@ def configure_subparsers(subparsers):
         default='',
         help="Suffix to output name."
     )
-    parser.set_defaults(func=main)
+    parser.set_defaults(func=main, output_key=output_key)
 
 
-def main(
+def output_key(basename: str, args) -> str:
+    """Return the date of the graph written for the input file basename,
+       input files of the same date write the same outputs.
+    """
+    match = basename_re.match(basename)
+    if match is None:
+        return basename
+    return '-'.join(match.groups())
+
+
+def write_graph(
         dump: Iterable[list],
-        basename: str,
-        args) -> None:
-    """Main function that parses the arguments and writes the output."""
+        date: arrow.Arrow,
+        pages_in_snapshot: Mapping,
+        pages_redirected: Mapping,
+        ids_redirected: Mapping,
+        args,
+        progress: Optional[utils.Progress]=None) -> Mapping:
+    """Match the links of a link snapshot at date to page ids, write the
+       graph and its stats and return the stats.
+
+    dump yields the rows of the link snapshot, without header.
+    """
     stats = {
         'performance': {
             'start_time': None,
@@ -336,35 +384,9 @@ def main(
     }
     stats['performance']['start_time'] = datetime.datetime.utcnow()
 
-    if args.trim_redirects and not args.resolved_redirects:
-        utils.log("Got --trim-redirect but no --resolved.redirects. "
-                  "This is unexected. Exiting.")
-        exit(1)
-
-    match = basename_re.match(basename)
-    year = int(match.group(1))
-    month = int(match.group(2))
-    day = int(match.group(3))
-
-    date = arrow.Arrow(year, month, day)
-
-    snapshot_filename = str(os.path.join(args.snapshot_dir,
-                                         args.snapshot_filename_template))
-    snapshot_filename = snapshot_filename.format(
-        date=date.format('YYYY-MM-DD'))
-
-    snapshot_infile = fu.open_csv_file(snapshot_filename)
-    snapshot_reader = csv.reader(snapshot_infile)
-    if args.skip_snapshot_header:
-        next(snapshot_reader)
-
-    pages_in_snapshot, pages_redirected, ids_redirected = (
-        read_snapshot(reader=snapshot_reader,
-                      resolved_redirects=args.resolved_redirects)
-        )
-
     if args.dry_run:
         pages_output = open(os.devnull, 'wt')
+        stats_output = open(os.devnull, 'wt')
     else:
         outname = ('wikilink_graph{suffix}.{{date}}.csv'
                    .format(suffix=args.output_suffix)
@@ -389,11 +411,6 @@ def main(
 
     writer = csv.writer(pages_output, delimiter=args.delimiter)
 
-    dump = csv.reader(dump)
-
-    if args.skip_header:
-        next(dump)
-
     pages_generator = process_lines(
         dump,
         stats,
@@ -402,27 +419,29 @@ def main(
         ids_redirected=ids_redirected,
         keep_duplicate_links=args.keep_duplicate_links,
         add_titles=args.titles,
-        trim_redirects=args.trim_redirects
+        trim_redirects=args.trim_redirects,
+        progress=progress,
         )
 
-    if args.titles:
-        writer.writerow(csv_header_output_titles)
-    else:
-        writer.writerow(csv_header_output_notitles)
-
-    for page_from, page_to in pages_generator:
+    with pages_output:
         if args.titles:
-            writer.writerow((
-                page_from.id,
-                page_from.title,
-                page_to.id,
-                page_to.title
-            ))
+            writer.writerow(csv_header_output_titles)
         else:
-            writer.writerow((
-                page_from.id,
-                page_to.id
-            ))
+            writer.writerow(csv_header_output_notitles)
+
+        for page_from, page_to in pages_generator:
+            if args.titles:
+                writer.writerow((
+                    page_from.id,
+                    page_from.title,
+                    page_to.id,
+                    page_to.title
+                ))
+            else:
+                writer.writerow((
+                    page_from.id,
+                    page_to.id
+                ))
 
     stats['performance']['end_time'] = datetime.datetime.utcnow()
 
@@ -432,3 +451,98 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
+
+
+def main(
+        dump: Iterable[list],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    if args.trim_redirects and not args.resolved_redirects:
+        utils.log("Got --trim-redirect but no --resolved.redirects. "
+                  "This is unexected. Exiting.")
+        exit(1)
+
+    if args.intervals_file and args.resolved_redirects:
+        utils.log("Got --intervals-file and --resolved-redirects, but "
+                  "interval files have no resolved redirects. Exiting.")
+        exit(1)
+
+    if args.snapshot_dir is None and \
+            not (args.intervals_file or args.title_index):
+        utils.log("Got no --snapshot-dir, --intervals-file or "
+                  "--title-index. Exiting.")
+        exit(1)
+
+    match = basename_re.match(basename)
+    year = int(match.group(1))
+    month = int(match.group(2))
+    day = int(match.group(3))
+
+    date = arrow.Arrow(year, month, day)
+
+    snapshot_filename = None
+    if args.snapshot_dir is not None:
+        snapshot_filename = str(os.path.join(args.snapshot_dir,
+                                             args.snapshot_filename_template))
+        snapshot_filename = snapshot_filename.format(
+            date=date.format('YYYY-MM-DD'))
+
+    titles = title_index.open_index(args.title_index, date)
+    if titles is not None:
+        if titles.resolved != args.resolved_redirects:
+            utils.log("The title index {} {} resolved redirects, "
+                      "unlike the snapshot files. Exiting."
+                      .format(titles.path,
+                              'has' if titles.resolved else 'has no'))
+            exit(1)
+
+        pages_in_snapshot = titles.pages
+        pages_redirected = titles.redirects
+        ids_redirected = titles.redirect_ids
+    else:
+        def load_snapshot():
+            if args.intervals_file:
+                # the snapshot at date is extracted from the interval file
+                snapshot_reader = interval_index.read_snapshot(
+                    args.intervals_file, date, save_index=not args.dry_run)
+            else:
+                snapshot_infile = fu.open_csv_file(snapshot_filename)
+                snapshot_reader = csv.reader(snapshot_infile)
+                if args.skip_snapshot_header:
+                    next(snapshot_reader)
+
+            return read_snapshot(reader=snapshot_reader,
+                                 resolved_redirects=args.resolved_redirects)
+
+        # link snapshot chunks of the same date share the snapshot
+        pages_in_snapshot, pages_redirected, ids_redirected = (
+            context.of(args).cached(
+                args.intervals_file or snapshot_filename,
+                load_snapshot,
+                'match-id',
+                date.format('YYYY-MM-DD'),
+                args.resolved_redirects,
+                args.skip_snapshot_header)
+            )
+
+    progress = utils.Progress(source=fu.raw_file(dump))
+    dump = csv.reader(dump)
+
+    if args.skip_header:
+        next(dump)
+
+    stats = write_graph(dump,
+                        date,
+                        pages_in_snapshot=pages_in_snapshot,
+                        pages_redirected=pages_redirected,
+                        ids_redirected=ids_redirected,
+                        args=args,
+                        progress=progress)
+
+    if titles is not None:
+        titles.close()
+
+    return stats
@@ -23,6 +23,8 @@ from typing import Iterable, Iterator, Mapping, NamedTuple, Optional
 from .. import utils
 from .. import file_utils as fu
 from .. import dumper
+from .. import title_index
+from .. import context
 
 csv_header = ('page_id',
               'page_title',
@@ -102,10 +104,14 @@ def process_lines(
         dump: Iterable[list],
         stats: Mapping,
         pages_in_snapshot: Mapping,
-        redirects: Mapping) -> Iterator[list]:
+        redirects: Mapping,
+        progress: Optional[utils.Progress]=None) -> Iterator[list]:
     """Assign each revision to the snapshot to which they
        belong.
     """
+    if progress is None:
+        progress = utils.Progress()
+
     dump_page = None
     dump_prevpage = None
 
@@ -125,6 +131,7 @@ def process_lines(
     # -------------------------------------------------------------------------
     for linkline in dump:
         stats['performance']['revisions_analyzed'] += 1
+        progress.line()
         # Mapping from the input csv
         # 'page_id', 0
         # 'page_title', 1
@@ -162,12 +169,9 @@ def process_lines(
         except ValueError:
             continue
 
-        # Print page id
+        # Count pages
         if dump_prevpage is None or dump_prevpage.id != dump_page.id:
-            utils.log("Processing page id {}".format(dump_page.id))
-
-        # print a dot for each link analyzed
-        utils.dot()
+            progress.page()
 
         original_wikilink = dump_page.revision.wikilink.link
         wikilink = first_uppercase(original_wikilink).strip()
@@ -200,6 +204,8 @@ def process_lines(
 
         dump_prevpage = dump_page
 
+    progress.close()
+
 
 def configure_subparsers(subparsers):
     """Configure a new subparser ."""
@@ -217,13 +223,31 @@ def configure_subparsers(subparsers):
         type=pathlib.Path,
         help='List with redirects.'
     )
-    parser.set_defaults(func=main)
+    parser.add_argument(
+        '--title-index',
+        type=str,
+        help="Read the snapshot titles from this title index, written by "
+             "build-title-index, instead of the snapshot directory. {date} "
+             "is replaced by the date of the snapshot. Titles are matched "
+             "in the normalized form of the index."
+    )
+    parser.set_defaults(func=main, output_key=output_key)
+
+
+def output_key(basename: str, args) -> str:
+    """Return the date of the graph written for the input file basename,
+       input files of the same date write the same outputs.
+    """
+    match = basename_re.match(basename)
+    if match is None:
+        return basename
+    return '-'.join(match.groups())
 
 
 def main(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
+        args) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -247,28 +271,45 @@ def main(
 
     date = arrow.Arrow(year, month, day)
 
-    snapshot_filename = str(args.snapshot_dir /
-                                         ('snapshot.{date}.csv.gz'))
-    snapshot_filename = snapshot_filename.format(
-        date=date.format('YYYY-MM-DD'))
-    snapshot_infile = fu.open_csv_file(snapshot_filename)
-    snapshot_reader = csv.reader(snapshot_infile)
+    def load_redirects():
+        with open(str(args.redirects), 'r') as redirects_file:
+            reader = csv.reader(redirects_file, delimiter='\t')
 
-    redirects = dict()
-    with open(str(args.redirects), 'r') as redirects_file:
-        reader = csv.reader(redirects_file, delimiter='\t')
+            # skip header
+            next(reader)
 
-        # skip header
-        next(reader)
+            return dict((k,v) for k,v in reader)
 
-        redirects = dict((k,v) for k,v in reader)
+    redirects = context.of(args).cached(args.redirects,
+                                        load_redirects,
+                                        'match-ngi-id redirects')
 
     # import ipdb; ipdb.set_trace()
 
-    pages_in_snapshot = dict()
-    for row_data in snapshot_reader:
-        page_title = first_uppercase(row_data[1]).replace(' ', '_')
-        pages_in_snapshot[page_title] = int(row_data[0])
+    titles = title_index.open_index(args.title_index, date)
+    if titles is not None:
+        # the index has normalized titles, links are normalized to be
+        # looked up
+        pages_in_snapshot = title_index.NormalizedTitles(titles.pages)
+    else:
+        snapshot_filename = str(args.snapshot_dir /
+                                             ('snapshot.{date}.csv.gz'))
+        snapshot_filename = snapshot_filename.format(
+            date=date.format('YYYY-MM-DD'))
+
+        def load_snapshot():
+            snapshot_infile = fu.open_csv_file(snapshot_filename)
+            snapshot_reader = csv.reader(snapshot_infile)
+
+            pages_in_snapshot = dict()
+            for row_data in snapshot_reader:
+                page_title = first_uppercase(row_data[1]).replace(' ', '_')
+                pages_in_snapshot[page_title] = int(row_data[0])
+            return pages_in_snapshot
+
+        pages_in_snapshot = context.of(args).cached(snapshot_filename,
+                                                    load_snapshot,
+                                                    'match-ngi-id snapshot')
 
     if args.dry_run:
         pages_output = open(os.devnull, 'wt')
@@ -294,12 +335,14 @@ def main(
     with pages_output:
         stats['performance']['start_time'] = datetime.datetime.utcnow()
 
+        progress = utils.Progress(source=fu.raw_file(dump))
         dump = csv.reader(dump)
         pages_generator = process_lines(
             dump,
             stats,
             pages_in_snapshot=pages_in_snapshot,
             redirects=redirects,
+            progress=progress,
         )
 
         writer = csv.writer(pages_output, delimiter='\t')
@@ -308,10 +351,14 @@ def main(
             writer.writerow(edge)
         stats['performance']['end_time'] = datetime.datetime.utcnow()
 
+    if titles is not None:
+        titles.close()
 
     with stats_output:
         dumper.render_template(
             stats_template,
             stats_output,
             stats=stats,
-        )
\ No newline at end of file
+        )
+
+    return stats
@@ -0,0 +1,579 @@
+"""
+Build the graph of each date from the revision and link dumps in a single
+run, chaining extract-snapshot, resolve-redirect, extract-link-snapshot and
+match-id.
+
+The rows produced by each step are passed in memory to the next one, so
+the intermediate snapshots are not compressed, written and parsed again;
+they are written only with --keep-intermediates. The links of each date are
+sent in batches, through a bounded queue, to a consumer that matches them to
+page ids and writes the graph, in a thread or, with --processes, in a worker
+process.
+
+The output format is csv, the same of match-id.
+"""
+
+import os
+import copy
+import queue
+import pathlib
+import datetime
+import threading
+import traceback
+import multiprocessing
+from array import array
+
+import arrow
+from typing import Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from .. import utils
+from .. import file_utils as fu
+from .. import dumper
+from .. import context
+from .. import redirect_index
+from . import snapshot_extractor
+from . import redirect_resolver
+from . import link_snapshot_extractor
+from . import match_id
+
+
+# links sent to a consumer at a time
+BATCH_SIZE = 1024
+
+# batches waiting in the queue of each consumer
+QUEUE_SIZE = 64
+
+
+stats_template = '''
+<stats>
+    <performance>
+        <start_time>${stats['performance']['start_time'] | x}</start_time>
+        <end_time>${stats['performance']['end_time'] | x}</end_time>
+    </performance>
+    <extract_snapshot>
+        <revisions_analyzed>${stats['extract_snapshot']['revisions_analyzed'] | x}</revisions_analyzed>
+        <pages_analyzed>${stats['extract_snapshot']['pages_analyzed'] | x}</pages_analyzed>
+        <pages_out_of_order>${stats['extract_snapshot']['pages_out_of_order'] | x}</pages_out_of_order>
+    </extract_snapshot>
+    <resolve_redirect>
+        <redirects_analyzed>${stats['resolve_redirect']['redirects_analyzed'] | x}</redirects_analyzed>
+        <pages_analyzed>${stats['resolve_redirect']['pages_analyzed'] | x}</pages_analyzed>
+    </resolve_redirect>
+    <extract_link_snapshot>
+        <revisions_analyzed>${stats['extract_link_snapshot']['revisions_analyzed'] | x}</revisions_analyzed>
+        <pages_analyzed>${stats['extract_link_snapshot']['pages_analyzed'] | x}</pages_analyzed>
+        <links>${stats['extract_link_snapshot']['links'] | x}</links>
+        <revisions>${stats['extract_link_snapshot']['revisions'] | x}</revisions>
+    </extract_link_snapshot>
+    <match_id>
+    % for date, graph_stats in stats['match_id'].items():
+        <graph date="${date | x}">
+            <links_active>${graph_stats['links']['active'] | x}</links_active>
+            <links_redirected>${graph_stats['links']['redirected'] | x}</links_redirected>
+        </graph>
+    % endfor
+    </match_id>
+</stats>
+'''
+
+
+# input of match-id, the link snapshot without wikilink.tosection
+csv_header_links = tuple(column
+                         for column in link_snapshot_extractor.output_csv_header
+                         if column != 'wikilink.tosection')
+
+
+# - Snapshot: the maps of a snapshot used by match-id
+#   - pages_in_snapshot
+#   - pages_redirected
+#   - ids_redirected
+Snapshot = Tuple[Mapping, Mapping, Mapping]
+
+
+def snapshot_row(revision: snapshot_extractor.Revision) -> list:
+    """Return the row of a revision, as written by extract-snapshot."""
+    # revision.page_id,
+    # revision.page_title,
+    # revision.id,
+    # revision.parent_id,
+    # revision.timestamp,
+    return [str(revision.page_id),
+            revision.page_title,
+            str(revision.id),
+            '' if revision.parent_id is None else str(revision.parent_id),
+            utils.format_timestamp(revision.timestamp),
+            ]
+
+
+def link_row(page: link_snapshot_extractor.Page, active_link: int) -> tuple:
+    """Return the row of a link, as read by match-id."""
+    return (page.id,
+            page.title,
+            page.revision.id,
+            page.revision.parent_id,
+            page.revision.timestamp,
+            page.revision.user_type,
+            page.revision.username,
+            page.revision.user_id,
+            page.revision.minor,
+            page.revision.wikilink.link,
+            page.revision.wikilink.anchor,
+            page.revision.wikilink.section_name,
+            page.revision.wikilink.section_level,
+            page.revision.wikilink.section_number,
+            active_link
+            )
+
+
+def extract_snapshots(
+        dump: Iterable[str],
+        dates: List[arrow.Arrow],
+        stats: Mapping,
+        args) -> List[redirect_resolver.SnapshotRows]:
+    """Return the rows of the snapshot at each date."""
+    snapshots = [redirect_resolver.SnapshotRows() for _ in dates]
+    snapshot_index = {date: index for index, date in enumerate(dates)}
+
+    pages_generator = snapshot_extractor.process_lines(
+        dump,
+        timestamps=dates,
+        stats=stats,
+        only_last_revision=False,
+        skip_header=args.skip_header,
+        engine=args.snapshot_engine,
+    )
+
+    for revision, ts in pages_generator:
+        snapshots[snapshot_index[ts]].append(snapshot_row(revision))
+
+    return snapshots
+
+
+def read_redirects(date: arrow.Arrow, args) -> Mapping:
+    """Return the redirects at date, as resolve-redirect reads them."""
+    redirects = args.redirects
+    if redirect_index.is_index(redirects):
+        read = redirect_resolver.read_redirects_index
+    else:
+        read = redirect_resolver.read_redirects
+
+    return context.of(args).cached(
+        redirects,
+        lambda: read(redirects, date),
+        'resolve-redirect',
+        date.format('YYYY-MM-DD'))
+
+
+def kept(rows: Iterable[list],
+         intermediates: Optional[fu.OutputPool],
+         key: Tuple[str, int]) -> Iterator[list]:
+    """Yield the rows, writing them to an intermediate output if any."""
+    for row in rows:
+        if intermediates is not None:
+            intermediates.writerow(key, row)
+        yield row
+
+
+def match_snapshot(
+        rows: redirect_resolver.SnapshotRows,
+        date: arrow.Arrow,
+        index: int,
+        stats: Mapping,
+        intermediates: Optional[fu.OutputPool],
+        args) -> Snapshot:
+    """Resolve the redirects of a snapshot, if any, and return its maps for
+       match-id.
+    """
+    if args.redirects is None:
+        return match_id.read_snapshot(reader=rows, resolved_redirects=False)
+
+    resolved_rows = redirect_resolver.process_lines(
+        rows,
+        stats,
+        snapshot_title2id=redirect_resolver.read_snapshot_pages(rows),
+        redirects_history=read_redirects(date, args),
+        engine=args.redirect_engine,
+    )
+
+    return match_id.read_snapshot(
+        reader=kept(resolved_rows, intermediates, ('resolved', index)),
+        resolved_redirects=True)
+
+
+def write_graph(
+        batches: queue.Queue,
+        date: arrow.Arrow,
+        snapshot: Snapshot,
+        args) -> Mapping:
+    """Write the graph of the links received from batches, until None."""
+    rows = (row for batch in iter(batches.get, None) for row in batch)
+
+    pages_in_snapshot, pages_redirected, ids_redirected = snapshot
+    return match_id.write_graph(
+        rows,
+        date,
+        pages_in_snapshot=pages_in_snapshot,
+        pages_redirected=pages_redirected,
+        ids_redirected=ids_redirected,
+        args=args,
+        progress=utils.Progress('Graph {}'.format(date.format('YYYY-MM-DD'))),
+    )
+
+
+def run_consumer(
+        batches: queue.Queue,
+        results: queue.Queue,
+        index: int,
+        date: arrow.Arrow,
+        snapshot: Snapshot,
+        args) -> None:
+    """Write the graph of a date and put (index, stats, error) in results.
+
+    On error the batches are still read, so that the producer is never
+    blocked on a full queue.
+    """
+    try:
+        stats = write_graph(batches, date, snapshot, args)
+    except Exception:
+        error = traceback.format_exc()
+        while batches.get() is not None:
+            pass
+        results.put((index, None, error))
+    else:
+        results.put((index, stats, None))
+
+
+def start_consumers(
+        dates: List[arrow.Arrow],
+        snapshots: List[Snapshot],
+        args) -> Tuple[list, list, queue.Queue]:
+    """Start a consumer for each date, in a thread or in a process.
+
+    Return the consumers, their queues of batches and the queue of results.
+    """
+    # consumers do not share the cache of the run
+    consumer_args = copy.copy(args)
+    consumer_args.context = None
+
+    if args.processes:
+        Queue, Worker = multiprocessing.Queue, multiprocessing.Process
+    else:
+        Queue, Worker = queue.Queue, threading.Thread
+
+    results = Queue()
+    queues = []
+    consumers = []
+    for index, (date, snapshot) in enumerate(zip(dates, snapshots)):
+        batches = Queue(maxsize=args.queue_size)
+        consumer = Worker(
+            target=run_consumer,
+            args=(batches, results, index, date, snapshot, consumer_args),
+            daemon=True,
+        )
+        consumer.start()
+
+        queues.append(batches)
+        consumers.append(consumer)
+
+    return consumers, queues, results
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'pipeline',
+        help='Build the graph at the given dates from the revision and the '
+             'link dumps, without writing the intermediate snapshots.',
+    )
+    parser.add_argument(
+        '--date',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Dates of the snapshots.'
+    )
+    parser.add_argument(
+        '--links',
+        type=pathlib.Path,
+        required=True,
+        help='Link dump, the input of extract-link-snapshot.'
+    )
+    parser.add_argument(
+        '--redirects',
+        type=pathlib.Path,
+        help='File with redirects over the snapshot history, or its index '
+             'written by index-redirects. Redirects are resolved as with '
+             'resolve-redirect and match-id --resolved-redirects '
+             '[default: do not resolve redirects].'
+    )
+    parser.add_argument(
+        '--skip-header',
+        action='store_true',
+        help='Skip the first line of the input.'
+    )
+    parser.add_argument(
+        '--snapshot-engine',
+        type=str,
+        choices=sorted(snapshot_extractor.ENGINES.keys()) + ['numpy'],
+        default='bisect',
+        help='Algorithm used to assign revisions to snapshots, see '
+             'extract-snapshot --engine (default = "bisect").'
+    )
+    parser.add_argument(
+        '--redirect-engine',
+        choices=sorted(redirect_resolver.ENGINES),
+        default='table',
+        help='Algorithm used to resolve the redirect chains, see '
+             'resolve-redirect --engine [default: table].'
+    )
+    parser.add_argument(
+        '--keep-intermediates',
+        action='store_true',
+        help='Also write the snapshots, the resolved snapshots and the link '
+             'snapshots, as snapshot.{date}.csv, '
+             'snapshot.{date}.resolve_redirect.csv and '
+             'link_snapshot.{date}.csv.'
+    )
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help='Write the graph of each date in a worker process instead of a '
+             'thread.'
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=QUEUE_SIZE,
+        help='Batches of {} links waiting for each graph writer '
+             '(default = {}).'.format(BATCH_SIZE, QUEUE_SIZE)
+    )
+    parser.add_argument(
+        '--delimiter',
+        type=str,
+        default='\t',
+        help="Output CSV delimiter [default: '\\t']."
+    )
+    parser.add_argument(
+        '--titles',
+        action='store_true',
+        help="Output article titles in addition to ids."
+    )
+    parser.add_argument(
+        '--trim-redirects',
+        action='store_true',
+        help="Do not out redirect links."
+    )
+    parser.add_argument(
+        '--keep-duplicate-links',
+        action='store_true',
+        help="Keep duplicate links."
+    )
+    parser.add_argument(
+        '--output-suffix',
+        type=str,
+        default='',
+        help="Suffix to output name."
+    )
+    parser.set_defaults(func=main, output_key=output_key)
+
+
+def output_key(basename: str, args) -> str:
+    """The graphs and the intermediate files are named after the dates in
+       args, so all the input files write the same outputs.
+    """
+    return args.command
+
+
+def main(
+        dump: Iterable[str],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    if args.trim_redirects and args.redirects is None:
+        utils.log("Got --trim-redirect but no --redirects. "
+                  "This is unexected. Exiting.")
+        exit(1)
+
+    stats = {
+        'performance': {
+            'start_time': None,
+            'end_time': None,
+        },
+        'extract_snapshot': {
+            'revisions_analyzed': 0,
+            'pages_analyzed': 0,
+            'pages_out_of_order': 0,
+        },
+        'resolve_redirect': {
+            'redirects_analyzed': 0,
+            'pages_analyzed': 0,
+        },
+        'extract_link_snapshot': {
+            'revisions_analyzed': 0,
+            'pages_analyzed': 0,
+            'links': 0,
+            'revisions': 0,
+        },
+        'match_id': dict(),
+    }
+    stats['performance']['start_time'] = datetime.datetime.utcnow()
+
+    dates = sorted(set(arrow.get(date) for date in args.date))
+    date_names = [date.format('YYYY-MM-DD') for date in dates]
+
+    intermediates = None
+    if args.keep_intermediates:
+        if args.dry_run:
+            intermediates = fu.OutputPool(compression=None)
+        else:
+            intermediates = fu.OutputPool(compression=args.output_compression)
+
+        for kind, name, header in [
+                ('snapshot', 'snapshot.{date}.csv',
+                 snapshot_extractor.csv_header_output),
+                ('resolved', 'snapshot.{date}.resolve_redirect.csv',
+                 redirect_resolver.csv_header_output),
+                ('links', 'link_snapshot.{date}.csv', csv_header_links)]:
+            if kind == 'resolved' and args.redirects is None:
+                continue
+
+            for index, date_name in enumerate(date_names):
+                filename = (os.devnull if args.dry_run
+                            else str(args.output_dir_path /
+                                     name.format(date=date_name)))
+                intermediates.add((kind, index), filename)
+                intermediates.writerow((kind, index), header)
+
+    # extract-snapshot
+    utils.log("Extracting the snapshots at {}".format(', '.join(date_names)))
+    # extract-snapshot also counts the rows it reads as link_analyzed,
+    # which is not reported here.
+    performance = dict(stats['extract_snapshot'], link_analyzed=0)
+    snapshot_rows = extract_snapshots(
+        dump,
+        dates,
+        {'performance': performance},
+        args)
+    for key in stats['extract_snapshot']:
+        stats['extract_snapshot'][key] = performance[key]
+
+    # resolve-redirect and the snapshot maps of match-id
+    snapshots = []
+    for index, (date, rows) in enumerate(zip(dates, snapshot_rows)):
+        if intermediates is not None:
+            for row in rows:
+                intermediates.writerow(('snapshot', index), row)
+
+        snapshots.append(match_snapshot(
+            rows,
+            date,
+            index,
+            {'performance': stats['resolve_redirect']},
+            intermediates,
+            args))
+
+    # the pages and the titles of the snapshots, as in extract-link-snapshot
+    page_ids = array('q')
+    revision_ids = array('q')
+    snapshot_indexes = array('q')
+    pagetitles_in_snapshot = []
+
+    titles = dict()
+    for index, rows in enumerate(snapshot_rows):
+        snapshot_titles = set()
+        for row in rows:
+            page_ids.append(int(row[0]))
+
+            title = utils.normalize_wikititle(row[1])
+            snapshot_titles.add(titles.setdefault(title, title))
+
+            revision_ids.append(int(row[2]))
+            snapshot_indexes.append(index)
+
+        pagetitles_in_snapshot.append(snapshot_titles)
+    del titles, snapshot_rows
+
+    pages_in_snapshot = utils.IntSet(page_ids)
+    del page_ids
+
+    revisions_in_snapshot = utils.IntMultiMap(revision_ids, snapshot_indexes)
+    del revision_ids, snapshot_indexes
+
+    # match-id, fed with the links of extract-link-snapshot
+    consumers, queues, results = start_consumers(dates, snapshots, args)
+    del snapshots
+
+    utils.log("Extracting the links of {}".format(args.links))
+    links_dump = fu.open_csv_file(str(args.links))
+
+    links_stats = {'performance': stats['extract_link_snapshot'],
+                   'snapshot': stats['extract_link_snapshot']}
+    links_generator = link_snapshot_extractor.process_lines(
+        links_dump,
+        links_stats,
+        pages_in_snapshot=pages_in_snapshot,
+        pagetitles_in_snapshot=pagetitles_in_snapshot,
+        revisions_in_snapshot=revisions_in_snapshot,
+        progress=utils.Progress(source=fu.raw_file(links_dump)),
+    )
+
+    batches = [[] for _ in dates]
+    for page, index, active_link in links_generator:
+        row = link_row(page, active_link)
+        if intermediates is not None:
+            intermediates.writerow(('links', index), row)
+
+        batches[index].append(row)
+        if len(batches[index]) >= BATCH_SIZE:
+            queues[index].put(batches[index])
+            batches[index] = []
+
+    links_dump.close()
+
+    for batch, batches_queue in zip(batches, queues):
+        if batch:
+            batches_queue.put(batch)
+        batches_queue.put(None)
+
+    if intermediates is not None:
+        intermediates.close()
+
+    errors = []
+    for _ in consumers:
+        index, graph_stats, error = results.get()
+        if error is not None:
+            errors.append((date_names[index], error))
+        else:
+            stats['match_id'][date_names[index]] = graph_stats
+
+    for consumer in consumers:
+        consumer.join()
+
+    if errors:
+        for date_name, error in errors:
+            utils.log("Writing the graph at {} failed:\n{}"
+                      .format(date_name, error))
+        exit(1)
+
+    stats['match_id'] = {date_name: stats['match_id'][date_name]
+                         for date_name in date_names}
+
+    stats['performance']['end_time'] = datetime.datetime.utcnow()
+
+    if args.dry_run:
+        stats_output = open(os.devnull, 'wt')
+    else:
+        stats_output = fu.output_writer(
+            path=str(args.output_dir_path /
+                     (basename + '.pipeline.stats.xml')),
+            compression=args.output_compression,
+        )
+
+    with stats_output:
+        dumper.render_template(
+            stats_template,
+            stats_output,
+            stats=stats,
+        )
+
+    return stats
@@ -0,0 +1,91 @@
+"""
+Index a redirect history for resolve-redirect.
+
+The output is a directory of NumPy arrays, see graphsnapshot.redirect_index.
+"""
+
+import os
+import csv
+import datetime
+
+from typing import Iterable, Mapping
+
+from .. import utils
+from .. import file_utils as fu
+from .. import dumper
+from .. import redirect_index
+
+
+stats_template = '''
+<stats>
+    <performance>
+        <start_time>${stats['performance']['start_time'] | x}</start_time>
+        <end_time>${stats['performance']['end_time'] | x}</end_time>
+    </performance>
+    <index>
+        <revisions>${stats['index']['revisions'] | x}</revisions>
+    </index>
+</stats>
+'''
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'index-redirects',
+        help='Index a redirect history, to be passed to resolve-redirect '
+             '--redirects.',
+    )
+    parser.set_defaults(func=main)
+
+
+def main(
+        dump: Iterable[str],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    stats = {
+        'performance': {
+            'start_time': None,
+            'end_time': None,
+        },
+        'index': {
+            'revisions': 0,
+        },
+    }
+    stats['performance']['start_time'] = datetime.datetime.utcnow()
+
+    output_path = args.output_dir_path / redirect_index.index_path(basename)
+    utils.log("Writing redirect index {}".format(output_path))
+
+    reader = csv.reader(dump)
+
+    # skip header
+    next(reader, None)
+
+    if args.dry_run:
+        # the arrays are built but not kept
+        count = 0
+        for _ in reader:
+            count = count + 1
+        stats['index']['revisions'] = count
+        stats_output = open(os.devnull, 'wt')
+    else:
+        stats['index']['revisions'] = redirect_index.build(reader,
+                                                           output_path)
+        stats_output = fu.output_writer(
+            path=str(args.output_dir_path /
+                     (basename + '.index-redirects.stats.xml')),
+            compression=args.output_compression,
+        )
+
+    stats['performance']['end_time'] = datetime.datetime.utcnow()
+
+    with stats_output:
+        dumper.render_template(
+            stats_template,
+            stats_output,
+            stats=stats,
+        )
+
+    return stats
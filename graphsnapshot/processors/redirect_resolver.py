@@ -10,24 +10,39 @@ import mwxml
 import arrow
 import regex as re
 import pathlib
-import jsonable
 import datetime
 import functools
 import collections
-from typing import Iterable, Iterator, Mapping, NamedTuple
+from array import array
+from typing import (Iterable, Iterator, Mapping, NamedTuple, Optional,
+                    Tuple)
 
+import numpy
 import more_itertools
 
 from .. import utils
 from .. import file_utils as fu
 from .. import dumper
+from .. import interval_index
+from .. import redirect_index
+from .. import title_index
+from .. import context
 
-# print a dot each NPRINTREVISION revisions
-NPRINTREVISION = 10000
+# when resolving a redirect follow at maximum MAX_RECURSION redirects
+MAX_RECURSION = 10
 
 
-# when resolving a redirect recurse at maximum MAX_RECURSION times
-MAX_RECURSION = 10
+# kind of a page in a redirect chain:
+#   * REDIRECT_STOP: the page is not a redirect, or it redirects to itself
+#   * REDIRECT_CONTINUE: the page redirects to another page in the snapshot
+#   * REDIRECT_DANGLING: the page redirects to a page not in the snapshot
+REDIRECT_STOP = 0
+REDIRECT_CONTINUE = 1
+REDIRECT_DANGLING = 2
+
+
+# resolved page of a dangling redirect
+DANGLING_REDIRECT = [-1, '#DANGLINGREDIRECT', -1, -1, -1]
 
 
 # limit dates for our snapshot (the creation of Wikipedia and now)
@@ -43,7 +58,7 @@ re_snapshotname = re.compile(r'.*snapshot\.(\d{4}-\d{2}-\d{2})\.csv\.(.+)',
 Revision = NamedTuple('Revision', [
     ('id', int),
     ('parent_id', int),
-    ('timestamp', jsonable.Type),
+    ('timestamp', int),
     ('minor', bool),
 ])
 
@@ -61,7 +76,7 @@ Page = NamedTuple('Page', [
 #     - Revision:
 #       - revision_id
 #       - revision_parent_id
-#       - revision_timestamp,
+#       - revision_timestamp (epoch seconds)
 #       - revision_minor
 #   - target
 #   - tosection
@@ -103,7 +118,12 @@ stats_template = '''
 def read_redirects(
     redirects: pathlib.Path,
     snapshot_date: arrow.Arrow) -> Mapping:
+    """Read the redirects at snapshot_date from the redirect history.
 
+    For each page the last revision not after snapshot_date is used, as in
+    read_redirects_index: with the same timestamp the last one in the
+    history wins. Rows that can not be parsed are skipped.
+    """
     redirects_file = fu.open_csv_file(str(redirects))
     redirects_reader = csv.reader(redirects_file)
 
@@ -112,205 +132,430 @@ def read_redirects(
 
     # read redirects
     redirects_history = dict()
+    snapshot_epoch = snapshot_date.timestamp
 
-    redirect_line = None
-    redirect_prevline = None
+    progress = utils.Progress('Reading redirects',
+                              source=fu.raw_file(redirects_file))
+    for redirect in redirects_reader:
+        progress.line()
+
+        # 0: page_id
+        # 1: page_title
+        # 2: revision_id
+        # 3: revision_parent_id
+        # 4: revision_timestamp,
+        # 5: revision_minor
+        # 6: redirect.target
+        # 7: redirect.tosection
+        try:
+            red = Redirect(Page(int(redirect[0]),
+                                redirect[1],
+                                Revision(int(redirect[2]),
+                                         int(redirect[3]) if redirect[3]
+                                         else -1,
+                                         utils.parse_timestamp(redirect[4]),
+                                         int(redirect[5])
+                                         )
+                                ),
+                           redirect[6],
+                           redirect[7]
+                           )
+        except (IndexError, ValueError, arrow.parser.ParserError):
+            continue
+
+        timestamp = red.page.revision.timestamp
+        if timestamp > snapshot_epoch:
+            continue
+
+        # revisions are not guaranteed to be in order
+        current = redirects_history.get(red.page.id)
+        if current is None or timestamp >= current.page.revision.timestamp:
+            redirects_history[red.page.id] = red
+
+    progress.close()
+
+    redirects_file.close()
 
-    is_last_revision = False
+    return redirects_history
 
-    counter = 0
-    print('\nReading redirects ', end=' ')
-    for redirect in redirects_reader:
-        if counter % NPRINTREVISION == 0:
-            utils.dot()
-        counter = counter + 1
 
-        if redirect is None:
-                redirect_line = redirects_prevline
-                is_last_revision = True
-        else:
-            # 0: page_id
-            # 1: page_title
-            # 2: revision_id
-            # 3: revision_parent_id
-            # 4: revision_timestamp,
-            # 5: revision_minor
-            # 6: redirect.target
-            # 7: redirect.tosection
-            redirect_line = {
-                'page_id': int(redirect[0]),
-                'page_title': redirect[1],
-                'revision_id': int(redirect[2]),
-                'revision_parent_id': int(redirect[3]) \
-                                        if redirect[3] else -1,
-                'revision_timestamp': arrow.get(redirect[4]),
-                'revision_minor': int(redirect[5]),
-                'redirect.target': redirect[6],
-                'redirect.tosection': redirect[7]
-                }
-
-
-        if is_last_revision or \
-                redirect_line['revision_timestamp'] > snapshot_date:
-            red_dict = redirect_prevline
-
-            try:
-                red = Redirect(Page(red_dict['page_id'],
-                                   red_dict['page_title'],
-                                   Revision(red_dict['revision_id'],
-                                            red_dict['revision_parent_id'],
-                                            red_dict['revision_timestamp'],
-                                            red_dict['revision_minor']
-                                            )
-                                   ),
-                              red_dict['redirect.target'],
-                              red_dict['redirect.tosection']
-                              )
-            except TypeError as err:
-                continue
-
-            redirects_history[red_dict['page_id']] = red
+def read_redirects_index(
+    redirects: pathlib.Path,
+    snapshot_date: arrow.Arrow) -> Mapping:
+    """Read the redirects at snapshot_date from a redirect index built by
+       index-redirects.
 
-        else:
-            redirect_prevline = redirect_line
+    For each page the last revision not after snapshot_date is used.
+    """
+    index = redirect_index.RedirectIndex(redirects)
+
+    redirects_history = dict()
+    for values in index.revisions_at(snapshot_date):
+        redirect = index_redirect(values)
+        redirects_history[redirect.page.id] = redirect
 
     return redirects_history
 
 
-def read_snapshot_pages(
-    input_file_path: Iterable[list],
-    skip_header: bool
-    ) -> Mapping:
+def index_redirect(values: tuple) -> Redirect:
+    """Return the Redirect of a revision read from a redirect index."""
+    (page_id, page_title, revision_id, revision_parent_id,
+     revision_timestamp, revision_minor, target, tosection) = values
+
+    return Redirect(Page(page_id,
+                         page_title,
+                         Revision(revision_id,
+                                  revision_parent_id,
+                                  revision_timestamp,
+                                  revision_minor
+                                  )
+                         ),
+                    target,
+                    tosection
+                    )
+
+
+class SnapshotRows:
+    """Rows of a snapshot, read once and kept in compact columns.
+
+    Page ids are stored in an array('q'), the other fields of each row in a
+    StringArena. Iterating yields the rows as lists of strings, as a CSV
+    reader would.
+    """
+
+    # fields of each row after the page id
+    NFIELDS = len(csv_header_input) - 1
+
+    def __init__(self, reader: Iterable[list]=()) -> None:
+        self.page_ids = array('q')
+        self.fields = utils.StringArena()
+
+        for row in reader:
+            self.append(row)
 
-    snapshot = fu.open_csv_file(str(input_file_path))
-    snapshot_reader = csv.reader(snapshot)
+    def append(self, row: list) -> None:
+        """Append a row."""
+        self.page_ids.append(int(row[0]))
+        for value in row[1:self.NFIELDS + 1]:
+            self.fields.append(value)
 
-    if skip_header:
-        next(snapshot_reader)
+    def __len__(self) -> int:
+        return len(self.page_ids)
+
+    def __iter__(self) -> Iterator[list]:
+        fields = self.fields
+        nfields = self.NFIELDS
+        for row, page_id in enumerate(self.page_ids):
+            start = row * nfields
+            yield [str(page_id)] + [fields[start + column]
+                                    for column in range(nfields)]
+
+
+def read_snapshot_pages(
+    snapshot_reader: Iterable[list]
+    ) -> Mapping:
+    """Map the titles of the pages in the snapshot, normalized with
+       utils.normalize_wikititle as the redirect targets and as in a title
+       index, to their ids.
+    """
 
     title2id = dict()
 
-    counter = 0
-    print('\nReading snapshot ', end=' ')
+    progress = utils.Progress('Reading snapshot')
     for line in snapshot_reader:
-        if counter % NPRINTREVISION == 0:
-            utils.dot()
-        counter = counter + 1
+        progress.line()
 
-        page_title = line[1]
+        page_title = utils.normalize_wikititle(line[1])
         page_id = int(line[0])
 
         title2id[page_title] = page_id
 
+    progress.close()
+
     return title2id
 
 
-def resolve_redirect(
-    page: Iterable[list],
-    original_page: Iterable[list],
-    stats: Mapping,
-    snapshot_title2id: Mapping,
-    redirects_history: Mapping,
-    count_recursive_calls: int) -> Iterator[list]:
+def redirect_step(
+        page_id: int,
+        snapshot_title2id: Mapping,
+        redirects_history: Mapping
+        ) -> Tuple[int, Optional[int], Optional[str]]:
+    """Return the kind of page_id in a redirect chain and, for
+       REDIRECT_CONTINUE, the id and the title of its target.
+    """
+    redirect = redirects_history.get(page_id)
+    if redirect is None:
+        return REDIRECT_STOP, None, None
+
+    target_title = utils.normalize_wikititle(redirect.target)
+    target_id = snapshot_title2id.get(target_title, None)
+
+    if page_id == target_id or target_title == '#NOREDIRECT':
+        return REDIRECT_STOP, None, None
 
-    stats['performance']['redirects_analyzed'] += 1
+    if target_id is None:
+        return REDIRECT_DANGLING, None, None
 
-    count_recursive_calls = count_recursive_calls + 1
+    return REDIRECT_CONTINUE, target_id, target_title
 
-    result = None
-    page_id = int(page[0])
-    page_title = page[1]
 
-    if page_id in redirects_history:
-        # page is a redirect
-        redirect = redirects_history[page_id]
-        target_title = redirects_history[page_id].target
-        target_title = utils.normalize_wikititle(target_title)
-        target_id = snapshot_title2id.get(target_title, None)
+def redirect_page(
+        page_id: int,
+        snapshot_title2id: Mapping,
+        redirects_history: Mapping) -> list:
+    """Return the page to which page_id, a REDIRECT_CONTINUE page,
+       redirects, with the revision of the redirect.
+    """
+    _, target_id, target_title = redirect_step(page_id,
+                                               snapshot_title2id,
+                                               redirects_history)
+    redrev = redirects_history[page_id].page.revision
+
+    # page_id,
+    # page_title,
+    # revision_id,
+    # revision_parent_id,
+    # revision_timestamp
+    return [target_id,
+            target_title,
+            redrev.id,
+            redrev.parent_id,
+            utils.format_timestamp(redrev.timestamp)
+            ]
+
+
+def resolve_redirects(
+        snapshot_title2id: Mapping,
+        redirects_history: Mapping
+        ) -> Mapping[int, Tuple[Optional[list], int]]:
+    """Resolve all the redirects of the snapshot at once.
+
+    Return a map from the id of each page that is a redirect to its resolved
+    page (None for the page itself) and to the number of redirect lookups
+    counted for it, one for the page and one for each redirect followed.
+    Pages that are not in the map resolve to themselves with one lookup.
+
+    Each chain is followed once, with its length and last redirect memoized
+    for all the pages on it. Chains longer than MAX_RECURSION redirects and
+    cycles resolve to the page reached after MAX_RECURSION - 1 redirects.
+    """
+    steps = dict()
+    for page_id in redirects_history:
+        step = redirect_step(page_id, snapshot_title2id, redirects_history)
+        if step[0] != REDIRECT_STOP:
+            steps[page_id] = step
+
+    # for each page:
+    #   * hops: number of redirects followed from the page to the end of its
+    #     chain, None if the chain ends in a cycle
+    #   * last: last redirect followed, None if hops is 0
+    #   * kind: kind of the page at the end of the chain
+    hops = dict()
+    last = dict()
+    kind = dict()
+    for start in steps:
+        path = []
+        position = dict()
+        node = start
+        while node not in hops:
+            step = steps.get(node)
+            if step is None or step[0] == REDIRECT_DANGLING:
+                hops[node] = 0
+                last[node] = None
+                kind[node] = REDIRECT_DANGLING if step else REDIRECT_STOP
+                break
+
+            if node in position:
+                # the pages from node onwards form a cycle
+                for cycle_node in path[position[node]:]:
+                    hops[cycle_node] = None
+                    last[cycle_node] = None
+                    kind[cycle_node] = None
+                del path[position[node]:]
+                break
+
+            position[node] = len(path)
+            path.append(node)
+            node = step[1]
+
+        # path compression: every page on the path gets the end of its chain
+        for node in reversed(path):
+            target_id = steps[node][1]
+            if hops[target_id] is None:
+                hops[node] = None
+                last[node] = None
+            else:
+                hops[node] = hops[target_id] + 1
+                last[node] = last[target_id] if hops[target_id] else node
+            kind[node] = kind[target_id]
+
+    # resolved pages are shared among all the chains with the same last
+    # redirect
+    target_pages = dict()
+
+    def target_page(page_id: int) -> list:
+        if page_id not in target_pages:
+            target_pages[page_id] = redirect_page(page_id,
+                                                  snapshot_title2id,
+                                                  redirects_history)
+        return target_pages[page_id]
+
+    resolved = dict()
+    for page_id in steps:
+        nhops = hops[page_id]
+        if nhops is not None and nhops <= MAX_RECURSION:
+            if kind[page_id] == REDIRECT_DANGLING:
+                result = DANGLING_REDIRECT
+            else:
+                result = target_page(last[page_id])
+            resolved[page_id] = (result, nhops + 1)
+        else:
+            # the resolution stops after MAX_RECURSION redirects, at the
+            # page from which the last one was followed
+            node = page_id
+            for _ in range(MAX_RECURSION - 2):
+                node = steps[node][1]
+            result = target_page(node) if MAX_RECURSION > 1 else None
+            resolved[page_id] = (result, MAX_RECURSION + 1)
 
-        if page_id == target_id:
-            return page
+    return resolved
 
-        if target_title == '#NOREDIRECT':
-            # page is not a redirect, return page as it is
-            result = page
 
+def numpy_resolve_redirects(
+        snapshot_title2id: Mapping,
+        redirects_history: Mapping
+        ) -> Mapping[int, Tuple[Optional[list], int]]:
+    """Resolve all the redirects of the snapshot at once with NumPy, same
+       results as resolve_redirects.
+
+    Pages are numbered densely and each chain is followed by pointer
+    jumping over integer arrays: at each round every page jumps to the end
+    of the path of the page it points to, so that a chain of n redirects is
+    followed in log2(n) vector operations. Pages still not at the end of
+    their chain when the jumps cover as many redirects as the pages are on
+    a cycle.
+    """
+    sources = array('q')
+    targets = array('q')
+    dangling = array('q')
+    for page_id in redirects_history:
+        kind, target_id, _ = redirect_step(page_id,
+                                           snapshot_title2id,
+                                           redirects_history)
+        if kind == REDIRECT_CONTINUE:
+            sources.append(page_id)
+            targets.append(target_id)
+        elif kind == REDIRECT_DANGLING:
+            dangling.append(page_id)
+
+    sources = numpy.frombuffer(sources, dtype=numpy.int64)
+    targets = numpy.frombuffer(targets, dtype=numpy.int64)
+    dangling = numpy.frombuffer(dangling, dtype=numpy.int64)
+
+    # dense numbering of all the pages in the chains
+    page_ids = numpy.unique(numpy.concatenate([sources, targets, dangling]))
+    npages = len(page_ids)
+    source_index = numpy.searchsorted(page_ids, sources)
+    dangling_index = numpy.searchsorted(page_ids, dangling)
+
+    # for each page:
+    #   * target: page it redirects to, itself at the end of a chain
+    #   * hops: number of redirects from the page to target
+    #   * last: last redirect followed to reach target
+    target = numpy.arange(npages, dtype=numpy.int64)
+    target[source_index] = numpy.searchsorted(page_ids, targets)
+    first_target = target.copy()
+
+    hops = numpy.zeros(npages, dtype=numpy.int64)
+    hops[source_index] = 1
+    last = numpy.arange(npages, dtype=numpy.int64)
+
+    is_end = target == numpy.arange(npages)
+    is_dangling = numpy.zeros(npages, dtype=bool)
+    is_dangling[dangling_index] = True
+
+    # pointer jumping
+    covered = 1
+    reached = is_end[target]
+    while not reached.all() and covered < npages:
+        moves = hops[target] > 0
+        last = numpy.where(moves, last[target], last)
+        hops = hops + hops[target]
+        target = target[target]
+        covered = covered * 2
+        reached = is_end[target]
+    is_cyclic = ~reached
+
+    # pages on chains longer than MAX_RECURSION or on a cycle resolve to the
+    # page reached after MAX_RECURSION - 1 redirects, that is the target of
+    # the redirect reached after MAX_RECURSION - 2 redirects.
+    is_long = is_cyclic | (hops > MAX_RECURSION)
+    cut = numpy.arange(npages, dtype=numpy.int64)
+    for _ in range(MAX_RECURSION - 2):
+        cut = first_target[cut]
+
+    target_pages = dict()
+
+    def target_page(index: int) -> list:
+        if index not in target_pages:
+            target_pages[index] = redirect_page(int(page_ids[index]),
+                                                snapshot_title2id,
+                                                redirects_history)
+        return target_pages[index]
+
+    resolved = dict()
+    for index in numpy.concatenate([source_index, dangling_index]).tolist():
+        page_id = int(page_ids[index])
+        if is_long[index]:
+            result = target_page(int(cut[index])) \
+                if MAX_RECURSION > 1 else None
+            resolved[page_id] = (result, MAX_RECURSION + 1)
+        elif is_dangling[target[index]]:
+            resolved[page_id] = (DANGLING_REDIRECT, int(hops[index]) + 1)
         else:
-            if target_id is None:
-                # target page not in snapshot
-                result = [-1, '#DANGLINGREDIRECT', -1, -1, -1]
-            else:
-                # target page is in snapshot
-
-                # page_id,
-                # page_title,
-                # revision_id,target_page
-                # revision_parent_id,
-                # revision_timestamp
-                redrev = redirect.page.revision
-
-                target_rev_id = redrev.id
-                target_rev_parent_id = redrev.parent_id
-                target_rev_timestamp = redrev.timestamp.isoformat()
-
-                target_page = [target_id,
-                               target_title,
-                               target_rev_id,
-                               target_rev_parent_id,
-                               target_rev_timestamp
-                               ]
-                if count_recursive_calls <= MAX_RECURSION:
-                    result = resolve_redirect(
-                                page=target_page,
-                                original_page=page,
-                                stats=stats,
-                                snapshot_title2id=snapshot_title2id,
-                                redirects_history=redirects_history,
-                                count_recursive_calls=count_recursive_calls
-                                )
-                else:
-                    result = original_page
-
-                # if int(target_id) != int(result[0]):
-                #     import ipdb; ipdb.set_trace()
-    else:
-        # page is not a redirect, return page as it is
-        result = page
+            resolved[page_id] = (target_page(int(last[index])),
+                                 int(hops[index]) + 1)
+
+    return resolved
+
 
-    return result
+ENGINES = {
+    'table': resolve_redirects,
+    'numpy': numpy_resolve_redirects,
+}
 
 
 def process_lines(
         dump: Iterable[list],
         stats: Mapping,
         snapshot_title2id: Mapping,
-        redirects_history: Mapping) -> Iterator[list]:
+        redirects_history: Mapping,
+        engine: str='table') -> Iterator[list]:
     """Assign each revision to the snapshot or snapshots to which they
        belong.
     """
 
     header = csv_header_input
 
-    counter = 0
-    print('\nProcess snapshot ', end=' ')
+    resolved_redirects = ENGINES[engine](snapshot_title2id,
+                                         redirects_history)
+
+    progress = utils.Progress('Process snapshot')
     for snapshot_page in dump:
-        if counter % NPRINTREVISION == 0:
-            utils.dot()
-
-        counter = counter + 1
-        # get only page id and page title
-        resolved = resolve_redirect(page=snapshot_page,
-                                    original_page=snapshot_page,
-                                    stats=stats,
-                                    snapshot_title2id=snapshot_title2id,
-                                    redirects_history=redirects_history,
-                                    count_recursive_calls=0,
-                                    )
+        progress.line()
+
+        resolved, calls = resolved_redirects.get(int(snapshot_page[0]),
+                                                 (None, 1))
+        if resolved is None:
+            resolved = snapshot_page
+        stats['performance']['redirects_analyzed'] += calls
 
         stats['performance']['pages_analyzed'] += 1
 
         yield snapshot_page + resolved
 
+    progress.close()
+
 
 def configure_subparsers(subparsers):
     """Configure a new subparser ."""
@@ -322,21 +567,51 @@ def configure_subparsers(subparsers):
         '--redirects',
         type=pathlib.Path,
         required=True,
-        help='File with redirects over the snapshot history.'
+        help='File with redirects over the snapshot history, or its index '
+             'written by index-redirects.'
     )
     parser.add_argument(
         '--skip-header',
         action='store_true',
         help='Skip the first line of the input.'
     )
+    parser.add_argument(
+        '--date',
+        type=str,
+        help='Date of the snapshot, needed if the input is an interval file '
+             '[default: infer from the snapshot name].'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=sorted(ENGINES),
+        default='table',
+        help='Algorithm used to resolve the redirect chains: a memoized '
+             'walk of each chain (table) or pointer jumping over NumPy '
+             'arrays (numpy) [default: table].'
+    )
+    parser.add_argument(
+        '--title-index',
+        type=str,
+        help='Look up redirect targets in this title index, written by '
+             'build-title-index, instead of the titles of the input. '
+             '{date} is replaced by the date of the snapshot.'
+    )
     parser.set_defaults(func=main)
 
 
-def main(
+def write_resolved(
         dump: Iterable[list],
         basename: str,
-        args) -> None:
-    """Main function that parses the arguments and writes the output."""
+        redirects_history: Mapping,
+        args,
+        snapshot_title2id: Optional[Mapping]=None) -> Mapping:
+    """Resolve the redirects of a snapshot, write the output files and
+       return the stats.
+
+    dump is a reader of the rows of the snapshot, without header. The rows
+    are read once and buffered, for the title index and for the output,
+    unless snapshot_title2id (a title index) is given.
+    """
     stats = {
         'performance': {
             'start_time': None,
@@ -347,10 +622,6 @@ def main(
     }
     stats['performance']['start_time'] = datetime.datetime.utcnow()
 
-    redirects = args.redirects
-    inputfile_full_path = [afile for afile in args.files
-                           if afile.name == basename][0]
-
     if args.dry_run:
         pages_output = open(os.devnull, 'wt')
         stats_output = open(os.devnull, 'wt')
@@ -368,44 +639,36 @@ def main(
         )
     writer = csv.writer(pages_output)
 
-    match = re_snapshotname.match(basename)
-    if match:
-        snapshot_date = arrow.get(match.group(1), 'YYYY-MM-DD')
-    assert (snapshot_date > DATE_START and snapshot_date < DATE_NOW)
-    # snapshot_date = snapshot_date.strftime('%Y-%m-%d')
-
-    redirects_history = read_redirects(redirects, snapshot_date)
-
-    snapshot_title2id = read_snapshot_pages(inputfile_full_path,
-                                            skip_header=args.skip_header)
-    
-    dump = csv.reader(dump)
-
-    if args.skip_header:
-        next(dump)
+    if snapshot_title2id is None:
+        snapshot_rows = SnapshotRows(dump)
+        snapshot_title2id = read_snapshot_pages(snapshot_rows)
+    else:
+        snapshot_rows = dump
 
     pages_generator = process_lines(
-        dump,
+        snapshot_rows,
         stats,
         snapshot_title2id=snapshot_title2id,
-        redirects_history=redirects_history
+        redirects_history=redirects_history,
+        engine=args.engine,
         )
 
-    writer.writerow(csv_header_output)
-    for page in pages_generator:
-        # csv_header_output
-        #
-        # page_id
-        # page_title
-        # revision_id
-        # revision_parent_id
-        # revision_timestamp
-        # redirect_id
-        # redirect_title
-        # redirect_revision_id
-        # redirect_revision_parent_id
-        # redirect_revision_timestamp
-        writer.writerow(page)
+    with pages_output:
+        writer.writerow(csv_header_output)
+        for page in pages_generator:
+            # csv_header_output
+            #
+            # page_id
+            # page_title
+            # revision_id
+            # revision_parent_id
+            # revision_timestamp
+            # redirect_id
+            # redirect_title
+            # redirect_revision_id
+            # redirect_revision_parent_id
+            # redirect_revision_timestamp
+            writer.writerow(page)
 
     stats['performance']['end_time'] = datetime.datetime.utcnow()
 
@@ -415,3 +678,72 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
+
+
+def main(
+        dump: Iterable[list],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    redirects = args.redirects
+    inputfile_full_path = [afile for afile in args.files
+                           if afile.name == basename][0]
+
+    if interval_index.is_intervals_file(inputfile_full_path):
+        # the snapshot at --date is extracted from the interval file
+        if args.date is None:
+            raise ValueError("--date is needed to read the snapshot from "
+                             "an interval file")
+        snapshot_date = arrow.get(args.date)
+        basename = interval_index.snapshot_basename(basename, snapshot_date)
+
+        dump = interval_index.read_snapshot(inputfile_full_path,
+                                            snapshot_date,
+                                            save_index=not args.dry_run)
+    else:
+        if args.date is not None:
+            snapshot_date = arrow.get(args.date)
+        else:
+            match = re_snapshotname.match(basename)
+            if not match:
+                raise ValueError("Could not infer date from snapshot name "
+                                 "and no --date passed")
+            snapshot_date = arrow.get(match.group(1), 'YYYY-MM-DD')
+
+        dump = csv.reader(dump)
+
+        if args.skip_header:
+            next(dump)
+
+    assert (snapshot_date > DATE_START and snapshot_date < DATE_NOW)
+    # snapshot_date = snapshot_date.strftime('%Y-%m-%d')
+
+    if redirect_index.is_index(redirects):
+        read = read_redirects_index
+    else:
+        read = read_redirects
+
+    # snapshots of the same date share the redirects
+    redirects_history = context.of(args).cached(
+        redirects,
+        lambda: read(redirects, snapshot_date),
+        'resolve-redirect',
+        snapshot_date.format('YYYY-MM-DD'))
+
+    snapshot_title2id = None
+    titles = title_index.open_index(args.title_index, snapshot_date)
+    if titles is not None:
+        snapshot_title2id = titles.pages
+
+    stats = write_resolved(dump,
+                           basename,
+                           redirects_history=redirects_history,
+                           args=args,
+                           snapshot_title2id=snapshot_title2id)
+
+    if titles is not None:
+        titles.close()
+
+    return stats
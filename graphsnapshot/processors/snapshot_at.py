@@ -0,0 +1,120 @@
+"""
+Extract snapshots at given dates from a validity-interval file.
+
+The output format is csv.
+"""
+
+import os
+import csv
+import datetime
+
+import arrow
+from typing import Iterable, Mapping
+
+from .. import utils
+from .. import file_utils as fu
+from .. import dumper
+from .. import interval_index
+from . import snapshot_extractor
+
+
+stats_template = '''
+<stats>
+    <performance>
+        <start_time>${stats['performance']['start_time'] | x}</start_time>
+        <end_time>${stats['performance']['end_time'] | x}</end_time>
+    </performance>
+    <snapshots>
+        % for date, count in stats['snapshots'].items():
+        <snapshot date="${date | x}" pages="${count | x}" />
+        % endfor
+    </snapshots>
+</stats>
+'''
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'snapshot-at',
+        help='Extract snapshots at given dates from an interval file.',
+    )
+    parser.add_argument(
+        '--date',
+        type=str,
+        nargs='+',
+        required=True,
+        help='Dates of the snapshots.'
+    )
+    parser.set_defaults(func=main)
+
+
+def main(
+        dump: Iterable[list],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    stats = {
+        'performance': {
+            'start_time': None,
+            'end_time': None,
+        },
+        'snapshots': {},
+    }
+    stats['performance']['start_time'] = datetime.datetime.utcnow()
+
+    inputfile_full_path = [afile for afile in args.files
+                           if afile.name == basename][0]
+
+    if not interval_index.is_intervals_file(inputfile_full_path):
+        raise ValueError("Unexpected name for interval file: {}"
+                         .format(basename))
+
+    dates = sorted(arrow.get(date) for date in args.date)
+
+    for date in dates:
+        utils.log("Extracting snapshot at {}".format(date.format('YYYY-MM-DD')))
+
+        if args.dry_run:
+            pages_output = open(os.devnull, 'wt')
+        else:
+            filename = str(args.output_dir_path /
+                           interval_index.snapshot_basename(basename, date))
+            pages_output = fu.output_writer(
+                path=filename,
+                compression=args.output_compression,
+            )
+
+        count = 0
+        with pages_output:
+            writer = csv.writer(pages_output)
+            writer.writerow(snapshot_extractor.csv_header_output)
+
+            for row in interval_index.read_snapshot(
+                    inputfile_full_path,
+                    date,
+                    save_index=not args.dry_run):
+                writer.writerow(row)
+                count = count + 1
+
+        stats['snapshots'][date.format('YYYY-MM-DD')] = count
+
+    stats['performance']['end_time'] = datetime.datetime.utcnow()
+
+    if args.dry_run:
+        stats_output = open(os.devnull, 'wt')
+    else:
+        stats_output = fu.output_writer(
+            path=str(args.output_dir_path /
+                     (basename + '.snapshot_at.stats.xml')),
+            compression=args.output_compression,
+        )
+
+    with stats_output:
+        dumper.render_template(
+            stats_template,
+            stats_output,
+            stats=stats,
+        )
+
+    return stats
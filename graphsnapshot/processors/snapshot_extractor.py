@@ -4,29 +4,30 @@ Extract snapshots from list of revisions.
 The output format is csv.
 """
 
+import os
 import csv
+import bisect
 import argparse
 import datetime
+import operator
 import functools
+import itertools
 import collections
-from io import StringIO
+from array import array
 
 import arrow
+import numpy
 import regex
 import mwxml
-import jsonable
 import more_itertools
-from typing import Iterable, Iterator, Mapping, NamedTuple
+from typing import (Callable, Iterable, Iterator, List, Mapping, NamedTuple,
+                    Optional, Tuple)
 
 from .. import utils
 from .. import file_utils as fu
 from .. import dumper
 
 
-# print a dot each NPRINTREVISION revisions
-NPRINTREVISION = 10000
-
-
 # snapshot to infer the date from the input file
 snapshot_date_pattern = r'.+wiki-([0-9]{8})-pages-meta-history.+\.xml.*'
 SNAPSHOT_DATE_RE = regex.compile(snapshot_date_pattern)
@@ -52,6 +53,18 @@ NPERIODS = {
     'y': lambda days: int(days/365) + 2
 }
 
+# name of the series of snapshots of each periodicity, in the output names
+# when more than one series is extracted
+SERIES_NAMES = {
+    'd': 'daily',
+    'w': 'weekly',
+    'M': 'monthly',
+    'y': 'yearly',
+}
+
+# name of the series of the dates in --dates-file
+DATES_SERIES = 'dates'
+
 
 # templates
 stats_template = '''
@@ -63,24 +76,45 @@ stats_template = '''
             <link_analyzed>${stats['performance']['link_analyzed'] | x}</link_analyzed>
             <revisions_analyzed>${stats['performance']['revisions_analyzed'] | x}</revisions_analyzed>
             <pages_analyzed>${stats['performance']['pages_analyzed'] | x}</pages_analyzed>
+            <pages_out_of_order>${stats['performance']['pages_out_of_order'] | x}</pages_out_of_order>
         </input>
     </performance>
 </stats>
 '''
 
 
-# Revison and Page objects
+# Revision record, as read from the input
+#   0: page_id
+#   1: page_title
+#   2: revision_id
+#   3: revision_parent_id (None if the revision has no parent)
+#   4: revision_timestamp (epoch seconds)
+#
+# The order of the fields is the same of csv_header_output, so that a record
+# can be written once its timestamp is formatted, see output_row.
 Revision = NamedTuple('Revision', [
+    ('page_id', int),
+    ('page_title', str),
     ('id', int),
-    ('parent_id', int),
-    ('timestamp', jsonable.Type),
+    ('parent_id', Optional[int]),
+    ('timestamp', int),
 ])
 
-Page = NamedTuple('Page', [
-    ('id', str),
-    ('title', str),
-    ('revision', Revision),
-])
+
+# Columns of the buffer of the revisions of a page (utils.RevisionBuffer),
+# the page title is its only field.
+#   0: page_id
+#   1: revision_id
+#   2: revision_parent_id (NO_PARENT if the revision has no parent)
+#   3: revision_timestamp (epoch seconds)
+buffer_columns = ('page_id',
+                  'revision_id',
+                  'revision_parent_id',
+                  'revision_timestamp',
+                  )
+
+# revision_parent_id in the buffer of a revision without a parent
+NO_PARENT = -1
 
 
 # CSV headers
@@ -96,11 +130,11 @@ csv_header = ('page_id',
               )
 
 
-# page.id,
-# page.title,
-# page.revision.id,
-# page.revision.parent_id,
-# page.revision.timestamp,
+# revision.page_id,
+# revision.page_title,
+# revision.id,
+# revision.parent_id,
+# revision.timestamp,
 csv_header_output = ('page_id',
                      'page_title',
                      'revision_id',
@@ -109,251 +143,542 @@ csv_header_output = ('page_id',
                      )
 
 
-def process_lines(
-        dump: Iterable[list],
-        timestamps: Iterable[arrow.arrow.Arrow],
-        stats: Mapping,
-        only_last_revision: bool,
-        skip_header: bool) -> Iterator[list]:
-    """Assign each revision to the snapshot or snapshots to which they
-       belong.
+# revision.page_id,
+# revision.page_title,
+# revision.id,
+# revision.parent_id,
+# revision.timestamp,
+# valid_from,
+# valid_to
+csv_header_intervals = csv_header_output + ('valid_from',
+                                            'valid_to',
+                                            )
+
+
+def read_revisions(
+        dump: Iterable[str],
+        skip_header: bool,
+        progress: Optional[utils.Progress]=None) -> Iterator[Revision]:
+    """Parse the input with a single CSV reader and yield a typed record for
+       each revision.
+
+    Lines that can not be parsed are skipped.
     """
+    if progress is None:
+        progress = utils.Progress()
+
+    reader = csv.reader(dump)
 
     # skip header
     if skip_header:
-        next(dump)
+        next(reader, None)
 
-    header = csv_header
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error:
+            continue
 
-    dump_page = None
-    dump_prevpage = None
+        progress.line()
 
-    i = 0
-    page_revisions = []
+        # 0: page_id
+        # 1: page_title
+        # 2: revision_id
+        # 3: revision_parent_id
+        # 4: revision_timestamp
+        try:
+            revision = Revision(int(row[0]),
+                                row[1],
+                                int(row[2]),
+                                int(row[3]) if row[3] else None,
+                                utils.parse_timestamp(row[4]),
+                                )
+        except (IndexError, ValueError, arrow.parser.ParserError):
+            continue
 
-    old_revision = None
-    revision = None
-    is_last_revision = False
-    break_flag = False
+        yield revision
 
-    counter = 0
 
-    # equivalent to
-    # for revision in dump:
-    while True:
-        if break_flag:
-            break
+def buffer_revision(page: utils.RevisionBuffer, revision: Revision) -> None:
+    """Append a revision to the buffer of its page."""
+    parent_id = revision.parent_id
+    page.append((revision.page_id,
+                 revision.id,
+                 NO_PARENT if parent_id is None else parent_id,
+                 revision.timestamp,
+                 ),
+                (revision.page_title, ))
+
+
+def page_revision(page: utils.RevisionBuffer, index: int) -> Revision:
+    """Return the revision at index in the buffer of a page."""
+    page_id, revision_id, parent_id, timestamp = page.row(index)
+    return Revision(page_id,
+                    page.field(index, 0),
+                    revision_id,
+                    None if parent_id == NO_PARENT else parent_id,
+                    timestamp,
+                    )
 
-        old_revision = revision
-        revision = next(dump, None)
 
+def page_revisions(
+        page: utils.RevisionBuffer) -> Callable[[int], Revision]:
+    """Return a function that gives the revision at an index in the buffer of
+       a page, each revision is built once.
+    """
+    revisions = {}
+
+    def get_revision(index: int) -> Revision:
+        revision = revisions.get(index)
         if revision is None:
-            revision = old_revision
-            is_last_revision = True
+            revision = revisions[index] = page_revision(page, index)
+        return revision
 
-        # read the line in a StringIO object and parse it with the csv module
-        try:
-            revision_parsed = [l for l in csv.reader(StringIO(revision))][0]
-        except (csv.Error, TypeError) as err:
+    return get_revision
+
+
+def read_pages(
+        revisions: Iterable[Revision],
+        stats: Mapping,
+        progress: Optional[utils.Progress]=None
+        ) -> Iterator[utils.RevisionBuffer]:
+    """Group consecutive revisions of the same page and yield them sorted by
+       timestamp, in a buffer.
+
+    The order is checked while the revisions of a page are read, only the
+    pages that are out of order are sorted and counted.
+    """
+    if progress is None:
+        progress = utils.Progress()
+
+    prev_revision_id = None
+    for page_id, page_revisions in itertools.groupby(
+            revisions, key=operator.attrgetter('page_id')):
+
+        stats['performance']['pages_analyzed'] += 1
+        progress.page()
+
+        page = utils.RevisionBuffer(buffer_columns, nfields=1)
+        in_order = True
+        last_timestamp = None
+        for revision in page_revisions:
+            stats['performance']['link_analyzed'] += 1
+            if revision.id != prev_revision_id:
+                stats['performance']['revisions_analyzed'] += 1
+            prev_revision_id = revision.id
+
+            if last_timestamp is not None and \
+                    revision.timestamp < last_timestamp:
+                in_order = False
+            last_timestamp = revision.timestamp
+
+            buffer_revision(page, revision)
+
+        if in_order:
+            yield page
             continue
 
-        revision_data = dict(zip(header, revision_parsed))
-        # Let:
-        # prevpage  be the id of the page that we analyzed in the previous
-        #           revision.
-        # page      be the id of the page we are processing now in the
-        #           dump.
-        # ct        be the timestamp of the revision we are processing now
-        #           in the dump.
-        # pt        be the timestamp of the previous revision.
-        # prevts    be the previous timestamp that we tried
-        # ts        be the timestamp of the snapshot that we want to
-        #           create.
-        #
-        # CASE 1 - prevpage and page are the same
-        #
-        # We have that:
-        # * if prevage is None, then pt = EPOCH (-inf)
-        # * pt <= ct for all revisions (implied).
-        #
-        # then:
-        # if pt > ts:
-        #     # ct > ts is implied, so ct >= pt > ts
-        #     # the timestamps of all the revisions that we want to
-        #     # analyze will be greater than ts
-        #     jump to new page
-        #
-        # elif ct > ts:
-        #     # pt <= ts is implied, so pt <= ts < cs
-        #     the previous revision is in the snapshot
-        #
-        # else:
-        #     # pt <= ts and ct <= ts, so pt <= ct <= ts
-        #     # there may be a further time in the snapshopt
-        #     check another revision
-        #
-        # CASE 2 - prevpage and page differ
-        #
-        # If prevpage and pagetitle differ then pt was the maximum
-        # revision available.
-        #
-        # prevpage is in the snapshot with pt, we still have to
-        # check ct for the current page. In this case the pt
-        # wrt the current page is the EPOCH and prevpage wrt
-        # the current page is None.
-
-        # prevpage is set outside the loop to None
-        # page = get value
-
-        # ct = get value
-        # pt = get_value if prevpage is not None else EPOCH
-
-        dump_page = Page(
-            revision_data['page_id'],
-            revision_data['page_title'],
-            Revision(revision_data['revision_id'],
-                     revision_data['revision_parent_id'],
-                     arrow.get(revision_data['revision_timestamp'])
-                     ))
-
-        if dump_prevpage is None or dump_prevpage.id != dump_page.id:
-            # we are starting now or we have a new page
-            counter = 0
-            utils.log("Processing", dump_page.title)
-            stats['performance']['pages_analyzed'] += 1
-
-        if dump_prevpage is None or \
-                dump_prevpage.revision.id != dump_page.revision.id:
-            stats['performance']['revisions_analyzed'] += 1
-
-        if not is_last_revision and \
-                (dump_prevpage is None or dump_prevpage.id == dump_page.id):
-            # it is not the last revision, futhermore two cases:
-            #   * dump_prevpage is None: we are reading the first line of the
-            #     dump file
-            #   * dump_prevpage.id == dump_page.id we are reading a page whose
-            #     is is the same as the previous one we read
-            # so, either we just started or we are in the middle of the
-            # history of a page. What we do is we just add the revision to the
-            # list.
-
-            counter = counter + 1
-
-            if counter % NPRINTREVISION == 1:
-                utils.dot()
-
-            page_revisions.append(dump_page)
-            dump_prevpage = dump_page
+        # sort all the revision by timestamp (they are not guaranted to be
+        # ordered), sorted() is stable so revisions with the same timestamp
+        # keep the order in which they appear in the dump.
+        stats['performance']['pages_out_of_order'] += 1
+        yield page.sorted('revision_timestamp')
 
-        else:
-            # cases:
-            #   * this is the last revision of the dump
-            #     (is_last_revision is True)
-            #   * we have changed to a new page (dump_prevpage is not None
-            #     and dump_prevpage.id != dump_page.id)
-
-            # sort all the revision by timestamp (they are not guaranted to be
-            # ordered)
-            sorted_revisions = sorted(page_revisions,
-                                      key=lambda pg: pg.revision.timestamp)
-
-            # if we only want the sorted_revisions list is limited to the
-            # last element.
-
-            # Note: don't try to bee to smart and think that one can skip
-            # reading all revisions and just take the last that is encountered,
-            # that is when page.id changes, i.e.
-            #     when dump_prevpage.id != dump_page.id
-            # because as said in the previous comment we are not assured that
-            # all revisions will be in the correct order, so we still need to
-            # collect them all, sort them and take the last one.
-            if only_last_revision:
-                sorted_revisions = [sorted_revisions[-1]]
-
-            # we are not interested to the new page for the moment, put it in
-            # the list
-            dump_prevpage = dump_page
-            page_revisions = [dump_page]
-
-            i = 0
-            j = 0
-            prevpage = None
-            while j < len(sorted_revisions):
-                page = sorted_revisions[j]
-
-                ct = page.revision.timestamp
-                pt = prevpage.revision.timestamp if prevpage else EPOCH
-
-                while i < len(timestamps):
-                    ts = timestamps[i]
-
-                    if not prevpage:
-                        # page contains the first revision for this page
-
-                        if ct > ts:
-                            # the page did not exist at the time
-                            # check another timestamp
-                            # print("ct {} > ts {}".format(ct, ts))
-
-                            i = i + 1
-                            continue
-
-                        else:
-                            # ct <= ts
-                            # check another revision
-                            # print("ct {} <= ts {}".format(ct, ts))
-
-                            # update step
-                            prevpage = page
-                            j = j + 1
-
-                            if j < len(sorted_revisions):
-                                break
-                    else:
-
-                        if pt > ts:
-                            # check the other timestamps
-                            # print("pt {} > ts {}" .format(pt, ts))
-
-                            i = i + 1
-                            continue
-
-                        elif ct > ts:
-                            # the previous revision is in the snapshot
-                            # check another timestamp
-                            # print("ct {} > ts {}".format(ct, ts))
-
-                            i = i + 1
-
-                            # print("{} -> {}".format(prevpage, ts), end='')
-                            # print(" - j: {}".format(j))
-                            yield (prevpage, ts)
-
-                            continue
-
-                        else:
-                            # check another revision
-                            # print("ct {} <= ts {}, pt {} <= ts {}"
-                            #       .format(ct, ts, pt, ts))
-
-                            # update step
-                            prevpage = page
-                            j = j + 1
-                            if j < len(sorted_revisions):
-                                break
-
-                    if j >= len(sorted_revisions):
-                        i = i + 1
-
-                        # print("--- {} -> {}".format(page, ts), end='')
-                        # print(" - j: {}".format(j))
-                        yield (page, ts)
-
-            if is_last_revision:
-                break_flag = True
 
-        if not is_last_revision:
+def read_last_revisions(
+        revisions: Iterable[Revision],
+        stats: Mapping,
+        progress: Optional[utils.Progress]=None
+        ) -> Iterator[utils.RevisionBuffer]:
+    """Group consecutive revisions of the same page and yield a buffer with
+       only the last one by timestamp.
+
+    This is the last revision of the buffer yielded by read_pages, found while
+    reading the page: only the latest revision seen so far is kept, instead
+    of all the revisions of the page.
+    """
+    if progress is None:
+        progress = utils.Progress()
+
+    prev_revision_id = None
+    for page_id, page_revisions in itertools.groupby(
+            revisions, key=operator.attrgetter('page_id')):
+
+        stats['performance']['pages_analyzed'] += 1
+        progress.page()
+
+        last_revision = None
+        in_order = True
+        last_timestamp = None
+        for revision in page_revisions:
             stats['performance']['link_analyzed'] += 1
+            if revision.id != prev_revision_id:
+                stats['performance']['revisions_analyzed'] += 1
+            prev_revision_id = revision.id
+
+            if last_timestamp is not None and \
+                    revision.timestamp < last_timestamp:
+                in_order = False
+            last_timestamp = revision.timestamp
+
+            # Note: don't take just the last revision that is encountered,
+            # revisions are not guaranteed to be in order. With the same
+            # timestamp the last one in the dump wins, as it would be the
+            # last after the stable sort of read_pages.
+            if last_revision is None or \
+                    revision.timestamp >= last_revision.timestamp:
+                last_revision = revision
+
+        if not in_order:
+            stats['performance']['pages_out_of_order'] += 1
+
+        page = utils.RevisionBuffer(buffer_columns, nfields=1)
+        buffer_revision(page, last_revision)
+        yield page
+
+
+def assign_snapshots(
+        page: utils.RevisionBuffer,
+        timestamps: List[arrow.arrow.Arrow],
+        epochs: List[int]
+        ) -> Iterator[Tuple[Revision, arrow.arrow.Arrow]]:
+    """Assign the revisions of a page, sorted by timestamp, to the
+       snapshots in which they are the current revision.
+
+    This engine scans revisions and timestamps together, comparing their
+    epochs one by one.
+    """
+    # Let:
+    # prevpage  be the index of the previous revision of the page.
+    # current   be the index of the revision we are processing now.
+    # ct        be the timestamp of the revision we are processing now.
+    # pt        be the timestamp of the previous revision.
+    # ts        be the timestamp of the snapshot that we want to
+    #           create.
+    #
+    # We have that:
+    # * if prevpage is None, then pt = EPOCH (-inf)
+    # * pt <= ct for all revisions (implied).
+    #
+    # then:
+    # if pt > ts:
+    #     # ct > ts is implied, so ct >= pt > ts
+    #     # the timestamps of all the revisions that we want to
+    #     # analyze will be greater than ts
+    #     check another timestamp
+    #
+    # elif ct > ts:
+    #     # pt <= ts is implied, so pt <= ts < cs
+    #     the previous revision is in the snapshot
+    #
+    # else:
+    #     # pt <= ts and ct <= ts, so pt <= ct <= ts
+    #     # there may be a further time in the snapshopt
+    #     check another revision
+    revision_epochs = page.column('revision_timestamp')
+    nrevisions = len(page)
+    get_revision = page_revisions(page)
+
+    i = 0
+    j = 0
+    prevpage = None
+    while j < nrevisions:
+        current = j
+
+        ct = revision_epochs[current]
+        pt = (revision_epochs[prevpage] if prevpage is not None
+              else EPOCH.timestamp)
+
+        while i < len(timestamps):
+            ts = timestamps[i]
+            epoch = epochs[i]
+
+            if prevpage is None:
+                # current is the first revision for this page
+
+                if ct > epoch:
+                    # the page did not exist at the time
+                    # check another timestamp
+                    i = i + 1
+                    continue
+
+                else:
+                    # ct <= ts
+                    # check another revision
+
+                    # update step
+                    prevpage = current
+                    j = j + 1
+
+                    if j < nrevisions:
+                        break
+            else:
+
+                if pt > epoch:
+                    # check the other timestamps
+                    i = i + 1
+                    continue
+
+                elif ct > epoch:
+                    # the previous revision is in the snapshot
+                    # check another timestamp
+                    i = i + 1
+
+                    yield (get_revision(prevpage), ts)
+
+                    continue
+
+                else:
+                    # check another revision
+
+                    # update step
+                    prevpage = current
+                    j = j + 1
+                    if j < nrevisions:
+                        break
+
+            if j >= nrevisions:
+                i = i + 1
+
+                yield (get_revision(current), ts)
+
+
+def bisect_snapshots(
+        page: utils.RevisionBuffer,
+        timestamps: List[arrow.arrow.Arrow],
+        epochs: List[int]
+        ) -> Iterator[Tuple[Revision, arrow.arrow.Arrow]]:
+    """Assign the revisions of a page, sorted by timestamp, to the
+       snapshots in which they are the current revision.
+
+    This engine works on integer epochs: for each snapshot, the current
+    revision is the last one with a timestamp lower or equal to the snapshot
+    timestamp, and it is found with a binary search over the revision times.
+    """
+    if len(page) == 0:
+        return
+
+    revision_epochs = page.column('revision_timestamp')
+    get_revision = page_revisions(page)
+
+    # snapshots before the first revision do not contain the page
+    first = bisect.bisect_left(epochs, revision_epochs[0])
+
+    j = 0
+    for i in range(first, len(epochs)):
+        # revisions are sorted, so we can start searching from the revision
+        # found for the previous snapshot.
+        j = bisect.bisect_right(revision_epochs, epochs[i], lo=j) - 1
+        yield (get_revision(j), timestamps[i])
+
+
+# snapshot assignment engines
+ENGINES = {
+    'scan': assign_snapshots,
+    'bisect': bisect_snapshots,
+}
+
+
+def read_columns(
+        revisions: Iterable[Revision],
+        stats: Mapping) -> Mapping:
+    """Load all the revisions of the input in columnar NumPy arrays.
+
+    Page titles are kept in a list, consecutive revisions with the same
+    title share the same string.
+    """
+    page_ids = array('q')
+    revision_ids = array('q')
+    parent_ids = array('q')
+    has_parent = array('b')
+    times = array('q')
+    titles = []
+
+    prev_title = None
+    for revision in revisions:
+        page_ids.append(revision.page_id)
+        revision_ids.append(revision.id)
+        if revision.parent_id is None:
+            parent_ids.append(0)
+            has_parent.append(0)
+        else:
+            parent_ids.append(revision.parent_id)
+            has_parent.append(1)
+        times.append(revision.timestamp)
+
+        if revision.page_title != prev_title:
+            prev_title = revision.page_title
+        titles.append(prev_title)
+
+    columns = {
+        'page_id': numpy.frombuffer(page_ids, dtype=numpy.int64),
+        'revision_id': numpy.frombuffer(revision_ids, dtype=numpy.int64),
+        'parent_id': numpy.frombuffer(parent_ids, dtype=numpy.int64),
+        'has_parent': numpy.frombuffer(has_parent, dtype=numpy.int8),
+        'timestamp': numpy.frombuffer(times, dtype=numpy.int64),
+        'page_title': titles,
+    }
+
+    nrows = len(page_ids)
+    stats['performance']['link_analyzed'] += nrows
+    if nrows > 0:
+        stats['performance']['revisions_analyzed'] += 1 + int(
+            numpy.count_nonzero(columns['revision_id'][1:] !=
+                                columns['revision_id'][:-1]))
+
+    return columns
+
+
+def numpy_snapshots(
+        revisions: Iterable[Revision],
+        timestamps: List[arrow.arrow.Arrow],
+        stats: Mapping,
+        only_last_revision: bool
+        ) -> Iterator[Tuple[Revision, arrow.arrow.Arrow]]:
+    """Assign each revision to the snapshots to which they belong, working
+       on the whole input at once.
+
+    Pages are the runs of consecutive revisions with the same page id, as in
+    read_pages. The revisions are sorted with one stable lexsort by
+    (page, timestamp) and, for each page, the revisions valid at every
+    snapshot are found with a single batched searchsorted.
+    """
+    columns = read_columns(revisions, stats)
+    nrows = len(columns['page_id'])
+    if nrows == 0:
+        return
+
+    epochs = numpy.array([ts.timestamp for ts in timestamps],
+                         dtype=numpy.int64)
+
+    # number each run of consecutive revisions of the same page
+    page_ids = columns['page_id']
+    runs = numpy.zeros(nrows, dtype=numpy.int64)
+    numpy.cumsum(page_ids[1:] != page_ids[:-1], out=runs[1:])
+
+    # lexsort is stable, revisions with the same timestamp keep the order in
+    # which they appear in the dump.
+    order = numpy.lexsort((columns['timestamp'], runs))
+    times = columns['timestamp'][order]
+
+    starts = numpy.flatnonzero(numpy.diff(runs, prepend=-1))
+    ends = numpy.append(starts[1:], nrows)
+    stats['performance']['pages_analyzed'] += len(starts)
+
+    # pages with a revision older than the previous one in the dump
+    backwards = ((columns['timestamp'][1:] < columns['timestamp'][:-1]) &
+                 (runs[1:] == runs[:-1]))
+    stats['performance']['pages_out_of_order'] += len(
+        numpy.unique(runs[1:][backwards]))
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if only_last_revision:
+            start = end - 1
+        page_times = times[start:end]
+
+        # snapshots before the first revision do not contain the page
+        first = int(numpy.searchsorted(epochs, page_times[0], side='left'))
+        positions = numpy.searchsorted(page_times,
+                                       epochs[first:],
+                                       side='right') - 1
+        positions = order[start + positions]
+
+        page_revisions = {}
+        for i, row in enumerate(positions.tolist(), start=first):
+            revision = page_revisions.get(row)
+            if revision is None:
+                revision = Revision(
+                    int(page_ids[row]),
+                    columns['page_title'][row],
+                    int(columns['revision_id'][row]),
+                    (int(columns['parent_id'][row])
+                     if columns['has_parent'][row] else None),
+                    int(columns['timestamp'][row]),
+                    )
+                page_revisions[row] = revision
+
+            yield (revision, timestamps[i])
+
+
+def process_lines(
+        dump: Iterable[str],
+        timestamps: List[arrow.arrow.Arrow],
+        stats: Mapping,
+        only_last_revision: bool,
+        skip_header: bool,
+        engine: str='bisect'
+        ) -> Iterator[Tuple[Revision, arrow.arrow.Arrow]]:
+    """Assign each revision to the snapshot or snapshots to which they
+       belong.
+    """
+    progress = utils.Progress(source=fu.raw_file(dump))
+    revisions = read_revisions(dump,
+                               skip_header=skip_header,
+                               progress=progress)
+
+    if engine == 'numpy':
+        yield from numpy_snapshots(revisions,
+                                   timestamps,
+                                   stats,
+                                   only_last_revision=only_last_revision)
+        progress.close()
+        return
+
+    assign = ENGINES[engine]
+    epochs = [ts.timestamp for ts in timestamps]
+
+    # if we only want the last revision each page is reduced to its last
+    # revision while it is read.
+    read = read_last_revisions if only_last_revision else read_pages
+
+    for page in read(revisions, stats, progress=progress):
+        yield from assign(page, timestamps, epochs)
+
+    progress.close()
+
+
+def process_intervals(
+        dump: Iterable[str],
+        stats: Mapping,
+        only_last_revision: bool,
+        skip_header: bool
+        ) -> Iterator[Tuple[Revision, int, Optional[int]]]:
+    """Yield each revision together with the half-open interval
+       [valid_from, valid_to) in which it is the current revision of its
+       page, in epoch seconds.
+
+    valid_to is None for the last revision of a page. Revisions that are
+    immediately superseded by a revision with the same timestamp are never
+    the current revision, so they are not yielded.
+    """
+    progress = utils.Progress(source=fu.raw_file(dump))
+    revisions = read_revisions(dump,
+                               skip_header=skip_header,
+                               progress=progress)
+
+    read = read_last_revisions if only_last_revision else read_pages
+
+    for page in read(revisions, stats, progress=progress):
+        revision_epochs = page.column('revision_timestamp')
+        last = len(page) - 1
+        for index, epoch in enumerate(revision_epochs):
+            if index == last:
+                yield (page_revision(page, index), epoch, None)
+            elif epoch < revision_epochs[index + 1]:
+                yield (page_revision(page, index),
+                       epoch,
+                       revision_epochs[index + 1])
+
+    progress.close()
+
+
+def input_has_header(args) -> bool:
+    """Return True if the first line of the input is a header, for
+       graphsnapshot.sharding.
+    """
+    return args.skip_header
 
 
 def configure_subparsers(subparsers):
@@ -365,10 +690,18 @@ def configure_subparsers(subparsers):
     parser.add_argument(
         '--periodicity',
         type=str,
+        nargs='+',
         choices=['d', 'w', 'M', 'y'],
-        default='M',
-        help='Produce snapshot with daily (d), weekly (w), monthly (M) or'
-             'yearly periodicity (default = "M").'
+        help='Produce snapshot with daily (d), weekly (w), monthly (M) or '
+             'yearly periodicity, more than one series of snapshots can be '
+             'extracted in a single pass (default = "M", unless '
+             '--dates-file is given).'
+    )
+    parser.add_argument(
+        '--dates-file',
+        type=str,
+        help='File with the dates of the snapshots, one per line, '
+             'extracted as a series in addition to the periodic ones.'
     )
     parser.add_argument(
         '--skip-header',
@@ -390,14 +723,182 @@ def configure_subparsers(subparsers):
         action='store_true',
         help='Consider only the last revision for each page.',
     )
+    parser.add_argument(
+        '--engine',
+        type=str,
+        choices=sorted(ENGINES.keys()) + ['numpy'],
+        default='bisect',
+        help='Algorithm used to assign revisions to snapshots: "scan" '
+             'compares each revision with each timestamp, "bisect" uses a '
+             'binary search over the revision times, "numpy" loads the '
+             'whole input in memory and works on NumPy arrays '
+             '(default = "bisect").'
+    )
+    parser.add_argument(
+        '--output-format',
+        type=str,
+        choices=['snapshots', 'intervals'],
+        default='snapshots',
+        help='Write a file for each snapshot date (snapshots) or a single '
+             'file with each revision and the interval [valid_from, valid_to) '
+             'in which it is the current revision of its page (intervals) '
+             '(default = "snapshots").'
+    )
+    parser.add_argument(
+        '--max-open-files',
+        type=int,
+        default=fu.MAX_OPEN_FILES,
+        help='Maximum number of output files open at the same time '
+             '(default = {}).'.format(fu.MAX_OPEN_FILES)
+    )
+    parser.add_argument(
+        '--buffer-size',
+        type=int,
+        default=fu.MAX_BUFFER_SIZE // (1024 * 1024),
+        help='Memory used to buffer the output rows, in MB of UTF-8 text; '
+             'with --output-compression 7z the outputs are written '
+             'uncompressed and compressed at the end, so they need the disk '
+             'space of the uncompressed output '
+             '(default = {}).'.format(fu.MAX_BUFFER_SIZE // (1024 * 1024))
+    )
 
     parser.set_defaults(func=main)
 
 
+def output_row(revision: Revision) -> tuple:
+    """Return the output row of a revision, with a formatted timestamp."""
+    return revision._replace(
+        timestamp=utils.format_timestamp(revision.timestamp))
+
+
+def write_snapshots(
+        dump: Iterable[str],
+        basename: str,
+        series: List[Tuple[str, List[arrow.arrow.Arrow]]],
+        stats: Mapping,
+        args: argparse.Namespace) -> None:
+    """Write a file for each snapshot date of each series.
+
+    The revisions are assigned once to the dates of all the series. If there
+    is more than one series the name of the series is in the output names.
+    """
+    # the series of each date
+    date_series = collections.defaultdict(list)
+    for name, timestamps in series:
+        for ts in timestamps:
+            date_series[ts].append(name)
+    timestamps = sorted(date_series)
+
+    if len(series) == 1:
+        outname = basename + '.features.{date}.csv'
+    else:
+        outname = basename + '.features.{series}.{date}.csv'
+
+    if args.dry_run:
+        writers = fu.OutputPool(compression=None)
+        for ts, names in date_series.items():
+            for name in names:
+                writers.add((name, ts), os.devnull)
+    else:
+        # the output files are opened on demand by the pool, a limited
+        # number at a time.
+        writers = fu.OutputPool(
+            compression=args.output_compression,
+            max_open=args.max_open_files,
+            max_buffer=args.buffer_size * 1024 * 1024,
+        )
+        for ts, names in date_series.items():
+            for name in names:
+                filename = str(args.output_dir_path / outname)
+                filename = filename.format(series=name,
+                                           date=ts.format('YYYY-MM-DD'))
+
+                writers.add((name, ts), filename)
+
+    pages_generator = process_lines(
+        dump,
+        timestamps=timestamps,
+        stats=stats,
+        only_last_revision=args.only_last_revision,
+        skip_header=args.skip_header,
+        engine=args.engine,
+    )
+
+    with writers:
+        # write headers in each output file
+        for key in writers.keys():
+            writers.writerow(key, csv_header_output)
+
+        for revision, ts in pages_generator:
+            # revision.page_id,
+            # revision.page_title,
+            # revision.id,
+            # revision.parent_id,
+            # revision.timestamp,
+            row = output_row(revision)
+            for name in date_series[ts]:
+                writers.writerow((name, ts), row)
+
+
+def read_dates(path: str) -> List[arrow.arrow.Arrow]:
+    """Read the dates in a file, one per line, skipping empty lines and
+       comments (#).
+    """
+    dates = set()
+    with open(path, 'r') as dates_file:
+        for line in dates_file:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                dates.add(arrow.get(line))
+
+    return sorted(dates)
+
+
+def write_intervals(
+        dump: Iterable[str],
+        basename: str,
+        stats: Mapping,
+        args: argparse.Namespace) -> None:
+    """Write each revision once, with its validity interval."""
+    if args.dry_run:
+        intervals_output = open(os.devnull, 'wt')
+    else:
+        filename = str(args.output_dir_path /
+                       (basename + '.intervals.csv'))
+        intervals_output = fu.output_writer(
+            path=filename,
+            compression=args.output_compression,
+        )
+
+    intervals_generator = process_intervals(
+        dump,
+        stats=stats,
+        only_last_revision=args.only_last_revision,
+        skip_header=args.skip_header,
+    )
+
+    with intervals_output:
+        writer = csv.writer(intervals_output)
+        writer.writerow(csv_header_intervals)
+
+        for revision, valid_from, valid_to in intervals_generator:
+            # revision.page_id,
+            # revision.page_title,
+            # revision.id,
+            # revision.parent_id,
+            # revision.timestamp,
+            # valid_from,
+            # valid_to
+            writer.writerow(output_row(revision) + (
+                utils.format_timestamp(valid_from),
+                None if valid_to is None else utils.format_timestamp(valid_to),
+                ))
+
+
 def main(
         dump: Iterable[list],
         basename: str,
-        args: argparse.Namespace) -> None:
+        args: argparse.Namespace) -> Mapping:
     """Main function that parses the arguments and writes the output."""
     stats = {
         'performance': {
@@ -406,6 +907,7 @@ def main(
             'link_analyzed': 0,
             'revisions_analyzed': 0,
             'pages_analyzed': 0,
+            'pages_out_of_order': 0,
         },
         'section_names': {
             'global': collections.Counter(),
@@ -433,19 +935,28 @@ def main(
 
     # we add some margin to be safe
     last_date = last_date.replace(days=2).replace(seconds=-1)
-    endtime = last_date.replace(**PERIODICITY[args.periodicity](1))
 
-    period = PERIODICITY[args.periodicity]
-    nperiods = NPERIODS[args.periodicity](DELTA.days)
-    timestamps = [first_date.replace(**period(i))
-                  for i in range(nperiods)
-                  if first_date.replace(**period(i)) <= endtime and \
-                     first_date.replace(**period(i)) >= WIKIEPOCH
-                  ]
+    periodicities = args.periodicity
+    if periodicities is None:
+        periodicities = [] if args.dates_file else ['M']
+
+    series = []
+    for periodicity in sorted(set(periodicities), key=periodicities.index):
+        endtime = last_date.replace(**PERIODICITY[periodicity](1))
+
+        period = PERIODICITY[periodicity]
+        nperiods = NPERIODS[periodicity](DELTA.days)
+        timestamps = [first_date.replace(**period(i))
+                      for i in range(nperiods)
+                      if first_date.replace(**period(i)) <= endtime and \
+                         first_date.replace(**period(i)) >= WIKIEPOCH
+                      ]
+        series.append((SERIES_NAMES[periodicity], timestamps))
+
+    if args.dates_file:
+        series.append((DATES_SERIES, read_dates(args.dates_file)))
 
-    writers = {}
     if args.dry_run:
-        pages_output = open(os.devnull, 'wt')
         stats_output = open(os.devnull, 'wt')
     else:
         stats_filename = str(args.output_dir_path/
@@ -457,39 +968,12 @@ def main(
             path=stats_filename,
             compression=args.output_compression,
         )
-        for ts in timestamps:
-            filename = str(args.output_dir_path /
-                           (basename + '.features.{date}.csv'))
-            filename = filename.format(date=ts.format('YYYY-MM-DD'))
-
-            pages_output = fu.output_writer(
-                path=filename,
-                compression=args.output_compression,
-            )
-
-            writer = csv.writer(pages_output)
-            writers[ts] = writer
 
-    pages_generator = process_lines(
-        dump,
-        timestamps=timestamps,
-        stats=stats,
-        only_last_revision=args.only_last_revision,
-        skip_header=args.skip_header
-    )
+    if args.output_format == 'intervals':
+        write_intervals(dump, basename, stats, args)
+    else:
+        write_snapshots(dump, basename, series, stats, args)
 
-    # write headers in each output file
-    for ts in timestamps:
-        writers[ts].writerow(csv_header_output)
-
-    for page, ts in pages_generator:
-        writers[ts].writerow((
-            page.id,
-            page.title,
-            page.revision.id,
-            page.revision.parent_id,
-            page.revision.timestamp,
-        ))
     stats['performance']['end_time'] = datetime.datetime.utcnow()
 
     with stats_output:
@@ -498,3 +982,5 @@ def main(
             stats_output,
             stats=stats,
         )
+
+    return stats
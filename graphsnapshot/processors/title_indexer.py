@@ -0,0 +1,125 @@
+"""
+Write the title index of a snapshot.
+
+The output is a memory-mapped index of the titles of the pages in the
+snapshot, see graphsnapshot.title_index, that can be read in place of the
+snapshot by match-id, match-ngi-id, extract-link-snapshot and
+resolve-redirect with the --title-index option.
+"""
+
+import os
+import csv
+import datetime
+
+import regex
+from typing import Iterable, Mapping
+
+from .. import utils
+from .. import file_utils as fu
+from .. import dumper
+from .. import title_index
+from . import match_id
+
+
+stats_template = '''
+<stats>
+    <performance>
+        <start_time>${stats['performance']['start_time'] | x}</start_time>
+        <end_time>${stats['performance']['end_time'] | x}</end_time>
+    </performance>
+    <index>
+        <titles>${stats['index']['titles'] | x}</titles>
+        <redirects>${stats['index']['redirects'] | x}</redirects>
+    </index>
+</stats>
+'''
+
+
+# snapshot name regex
+#   * snapshot.2018-03-01.csv.gz
+#
+# 1: basename without the csv and compression extensions
+re_snapshot = regex.compile(r'(.+?)(?:\.csv)?(?:\.(gz|bz2|7z))?$')
+
+
+def indexed_basename(basename: str) -> str:
+    """Return the name of the title index of a snapshot."""
+    return title_index.index_path(re_snapshot.match(basename).group(1))
+
+
+def configure_subparsers(subparsers):
+    """Configure a new subparser ."""
+    parser = subparsers.add_parser(
+        'build-title-index',
+        help='Write the title index of a snapshot, to be read with '
+             '--title-index.',
+    )
+    parser.add_argument(
+        '--resolved-redirects',
+        action='store_true',
+        help="The snapshot has also resolved redirects, see match-id."
+    )
+    parser.add_argument(
+        '--skip-header',
+        action='store_true',
+        help="Skip input header."
+    )
+    parser.set_defaults(func=main)
+
+
+def main(
+        dump: Iterable[str],
+        basename: str,
+        args) -> Mapping:
+    """Main function that parses the arguments and writes the output."""
+    stats = {
+        'performance': {
+            'start_time': None,
+            'end_time': None,
+        },
+        'index': {
+            'titles': 0,
+            'redirects': 0,
+        },
+    }
+    stats['performance']['start_time'] = datetime.datetime.utcnow()
+
+    reader = csv.reader(dump)
+    if args.skip_header:
+        next(reader)
+
+    pages_in_snapshot, pages_redirected, ids_redirected = (
+        match_id.read_snapshot(reader=reader,
+                               resolved_redirects=args.resolved_redirects)
+        )
+
+    output_path = args.output_dir_path / indexed_basename(basename)
+    utils.log("Writing title index {}".format(output_path))
+
+    stats['index']['titles'] = title_index.build(
+        os.devnull if args.dry_run else output_path,
+        pages=pages_in_snapshot,
+        redirects=pages_redirected,
+        redirect_ids=ids_redirected,
+        resolved=args.resolved_redirects)
+    stats['index']['redirects'] = len(ids_redirected)
+
+    stats['performance']['end_time'] = datetime.datetime.utcnow()
+
+    if args.dry_run:
+        stats_output = open(os.devnull, 'wt')
+    else:
+        stats_output = fu.output_writer(
+            path=str(args.output_dir_path /
+                     (basename + '.build-title-index.stats.xml')),
+            compression=args.output_compression,
+        )
+
+    with stats_output:
+        dumper.render_template(
+            stats_template,
+            stats_output,
+            stats=stats,
+        )
+
+    return stats
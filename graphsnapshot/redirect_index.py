@@ -0,0 +1,211 @@
+"""Index the redirect history so that its state at any date is found by
+binary search.
+
+The index is a directory of NumPy arrays (.npy) with a row for each revision
+in the redirect history, sorted by page id and timestamp. Strings (page
+titles, redirect targets and sections) are stored once, concatenated in a
+byte array with their offsets.
+
+The state of the redirects at a date is, for each page, its last revision
+with a timestamp not after the date. The rows of all the pages are found at
+once with a single searchsorted over a composite (page_id, timestamp) key,
+over arrays that are memory-mapped, not parsed.
+"""
+
+import os
+from array import array
+
+import arrow
+import numpy
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from . import utils
+
+
+# suffix of the index directory
+INDEX_SUFFIX = '.index'
+
+# number of bits of the timestamp in the composite key, timestamps must be
+# in [0, 2**TIMESTAMP_BITS), that is before year 2514
+TIMESTAMP_BITS = 34
+MAX_PAGE_ID = 2**(63 - TIMESTAMP_BITS)
+
+
+# integer columns of the index
+#   * page_id
+#   * revision_id
+#   * revision_parent_id (-1 if missing)
+#   * revision_timestamp (epoch)
+#   * revision_minor
+#   * page_title (string id)
+#   * redirect.target (string id)
+#   * redirect.tosection (string id)
+COLUMNS = ('page_id',
+           'revision_id',
+           'revision_parent_id',
+           'revision_timestamp',
+           'revision_minor',
+           'page_title',
+           'redirect.target',
+           'redirect.tosection',
+           )
+
+
+def is_index(path: Union[str, os.PathLike]) -> bool:
+    """Return True if path is a redirect index directory."""
+    return os.path.isdir(str(path)) and \
+        os.path.exists(os.path.join(str(path), 'keys.npy'))
+
+
+def index_path(basename: str) -> str:
+    return basename + INDEX_SUFFIX
+
+
+def composite_keys(
+        page_ids: numpy.ndarray,
+        timestamps: numpy.ndarray) -> numpy.ndarray:
+    """Return the (page_id, timestamp) keys, sorted as the pairs."""
+    if len(page_ids) and (page_ids.min() < 0 or
+                          page_ids.max() >= MAX_PAGE_ID or
+                          timestamps.min() < 0 or
+                          timestamps.max() >= 2**TIMESTAMP_BITS):
+        raise ValueError("Page id or timestamp out of the range of the "
+                         "redirect index")
+    return (page_ids << TIMESTAMP_BITS) | timestamps
+
+
+def build(
+        reader: Iterable[List[str]],
+        path: Union[str, os.PathLike]) -> int:
+    """Build the index of the redirect history rows from reader (without
+       header) in the directory path, return the number of rows.
+
+    Rows that can not be parsed are skipped.
+    """
+    columns = {column: array('q') for column in COLUMNS}
+
+    strings = dict()
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    progress = utils.Progress('Indexing redirects')
+    for row in reader:
+        progress.line()
+
+        # 0: page_id
+        # 1: page_title
+        # 2: revision_id
+        # 3: revision_parent_id
+        # 4: revision_timestamp,
+        # 5: revision_minor
+        # 6: redirect.target
+        # 7: redirect.tosection
+        try:
+            values = (int(row[0]),
+                      int(row[2]),
+                      int(row[3]) if row[3] else -1,
+                      utils.parse_timestamp(row[4]),
+                      int(row[5]),
+                      string_id(row[1]),
+                      string_id(row[6]),
+                      string_id(row[7]),
+                      )
+        except (IndexError, ValueError, arrow.parser.ParserError):
+            continue
+
+        for column, value in zip(COLUMNS, values):
+            columns[column].append(value)
+
+    progress.close()
+
+    columns = {column: numpy.frombuffer(values, dtype=numpy.int64)
+               for column, values in columns.items()}
+
+    # the sort is stable, for the same page and timestamp the last row in
+    # the history is the one that is used
+    keys = composite_keys(columns['page_id'], columns['revision_timestamp'])
+    order = numpy.argsort(keys, kind='stable')
+
+    keys = keys[order]
+    page_ids = columns['page_id'][order]
+
+    # first row of each page
+    starts = numpy.flatnonzero(numpy.diff(page_ids, prepend=-1))
+
+    os.makedirs(str(path), exist_ok=True)
+    numpy.save(os.path.join(str(path), 'keys.npy'), keys)
+    numpy.save(os.path.join(str(path), 'pages.npy'), page_ids[starts])
+    numpy.save(os.path.join(str(path), 'page_starts.npy'), starts)
+    for column, values in columns.items():
+        numpy.save(os.path.join(str(path), column + '.npy'), values[order])
+
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(value) for value in encoded], out=offsets[1:])
+    numpy.save(os.path.join(str(path), 'strings.npy'),
+               numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8))
+    numpy.save(os.path.join(str(path), 'string_offsets.npy'), offsets)
+
+    return len(keys)
+
+
+class RedirectIndex:
+    """Memory-mapped redirect index."""
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        def load(name):
+            return numpy.load(os.path.join(str(path), name + '.npy'),
+                              mmap_mode='r')
+
+        self.keys = load('keys')
+        self.pages = load('pages')
+        self.page_starts = load('page_starts')
+        self.columns = {column: load(column) for column in COLUMNS}
+        self.strings = load('strings')
+        self.string_offsets = load('string_offsets')
+
+    def string(self, string_id: int) -> str:
+        start = self.string_offsets[string_id]
+        end = self.string_offsets[string_id + 1]
+        return self.strings[start:end].tobytes().decode('utf-8')
+
+    def rows_at(self, date: arrow.Arrow) -> numpy.ndarray:
+        """Return the row of the last revision not after date of each page.
+        """
+        epoch = min(max(date.timestamp, 0), 2**TIMESTAMP_BITS - 1)
+        queries = (numpy.asarray(self.pages) << TIMESTAMP_BITS) | epoch
+        rows = numpy.searchsorted(self.keys, queries, side='right') - 1
+
+        # skip the pages whose first revision is after date
+        return rows[rows >= self.page_starts]
+
+    def revisions_at(
+            self,
+            date: arrow.Arrow) -> Iterator[Tuple[int, str, int, int, int, int,
+                                                 str, str]]:
+        """Yield the last revision not after date of each page, as:
+           page_id, page_title, revision_id, revision_parent_id,
+           revision_timestamp (epoch), revision_minor, redirect.target,
+           redirect.tosection.
+        """
+        return self.revisions(self.rows_at(date))
+
+    def revisions(
+            self,
+            rows: numpy.ndarray) -> Iterator[Tuple[int, str, int, int, int,
+                                                   int, str, str]]:
+        """Yield the revisions at the given rows, as revisions_at."""
+        columns = [numpy.asarray(self.columns[column][rows]).tolist()
+                   for column in COLUMNS]
+
+        for (page_id, revision_id, parent_id, timestamp, minor,
+             title, target, tosection) in zip(*columns):
+            yield (page_id,
+                   self.string(title),
+                   revision_id,
+                   parent_id,
+                   timestamp,
+                   minor,
+                   self.string(target),
+                   self.string(tosection),
+                   )
@@ -0,0 +1,222 @@
+"""Run a processor over the input files, in this process or in a pool of
+worker processes, and summarize the run.
+
+Each input file is processed by a call of the processor main function.
+Outputs are named after the file, or after its date for match-id and
+match-ngi-id, while resolve-redirect-batch and pipeline write the same
+outputs for every file: processors with outputs not named after the file
+set an output_key function in their defaults. With more than one job the
+files are processed in worker processes, the largest first, so that a long
+file does not start last and keep the run going alone. Files with the same
+output key, among them a file given more than once, are processed one after
+the other by the same worker, in the order of the command line, as they
+would be by a single job. A single file can also be split in shards
+processed in parallel, see graphsnapshot.sharding.
+
+Runs of more than one file, or with more than one job, are summarized in
+<first file>.<command>.run.stats.xml, with the stats of the processor summed
+over the files.
+"""
+
+import os
+import time
+import datetime
+import collections
+import concurrent.futures
+
+from typing import Hashable, List, Mapping, NamedTuple, Optional
+
+from . import utils
+from . import file_utils
+from . import dumper
+from . import context
+from . import sharding
+
+
+run_stats_template = '''
+<%def name="render_stats(stats)">
+% for key, value in stats.items():
+    % if isinstance(value, dict):
+<group name="${key | x}">
+${render_stats(value)}
+</group>
+    % else:
+<stat name="${key | x}">${value | x}</stat>
+    % endif
+% endfor
+</%def>
+<stats>
+    <run>
+        <command>${command | x}</command>
+        <jobs>${jobs | x}</jobs>
+        <start_time>${start_time | x}</start_time>
+        <end_time>${end_time | x}</end_time>
+    </run>
+    <files>
+    % for file_run in runs:
+        <file name="${file_run.path | x}" size="${file_run.size | x}" elapsed="${'{:.3f}'.format(file_run.elapsed) | x}" />
+    % endfor
+    </files>
+    <total>
+${render_stats(total)}
+    </total>
+</stats>
+'''
+
+
+# - FileRun:
+#   - path: input file
+#   - size: size of the input file in bytes
+#   - elapsed: seconds spent processing the file
+#   - stats: stats returned by the processor
+FileRun = NamedTuple('FileRun', [
+    ('path', str),
+    ('size', int),
+    ('elapsed', float),
+    ('stats', Optional[Mapping]),
+])
+
+
+def file_size(path: os.PathLike) -> int:
+    try:
+        return os.path.getsize(str(path))
+    except OSError:
+        return 0
+
+
+def run_file(input_file_path: os.PathLike, args) -> FileRun:
+    """Process an input file with the processor in args.func."""
+    utils.log("Analyzing {}...".format(input_file_path))
+    start = time.monotonic()
+
+    dump = file_utils.open_csv_file(str(input_file_path))
+
+    basename = input_file_path.name
+
+    if getattr(args, 'shards', 1) > 1:
+        stats = sharding.run_sharded(input_file_path, dump, args)
+    else:
+        stats = args.func(
+            dump,
+            basename,
+            args,
+        )
+
+    # explicitly close input files
+    dump.close()
+
+    utils.log("Done Analyzing {}.".format(input_file_path))
+
+    return FileRun(str(input_file_path),
+                   file_size(input_file_path),
+                   time.monotonic() - start,
+                   stats)
+
+
+def output_key(input_file_path: os.PathLike, args) -> Hashable:
+    """Return the key of the outputs of an input file, files with the same
+       key write the same output files.
+    """
+    key_function = getattr(args, 'output_key', None)
+    if key_function is None:
+        return input_file_path.name
+    return key_function(input_file_path.name, args)
+
+
+def _run_files_in_worker(
+        input_file_paths: List[os.PathLike],
+        args) -> List[FileRun]:
+    # the cache of the worker is shared by the files it processes
+    args.context = context.worker()
+    return [run_file(input_file_path, args)
+            for input_file_path in input_file_paths]
+
+
+def run_files(args) -> List[FileRun]:
+    """Process all the input files, with args.file_jobs processes, and
+       return their runs in the order of args.files.
+    """
+    # files are identified by their position in args.files, files with
+    # the same outputs are grouped to be processed by the same worker
+    groups = collections.OrderedDict()
+    for index, input_file_path in enumerate(args.files):
+        groups.setdefault(output_key(input_file_path, args), []).append(index)
+
+    if args.file_jobs <= 1 or len(groups) <= 1:
+        return [run_file(input_file_path, args)
+                for input_file_path in args.files]
+
+    for indexes in groups.values():
+        if len(indexes) > 1:
+            utils.log("{} write the same outputs, they are processed one "
+                      "after the other."
+                      .format(', '.join(str(args.files[index])
+                                        for index in indexes)))
+
+    # largest groups first
+    order = sorted(groups.values(),
+                   key=lambda indexes: sum(file_size(args.files[index])
+                                           for index in indexes),
+                   reverse=True)
+
+    # each worker has its own context
+    run_context = args.context
+    args.context = None
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(args.file_jobs, len(order)),
+                initializer=context.init_worker,
+                initargs=(run_context.cache_size, )) as executor:
+            futures = [(indexes,
+                        executor.submit(_run_files_in_worker,
+                                        [args.files[index]
+                                         for index in indexes],
+                                        args))
+                       for indexes in order]
+            runs = dict()
+            for indexes, future in futures:
+                runs.update(zip(indexes, future.result()))
+    finally:
+        args.context = run_context
+
+    return [runs[index] for index in range(len(args.files))]
+
+
+def write_summary(
+        runs: List[FileRun],
+        args,
+        start_time: datetime.datetime,
+        end_time: datetime.datetime) -> None:
+    """Write the stats of the run, with the stats of the processor summed
+       over the input files, if the run has more than one file or job.
+    """
+    utils.log("Processed {} files in {}."
+              .format(len(runs), end_time - start_time))
+
+    if len(runs) <= 1 and args.file_jobs <= 1:
+        return
+
+    total = utils.sum_stats(file_run.stats for file_run in runs)
+
+    if args.dry_run:
+        stats_output = open(os.devnull, 'wt')
+    else:
+        # runs in the same output directory have different first files
+        stats_output = file_utils.output_writer(
+            path=str(args.output_dir_path /
+                     '{}.{}.run.stats.xml'.format(args.files[0].name,
+                                                  args.command)),
+            compression=args.output_compression,
+        )
+
+    with stats_output:
+        dumper.render_template(
+            run_stats_template,
+            stats_output,
+            command=args.command,
+            jobs=args.file_jobs,
+            start_time=start_time,
+            end_time=end_time,
+            runs=runs,
+            total=total,
+        )
@@ -0,0 +1,289 @@
+"""Process a single input file in parallel, split in shards of whole pages.
+
+The input is split in byte ranges whose boundaries are moved forward to the
+first line of a page, so that the lines of a page are always in the same
+shard, as the processors expect. Each shard is processed by the main
+function of the processor in a worker process, with the header of the input
+(if any) in front of it, writing its outputs in a directory of its own.
+The outputs of the shards are then concatenated in the order of the shards,
+that is in page order, with the header of each file written once; the stats
+files are written again with the stats summed over the shards.
+
+Compressed inputs are decompressed once to a temporary file, which can be
+split. A processor supports sharding if its module has an
+input_has_header(args) function, that tells if the first line of the input
+is a header.
+"""
+
+import io
+import os
+import sys
+import csv
+import copy
+import shutil
+import pathlib
+import tempfile
+import concurrent.futures
+
+import regex
+from typing import IO, List, Mapping, Optional, Tuple
+
+from . import utils
+from . import file_utils as fu
+from . import dumper
+from . import context
+
+
+# compressed file name regex
+#   * enwiki-20180301-pages-meta-history1.xml.features.csv.gz
+#
+# 1: ext
+re_compressed = regex.compile(r'.*\.(gz|bz2|7z)$')
+
+
+# page id at the start of a line
+re_page_id = regex.compile(rb'^([0-9]+),')
+
+
+# - a byte range of the input: (start, end)
+Range = Tuple[int, int]
+
+
+class RangeReader(io.RawIOBase):
+    """Read the given byte ranges of a file, one after the other."""
+
+    def __init__(self, path: str, ranges: List[Range]) -> None:
+        self._file = open(path, 'rb')
+        self._ranges = list(ranges)
+        self._position = None
+        self._end = None
+        self._next_range()
+
+    def _next_range(self) -> bool:
+        if not self._ranges:
+            return False
+        self._position, self._end = self._ranges.pop(0)
+        self._file.seek(self._position)
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._position >= self._end:
+            if not self._next_range():
+                return 0
+
+        size = min(len(buffer), self._end - self._position)
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def open_ranges(path: str, ranges: List[Range]) -> IO[str]:
+    """Open the given byte ranges of a file as a text stream."""
+    return io.TextIOWrapper(io.BufferedReader(RangeReader(path, ranges)),
+                            encoding='utf-8')
+
+
+def page_id(line: bytes, ncolumns: int) -> Optional[int]:
+    """Return the page id of a line of the input, None if the line is not
+       the first line of a row with ncolumns columns.
+    """
+    match = re_page_id.match(line)
+    if match is None:
+        return None
+
+    row = next(csv.reader([line.decode('utf-8', errors='replace')]), [])
+    if len(row) != ncolumns:
+        return None
+
+    return int(match.group(1))
+
+
+def page_start(
+        infile: IO[bytes],
+        offset: int,
+        ncolumns: int) -> Optional[int]:
+    """Return the offset of the first line of the first page that starts
+       after offset, None if there is none.
+    """
+    infile.seek(offset)
+    # skip the line that contains offset
+    infile.readline()
+
+    prev_page_id = None
+    while True:
+        position = infile.tell()
+        line = infile.readline()
+        if not line:
+            return None
+
+        line_page_id = page_id(line, ncolumns)
+        if line_page_id is None:
+            continue
+
+        if prev_page_id is not None and line_page_id != prev_page_id:
+            return position
+        prev_page_id = line_page_id
+
+
+def split(
+        path: str,
+        nshards: int,
+        has_header: bool) -> Tuple[int, List[Range]]:
+    """Split the file at path in at most nshards ranges of whole pages.
+
+    Return the length of the header and the ranges.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as infile:
+        first_line = infile.readline()
+        header_length = len(first_line) if has_header else 0
+        ncolumns = len(next(csv.reader([first_line.decode('utf-8')]), []))
+
+        offsets = [header_length]
+        for shard in range(1, nshards):
+            target = header_length + (size - header_length) * shard // nshards
+            if target <= offsets[-1]:
+                continue
+
+            offset = page_start(infile, target, ncolumns)
+            if offset is None:
+                break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+
+    offsets.append(size)
+    return header_length, list(zip(offsets[:-1], offsets[1:]))
+
+
+def process_shard(
+        path: str,
+        ranges: List[Range],
+        basename: str,
+        args) -> Optional[Mapping]:
+    """Process the given ranges of the input with the processor in args."""
+    args.context = context.worker()
+    dump = open_ranges(path, ranges)
+    try:
+        return args.func(dump, basename, args)
+    finally:
+        dump.close()
+
+
+def merge_outputs(
+        shard_dirs: List[pathlib.Path],
+        args,
+        stats_template: str,
+        stats: Mapping) -> None:
+    """Concatenate the outputs of the shards in args.output_dir_path and
+       write the stats files with the given stats.
+    """
+    names = []
+    for shard_dir in shard_dirs:
+        names.extend(name for name in sorted(os.listdir(str(shard_dir)))
+                     if name not in names)
+
+    for name in names:
+        output = fu.output_writer(path=str(args.output_dir_path / name),
+                                  compression=args.output_compression)
+
+        with output:
+            if name.endswith('.xml'):
+                dumper.render_template(stats_template, output, stats=stats)
+                continue
+
+            header = None
+            for shard_dir in shard_dirs:
+                shard_path = shard_dir / name
+                if not shard_path.exists():
+                    continue
+
+                with open(str(shard_path), 'rt', encoding='utf-8',
+                          newline='') as shard_output:
+                    first_line = shard_output.readline()
+                    if header is None:
+                        header = first_line
+                        output.write(first_line)
+                    elif first_line != header:
+                        output.write(first_line)
+                    shutil.copyfileobj(shard_output, output)
+
+
+def run_sharded(
+        input_file_path: pathlib.Path,
+        dump: IO[str],
+        args) -> Optional[Mapping]:
+    """Process the input file in args.shards shards, in parallel, and return
+       the stats summed over the shards.
+    """
+    module = sys.modules[args.func.__module__]
+    input_has_header = getattr(module, 'input_has_header', None)
+    if input_has_header is None:
+        raise ValueError("{} can not process an input in shards"
+                         .format(args.command))
+
+    basename = input_file_path.name
+    with tempfile.TemporaryDirectory(
+            prefix=basename + '.',
+            dir=str(args.output_dir_path)) as tmpdir:
+
+        if re_compressed.match(basename):
+            # only an uncompressed file can be split
+            path = os.path.join(tmpdir, 'input.csv')
+            utils.log("Decompressing {} to {}".format(input_file_path, path))
+            with open(path, 'wt', encoding='utf-8', newline='') as plain:
+                shutil.copyfileobj(dump, plain)
+        else:
+            path = str(input_file_path)
+
+        header_length, ranges = split(path,
+                                      args.shards,
+                                      has_header=input_has_header(args))
+        utils.log("Processing {} in {} shards".format(input_file_path,
+                                                      len(ranges)))
+
+        shard_dirs = []
+        shard_args = []
+        for shard in range(len(ranges)):
+            shard_dir = pathlib.Path(tmpdir) / 'shard-{:04d}'.format(shard)
+            shard_dir.mkdir()
+            shard_dirs.append(shard_dir)
+
+            # shards write uncompressed files, which are merged
+            shard_arg = copy.copy(args)
+            shard_arg.output_dir_path = shard_dir
+            shard_arg.output_compression = None
+            shard_arg.shards = 1
+            shard_arg.context = None
+            shard_args.append(shard_arg)
+
+        # each shard is read after the header
+        shard_ranges = [[(0, header_length), shard_range] if header_length
+                        else [shard_range]
+                        for shard_range in ranges]
+
+        cache_size = context.of(args).cache_size
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=len(ranges),
+                initializer=context.init_worker,
+                initargs=(cache_size, )) as executor:
+            futures = [executor.submit(process_shard,
+                                       path,
+                                       shard_range,
+                                       basename,
+                                       shard_arg)
+                       for shard_range, shard_arg in zip(shard_ranges,
+                                                         shard_args)]
+            shards_stats = [future.result() for future in futures]
+
+        stats = utils.sum_stats(shards_stats)
+        merge_outputs(shard_dirs, args, module.stats_template, stats)
+
+    return stats
@@ -0,0 +1,341 @@
+"""Immutable, memory-mapped index of the titles of a snapshot.
+
+The index maps the titles of the pages in a snapshot, normalized with
+utils.normalize_wikititle, to their page id and, for snapshots with resolved
+redirects, to the title of the page they redirect to. It also maps the ids
+of the redirects to the ids of their targets. It has the same content as the
+dictionaries built by match_id.read_snapshot.
+
+The index is a single file, mapped in memory when it is opened: opening it
+takes no time and the pages of the file are shared, through the page cache,
+among all the processes that use it. The file has a header, followed by
+arrays of native int64 and by the titles encoded in UTF-8:
+
+    * header: magic, version, resolved, nslots, nentries, nids, keys_size
+    * slots[nslots]: open-addressing hash table (linear probing) of the
+      titles, each slot has the index of an entry plus one, 0 if empty
+    * key_offsets[nentries + 1]: offsets of the titles of the entries
+    * page_ids[nentries]: page id of each entry
+    * redirects[nentries]: entry of the redirect target of each entry, -1
+      if the page is not a redirect
+    * redirect_sources[nids], redirect_targets[nids]: ids of the redirects
+      and of their targets, sorted by the former
+    * keys[keys_size]: the titles
+"""
+
+import os
+import mmap
+import zlib
+import bisect
+import collections.abc
+from array import array
+
+from typing import Any, Iterator, Mapping, Optional, Union
+
+from . import utils
+
+
+# suffix of the index file
+INDEX_SUFFIX = '.title-index'
+
+MAGIC = int.from_bytes(b'GSTITLES', 'little')
+VERSION = 1
+
+# header fields
+HEADER = ('magic',
+          'version',
+          'resolved',
+          'nslots',
+          'nentries',
+          'nids',
+          'keys_size',
+          )
+
+# size of an int64
+ITEMSIZE = 8
+
+
+def index_path(basename: str) -> str:
+    return basename + INDEX_SUFFIX
+
+
+def title_hash(key: bytes) -> int:
+    """Hash of a title, the same in all processes."""
+    return zlib.crc32(key)
+
+
+def build(
+        path: Union[str, os.PathLike],
+        pages: Mapping[str, int],
+        redirects: Mapping[str, str],
+        redirect_ids: Mapping[int, int],
+        resolved: bool) -> int:
+    """Write the index of the given titles to path, return the number of
+       titles.
+
+    pages, redirects and redirect_ids are the dictionaries returned by
+    match_id.read_snapshot. The targets of the redirects must be in pages.
+    """
+    titles = list(pages)
+    entries = {title: index for index, title in enumerate(titles)}
+    keys = [title.encode('utf-8') for title in titles]
+
+    key_offsets = array('q', [0])
+    for key in keys:
+        key_offsets.append(key_offsets[-1] + len(key))
+
+    page_ids = array('q', (pages[title] for title in titles))
+    redirect_entries = array('q', (entries[redirects[title]]
+                                   if title in redirects else -1
+                                   for title in titles))
+
+    # the table is at most half full
+    nslots = 1
+    while nslots < 2 * len(keys):
+        nslots = nslots * 2
+    mask = nslots - 1
+
+    slots = array('q', bytes(nslots * ITEMSIZE))
+    for index, key in enumerate(keys):
+        slot = title_hash(key) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+
+    redirect_sources = array('q', sorted(redirect_ids))
+    redirect_targets = array('q', (redirect_ids[source]
+                                   for source in redirect_sources))
+
+    header = array('q', [MAGIC,
+                         VERSION,
+                         int(resolved),
+                         nslots,
+                         len(keys),
+                         len(redirect_sources),
+                         key_offsets[-1],
+                         ])
+
+    with open(str(path), 'wb') as outfile:
+        for section in (header,
+                        slots,
+                        key_offsets,
+                        page_ids,
+                        redirect_entries,
+                        redirect_sources,
+                        redirect_targets):
+            outfile.write(section.tobytes())
+        for key in keys:
+            outfile.write(key)
+
+    return len(keys)
+
+
+class TitleIndex:
+    """Memory-mapped title index.
+
+    The pages, redirects and redirect_ids attributes are read-only mappings
+    that can be used in place of the dictionaries returned by
+    match_id.read_snapshot, until the index is closed.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.path = str(path)
+        with open(self.path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        self._views = [view]
+
+        offset = len(HEADER) * ITEMSIZE
+        header = dict(zip(HEADER, view[:offset].cast('q')))
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError("{} is not a title index".format(self.path))
+
+        self.resolved = bool(header['resolved'])
+        self._nentries = header['nentries']
+
+        def section(length):
+            nonlocal offset
+            start = offset
+            offset = offset + length * ITEMSIZE
+            self._views.append(view[start:offset].cast('q'))
+            return self._views[-1]
+
+        self._slots = section(header['nslots'])
+        self._key_offsets = section(header['nentries'] + 1)
+        self._page_ids = section(header['nentries'])
+        self._redirects = section(header['nentries'])
+        self._redirect_sources = section(header['nids'])
+        self._redirect_targets = section(header['nids'])
+        self._keys = view[offset:offset + header['keys_size']]
+        self._views.append(self._keys)
+        self._mask = header['nslots'] - 1
+
+        self.pages = _Pages(self)
+        self.redirects = _Redirects(self)
+        self.redirect_ids = _RedirectIds(self)
+
+    def entry(self, title: str) -> int:
+        """Return the entry of title, -1 if it is not in the index."""
+        if not self._nentries:
+            return -1
+
+        key = title.encode('utf-8')
+        slot = title_hash(key) & self._mask
+        while True:
+            index = self._slots[slot]
+            if not index:
+                return -1
+
+            index = index - 1
+            if self._keys[self._key_offsets[index]:
+                          self._key_offsets[index + 1]] == key:
+                return index
+
+            slot = (slot + 1) & self._mask
+
+    def title(self, index: int) -> str:
+        """Return the title of an entry."""
+        return bytes(self._keys[self._key_offsets[index]:
+                                self._key_offsets[index + 1]]).decode('utf-8')
+
+    def __len__(self) -> int:
+        return self._nentries
+
+    def close(self) -> None:
+        """Release the views over the file and unmap it."""
+        if self._mmap is None:
+            return
+
+        # the map can be closed only when no view over it is left
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self) -> 'TitleIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class _Pages(collections.abc.Mapping):
+    """Map from titles to page ids."""
+
+    def __init__(self, index: TitleIndex) -> None:
+        self._index = index
+
+    def get(self, title: str, default: Any=None) -> Any:
+        entry = self._index.entry(title)
+        return self._index._page_ids[entry] if entry >= 0 else default
+
+    def __getitem__(self, title: str) -> int:
+        entry = self._index.entry(title)
+        if entry < 0:
+            raise KeyError(title)
+        return self._index._page_ids[entry]
+
+    def __contains__(self, title: Any) -> bool:
+        return self._index.entry(title) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for entry in range(len(self._index)):
+            yield self._index.title(entry)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class _Redirects(collections.abc.Mapping):
+    """Map from the titles of redirects to the titles of their targets."""
+
+    def __init__(self, index: TitleIndex) -> None:
+        self._index = index
+
+    def _target(self, title: str) -> int:
+        entry = self._index.entry(title)
+        return self._index._redirects[entry] if entry >= 0 else -1
+
+    def __getitem__(self, title: str) -> str:
+        target = self._target(title)
+        if target < 0:
+            raise KeyError(title)
+        return self._index.title(target)
+
+    def __contains__(self, title: Any) -> bool:
+        return self._target(title) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for entry in range(len(self._index)):
+            if self._index._redirects[entry] >= 0:
+                yield self._index.title(entry)
+
+    def __len__(self) -> int:
+        return sum(1 for target in self._index._redirects if target >= 0)
+
+
+class _RedirectIds(collections.abc.Mapping):
+    """Map from the ids of redirects to the ids of their targets."""
+
+    def __init__(self, index: TitleIndex) -> None:
+        self._index = index
+
+    def _position(self, page_id: int) -> int:
+        sources = self._index._redirect_sources
+        position = bisect.bisect_left(sources, page_id)
+        if position < len(sources) and sources[position] == page_id:
+            return position
+        return -1
+
+    def __getitem__(self, page_id: int) -> int:
+        position = self._position(page_id)
+        if position < 0:
+            raise KeyError(page_id)
+        return self._index._redirect_targets[position]
+
+    def __contains__(self, page_id: Any) -> bool:
+        return self._position(page_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._index._redirect_sources)
+
+    def __len__(self) -> int:
+        return len(self._index._redirect_sources)
+
+
+class NormalizedTitles(collections.abc.Mapping):
+    """View of a title mapping whose keys are normalized with
+       utils.normalize_wikititle before the lookup.
+    """
+
+    def __init__(self, titles: Mapping[str, Any]) -> None:
+        self._titles = titles
+
+    def get(self, title: str, default: Any=None) -> Any:
+        return self._titles.get(utils.normalize_wikititle(title), default)
+
+    def __getitem__(self, title: str) -> Any:
+        return self._titles[utils.normalize_wikititle(title)]
+
+    def __contains__(self, title: Any) -> bool:
+        return utils.normalize_wikititle(title) in self._titles
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._titles)
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+
+def open_index(
+        template: Optional[str],
+        date: Any) -> Optional[TitleIndex]:
+    """Open the title index at template, where {date} is replaced by date
+       (YYYY-MM-DD); return None if template is None.
+    """
+    if template is None:
+        return None
+    return TitleIndex(template.format(date=date.format('YYYY-MM-DD')))
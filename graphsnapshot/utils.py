@@ -1,13 +1,20 @@
 """Various utilities."""
 
+import os
+import sys
+import time
+import bisect
+import datetime
 import functools
 import itertools
-import sys
+from array import array
 
+import arrow
 import more_itertools
+import numpy
 import regex as re
-from typing import (Generic, Iterable, List, NamedTuple, Optional, T, Tuple,
-                    TypeVar)
+from typing import (IO, Generic, Iterable, List, Mapping, NamedTuple, Optional,
+                    T, Tuple, TypeVar)
 
 
 class Diff(NamedTuple("Diff", [("action", str), ("data", T)]), Generic[T]):
@@ -93,6 +100,102 @@ def log(*args):
     print('\n' + str(first), *rest, end='', file=sys.stderr, flush=True)
 
 
+# seconds between two progress reports
+PROGRESS_INTERVAL = 10.0
+
+# lines counted between two reads of the clock
+PROGRESS_CHECK = 1024
+
+
+class Progress:
+    """Count the lines and pages processed and report the throughput on
+       stderr, at most once every interval seconds.
+
+    Counting is cheap, the clock is read once every PROGRESS_CHECK lines.
+    If source, the file on disk that is being read, is given, the reports
+    also have the MB read per second and the ETA.
+    """
+
+    def __init__(self,
+                 description: str='Progress',
+                 source: Optional[IO]=None,
+                 interval: float=PROGRESS_INTERVAL) -> None:
+        self.description = description
+        self.interval = interval
+
+        self.source = source
+        self.total = None
+        if source is not None:
+            try:
+                self.total = os.fstat(source.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                self.source = None
+
+        self.lines = 0
+        self.pages = 0
+
+        self._next_check = PROGRESS_CHECK
+        self._start = time.monotonic()
+        self._last = self._start
+
+    def line(self) -> None:
+        """Count a line."""
+        self.lines += 1
+        if self.lines >= self._next_check:
+            self._check()
+
+    def page(self) -> None:
+        """Count a page."""
+        self.pages += 1
+
+    def _check(self) -> None:
+        self._next_check = self.lines + PROGRESS_CHECK
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(now)
+
+    def _position(self) -> Optional[int]:
+        try:
+            return self.source.tell()
+        except (OSError, ValueError):
+            return None
+
+    def report(self, now: Optional[float]=None) -> None:
+        """Write the current counts and rates to stderr."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = max(now - self._start, 1e-6)
+
+        parts = ['{} lines ({:.0f} lines/s)'
+                 .format(self.lines, self.lines / elapsed)]
+        if self.pages:
+            parts.append('{} pages ({:.0f} pages/s)'
+                         .format(self.pages, self.pages / elapsed))
+
+        position = self._position() if self.source is not None else None
+        if position is not None:
+            mbytes = position / (1024 * 1024)
+            parts.append('{:.1f} MB ({:.1f} MB/s)'
+                         .format(mbytes, mbytes / elapsed))
+            if self.total and position:
+                eta = elapsed * max(self.total - position, 0) / position
+                parts.append('ETA {}'
+                             .format(datetime.timedelta(seconds=int(eta))))
+
+        log('{}: {}'.format(self.description, ', '.join(parts)))
+
+    def close(self) -> None:
+        """Write the final report."""
+        self.report()
+
+    def __enter__(self) -> 'Progress':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
 def remove_comments(source: str) -> str:
     """Remove all the html comments from a string."""
     pattern = re.compile(r'<!--(.*?)-->', re.MULTILINE | re.DOTALL)
@@ -122,6 +225,100 @@ def pairwise(iterable):
     return zip(a, b)
 
 
+def sum_stats(stats_list: Iterable[Optional[Mapping]]) -> dict:
+    """Merge the stats of many runs of a processor.
+
+    Numbers and durations are summed, start times give the earliest and
+    other times the latest, other values are kept if they are the same in
+    all the runs. Elapsed times are not summed, since runs can overlap: they
+    are computed again from the merged start and end times, or else the
+    longest is kept. Missing stats (None) are skipped.
+    """
+    total = dict()
+    for stats in stats_list:
+        if stats is None:
+            continue
+
+        for key, value in stats.items():
+            if key not in total:
+                total[key] = (sum_stats([value])
+                              if isinstance(value, Mapping) else value)
+            elif isinstance(value, Mapping):
+                total[key] = sum_stats([total[key], value])
+            elif isinstance(value, datetime.datetime) or \
+                    key.startswith('elapsed'):
+                if total[key] is None:
+                    total[key] = value
+                elif value is None:
+                    continue
+                elif key.startswith('start'):
+                    total[key] = min(total[key], value)
+                else:
+                    total[key] = max(total[key], value)
+            elif isinstance(value, (int, float, datetime.timedelta)) and \
+                    not isinstance(value, bool):
+                total[key] = (value if total[key] is None
+                              else total[key] + value)
+            elif total[key] != value:
+                total[key] = None
+
+    start_time = total.get('start_time')
+    end_time = total.get('end_time')
+    if isinstance(start_time, datetime.datetime) and \
+            isinstance(end_time, datetime.datetime):
+        for key, value in total.items():
+            if not key.startswith('elapsed'):
+                continue
+            if isinstance(value, datetime.timedelta):
+                total[key] = end_time - start_time
+            elif value is not None:
+                total[key] = (end_time - start_time).seconds
+
+    return total
+
+
+# Timestamps are handled as int epoch seconds, MediaWiki writes them as
+#   * 2001-01-15T13:14:15Z
+# and the processors as
+#   * 2001-01-15T13:14:15+00:00
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S+00:00'
+
+# day of the epoch in the proleptic Gregorian calendar
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def parse_timestamp(value: str) -> int:
+    """Parse a timestamp to epoch seconds.
+
+    UTC timestamps in the formats above are parsed by slicing, any other
+    format is parsed by arrow.
+    """
+    if (len(value) == 20 and value[19] == 'Z') or \
+            (len(value) == 25 and value.endswith('+00:00')):
+        if value[4] == '-' and value[10] == 'T' and value[13] == ':':
+            try:
+                # date() checks the day of the month
+                days = datetime.date(int(value[0:4]),
+                                     int(value[5:7]),
+                                     int(value[8:10])).toordinal()
+                hours = int(value[11:13])
+                minutes = int(value[14:16])
+                seconds = int(value[17:19])
+                if 0 <= hours < 24 and 0 <= minutes < 60 and \
+                        0 <= seconds < 60:
+                    return ((days - EPOCH_ORDINAL) * 86400 +
+                            hours * 3600 + minutes * 60 + seconds)
+            except ValueError:
+                pass
+
+    return arrow.get(value).timestamp
+
+
+def format_timestamp(epoch: int) -> str:
+    """Format epoch seconds as the processors write timestamps."""
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(epoch))
+
+
 # See also:
 # https://en.wikipedia.org/wiki/Help:Link#Conversion_to_canonical_form
 def normalize_wikititle(title: str) -> str:
@@ -132,3 +329,186 @@ def normalize_wikititle(title: str) -> str:
 
     title = title.replace('_', ' ')
     return ' '.join(title.split())
+
+
+class StringArena:
+    """Append-only sequence of strings stored, encoded in UTF-8, in a single
+       bytearray with their offsets in an array('q').
+
+    It takes a fraction of the memory of a list of str.
+    """
+
+    def __init__(self, values: Iterable[str]=()) -> None:
+        self._data = bytearray()
+        self._offsets = array('q', [0])
+        for value in values:
+            self.append(value)
+
+    def append(self, value: str) -> int:
+        """Append a string and return its index."""
+        self._data += value.encode('utf-8')
+        self._offsets.append(len(self._data))
+        return len(self._offsets) - 2
+
+    def __getitem__(self, index: int) -> str:
+        return (self._data[self._offsets[index]:self._offsets[index + 1]]
+                .decode('utf-8'))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __iter__(self) -> Iterable[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class RevisionBuffer:
+    """Revisions of a page kept in compact columns, for the processors that
+       buffer the history of a page.
+
+    The integer values of each revision (ids, timestamp, ...) are stored in
+    parallel array('q') columns, given by name, and its string fields in a
+    StringArena, nfields per revision. A revision takes a few bytes per
+    value and no Python object, so the long history of a page takes a
+    fraction of the memory of a list of records and does not fill the
+    garbage collector generations.
+    """
+
+    __slots__ = ('names', 'columns', 'nfields', 'fields')
+
+    def __init__(self, names: Iterable[str], nfields: int=0) -> None:
+        self.names = tuple(names)
+        self.columns = tuple(array('q') for _ in self.names)
+        self.nfields = nfields
+        self.fields = StringArena()
+
+    def append(self,
+               values: Iterable[int],
+               fields: Iterable[str]=()) -> None:
+        """Append a revision, with a value for each column and nfields
+           fields.
+        """
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        for field in itertools.islice(fields, self.nfields):
+            self.fields.append(field)
+
+    def column(self, name: str) -> array:
+        """Return the column with the given name."""
+        return self.columns[self.names.index(name)]
+
+    def row(self, index: int) -> Tuple[int, ...]:
+        """Return the values of the columns of a revision."""
+        return tuple(column[index] for column in self.columns)
+
+    def field(self, index: int, field: int) -> str:
+        """Return a field of a revision."""
+        return self.fields[index * self.nfields + field]
+
+    def row_fields(self, index: int) -> List[str]:
+        """Return the fields of a revision."""
+        start = index * self.nfields
+        return [self.fields[start + field] for field in range(self.nfields)]
+
+    def select(self, indexes: Iterable[int]) -> 'RevisionBuffer':
+        """Return a new buffer with the given revisions, in the given
+           order.
+        """
+        selected = RevisionBuffer(self.names, self.nfields)
+        for index in indexes:
+            selected.append(self.row(index), self.row_fields(index))
+        return selected
+
+    def sorted(self, name: str) -> 'RevisionBuffer':
+        """Return a new buffer with the revisions sorted by a column, the
+           sort is stable.
+        """
+        return self.select(sorted(range(len(self)),
+                                  key=self.column(name).__getitem__))
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+
+def _sorted_array(values: numpy.ndarray) -> array:
+    """Convert a sorted NumPy array of int64 to an array('q')."""
+    result = array('q')
+    result.frombytes(numpy.ascontiguousarray(values, dtype=numpy.int64)
+                     .tobytes())
+    return result
+
+
+class IntSet:
+    """Immutable set of integers stored in a sorted array('q').
+
+    Membership is tested with a binary search, each element takes 8 bytes
+    instead of the ~60 bytes of an int in a set.
+    """
+
+    def __init__(self, values: Iterable[int]=()) -> None:
+        if not isinstance(values, array):
+            values = array('q', values)
+        self._values = _sorted_array(
+            numpy.unique(numpy.frombuffer(values, dtype=numpy.int64)))
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_left(self._values, value)
+        return i < len(self._values) and self._values[i] == value
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self) -> Iterable[int]:
+        return iter(self._values)
+
+    def any_in_range(self, lo: int, hi: int) -> bool:
+        """Return True if the set has an element in [lo, hi]."""
+        i = bisect.bisect_left(self._values, lo)
+        return i < len(self._values) and self._values[i] <= hi
+
+
+class IntMultiMap:
+    """Immutable mapping from integers to lists of integers stored in two
+       parallel arrays, sorted by key.
+
+    The values of a key are looked up with a binary search and returned in
+    the order in which they were given.
+    """
+
+    def __init__(self, keys: array, values: array) -> None:
+        keys = numpy.frombuffer(keys, dtype=numpy.int64)
+        values = numpy.frombuffer(values, dtype=numpy.int64)
+
+        # stable sort, so that the values of each key keep their order
+        order = numpy.argsort(keys, kind='stable')
+        self._keys = _sorted_array(keys[order])
+        self._values = _sorted_array(values[order])
+
+    def _range(self, key: int) -> Tuple[int, int]:
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        return lo, hi
+
+    def __contains__(self, key: int) -> bool:
+        i = bisect.bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __getitem__(self, key: int) -> array:
+        lo, hi = self._range(key)
+        if lo == hi:
+            raise KeyError(key)
+        return self._values[lo:hi]
+
+    def get(self, key: int, default: Optional[array]=None) -> Optional[array]:
+        lo, hi = self._range(key)
+        if lo == hi:
+            return default
+        return self._values[lo:hi]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def any_in_range(self, lo: int, hi: int) -> bool:
+        """Return True if the mapping has a key in [lo, hi]."""
+        i = bisect.bisect_left(self._keys, lo)
+        return i < len(self._keys) and self._keys[i] <= hi
@@ -35,6 +35,7 @@ setup(
         'mwxml==0.2.0',
         'regex==2018.8.17',
         'more-itertools==6.0.0',
+        'numpy==1.24.4',
         'fuzzywuzzy==0.8.0',
         'python-Levenshtein==0.12.0',
         'requests==2.9.1',